@@ -0,0 +1,924 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+async_crawler.py: the TwitterCrawler operations on asyncio, so that one process keeps every api key (and proxy) busy
+
+Transport: the http layer, request() returns (status_code, headers with lower-case names, body); AiohttpTransport if aiohttp is installed, otherwise RequestsTransport (requests in a thread pool); anything with the same request() (e.g., one pointed at a local fake server) can be passed in instead
+
+AsyncTwitterCrawler: one per api key; the same operations as TwitterCrawler (search_by_query, fetch_user_timeline, fetch_users, lookup_tweets_by_ids, fetch_user_relationships, fetch_retweets) writing the same files; budgets come from the x-rate-limit-* headers (rate_limit.py) and bearer tokens from the on-disk cache (token_cache.py)
+
+AsyncCrawlEngine: one crawler per key; submit(endpoint, operation, *args) waits for the key with the most remaining quota (scheduler.py) and runs the operation as an asyncio task
+
+python async_crawler.py -c config.json -cmd search -cc search.json, the same commands and config files as twitter_tracker.py (geo needs user context and isn't supported)
+'''
+
+import logging
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+requests_log = logging.getLogger("requests")
+requests_log.setLevel(logging.WARNING)
+
+import os, json, time, datetime, argparse, itertools, functools
+import asyncio
+import concurrent.futures
+import requests
+import twython
+from util import md5, chunks, search_querystring
+from exceptions import NotImplemented, MissingArgs, InvalidConfig, MaxRetryReached
+from output_writer import open_writer, shared_writer, close_shared_writers, kept_writer, close_kept_writers, JsonLinesWriter, OUTPUT_FORMATS, SEGMENT_SIZE
+from rate_limit import RateLimitTracker, endpoint_name
+from scheduler import QuotaScheduler, WAIT_TIME
+from token_cache import BearerTokenCache, TOKEN_CACHE_FOLDER, invalid_token
+from proxy_check import check_proxy_twython, proxy_checker
+from snowflake import CandidateSpace
+from dedup_index import DedupIndex, DedupWriter
+from edge_store import EdgePageWriter, shared_edge_writer, close_shared_edge_writers, edges_prefix
+from frontier import BfsFrontier
+from checkpoint import CheckpointJournal, CursorStore
+from relationship_diff import RelationshipStore, relationship_ids, output_files
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+API_URL = 'https://api.twitter.com'
+MAX_RETRY_CNT = 3
+RETRY_WAIT = 10 # seconds after a failed call
+TIMEOUT = 30
+MAX_CONNECTIONS = 100
+
+class Transport(object):
+
+    async def request(self, method, url, params = None, data = None, headers = None, proxy = None, timeout = TIMEOUT):
+        '''
+        (status_code, headers with lower-case names, body as text)
+        '''
+        raise NotImplemented('%s.request'%self.__class__.__name__)
+
+    async def close(self):
+        pass
+
+class RequestsTransport(Transport):
+    '''
+    blocking requests calls in a thread pool; one pooled session, so connections are kept alive between calls
+    '''
+    def __init__(self, max_connections = MAX_CONNECTIONS):
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections)
+
+    def _request(self, method, url, params, data, headers, proxy, timeout):
+
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+
+        response = self.session.request(method, url, params=params, data=data, headers=headers, proxies=proxies, timeout=timeout)
+
+        return response.status_code, dict((k.lower(), v) for k, v in response.headers.items()), response.text
+
+    async def request(self, method, url, params = None, data = None, headers = None, proxy = None, timeout = TIMEOUT):
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, functools.partial(self._request, method, url, params, data, headers, proxy, timeout))
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+class AiohttpTransport(Transport):
+
+    def __init__(self, max_connections = MAX_CONNECTIONS):
+
+        if not aiohttp:
+            raise InvalidConfig('aiohttp is not installed')
+
+        self.max_connections = max_connections
+        self.session = None
+
+    async def request(self, method, url, params = None, data = None, headers = None, proxy = None, timeout = TIMEOUT):
+
+        # created lazily, a ClientSession has to be created inside the running loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+
+        async with self.session.request(method, url, params=params, data=data, headers=headers, proxy=proxy, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            body = await response.text()
+
+            return response.status, dict((k.lower(), v) for k, v in response.headers.items()), body
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+def default_transport(max_connections = MAX_CONNECTIONS):
+    return AiohttpTransport(max_connections) if aiohttp else RequestsTransport(max_connections)
+
+class AsyncTwitterCrawler(object):
+
+    def __init__(self, apikeys, transport, output_folder = './data', proxy = None, api_url = API_URL, rate_limits = None, token_cache = TOKEN_CACHE_FOLDER, output_format = 'json', segment_size = SEGMENT_SIZE, segment_interval = None, timeout = TIMEOUT, dedup_index = None, relationships_format = 'json', relationships_diff = None):
+
+        if not apikeys:
+            raise MissingArgs('apikeys is missing')
+
+        self.app_key = apikeys['app_key']
+        self.app_secret = apikeys['app_secret']
+
+        self.transport = transport
+        self.proxy = proxy
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+
+        self.output_folder = output_folder
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        self.output_format = output_format
+        self.segment_size = segment_size
+        self.segment_interval = segment_interval
+
+        # tweets already in the index are dropped (see dedup_index.py); the engine is one process, so every crawler shares it
+        self.dedup_index = dedup_index
+
+        # json (output_format) or edges, for /friends/ids and /followers/ids (see edge_store.py)
+        self.relationships_format = relationships_format
+
+        # folder of a RelationshipStore (see relationship_diff.py), the ids calls then only keep what changed since the last crawl
+        self.relationships_diff = relationships_diff
+
+        self.rate_limits = RateLimitTracker(self.app_key, rate_limits)
+        self.token_cache = BearerTokenCache(token_cache)
+        self.access_token = None
+
+        self.calls = 0
+        self.tweets = 0
+
+    def open_output(self, filename, mode='a', keep=False):
+        '''
+        keep: a file written again on every pass (a search, a timeline) stays open, compressed output goes on in the same segment (see output_writer.kept_writer)
+        '''
+        if keep:
+            writer = kept_writer(filename, self.output_format, segment_size=self.segment_size, segment_interval=self.segment_interval)
+        else:
+            writer = open_writer(filename, self.output_format, mode=mode, segment_size=self.segment_size, segment_interval=self.segment_interval)
+        return DedupWriter(writer, self.dedup_index) if self.dedup_index is not None else writer
+
+    async def authorize(self, renew = False):
+        '''
+        the bearer token from the cache (fetched in a thread, it goes through twython); renew drops the current one first
+        '''
+        if renew:
+            self.token_cache.invalidate(self.app_key, self.access_token)
+
+        client_args = {'timeout': self.timeout}
+        if self.proxy:
+            client_args['proxies'] = {'http': self.proxy, 'https': self.proxy}
+
+        loop = asyncio.get_running_loop()
+        self.access_token = await loop.run_in_executor(None, functools.partial(self.token_cache.get, self.app_key, self.app_secret, client_args = client_args, api_url = self.api_url))
+
+    async def request(self, endpoint, method = 'GET', params = None):
+        '''
+        waits while the budget of endpoint is used up, records the x-rate-limit-* headers, retries 429s after the reset and a 401 rejecting the token once with a new one; raises twython exceptions like TwitterCrawler does
+        '''
+        api = endpoint_name(endpoint)
+        url = '%s/1.1/%s.json'%(self.api_url, endpoint)
+
+        params = dict((k, ','.join('%s'%x for x in v) if isinstance(v, (list, tuple, set, range)) else '%s'%v) for k, v in (params or {}).items() if v is not None)
+
+        renewed = False
+        while True:
+            wait_for = self.rate_limits.wait_for(api)
+            if wait_for > 0:
+                logger.warn('[%s] rate limit of [%s] used up, sleep for %d'%(self.app_key, api, wait_for))
+                await asyncio.sleep(wait_for)
+
+            if not self.access_token:
+                await self.authorize()
+
+            headers = {'Authorization': 'Bearer %s'%self.access_token}
+
+            if method == 'GET':
+                status_code, response_headers, body = await self.transport.request(method, url, params=params, headers=headers, proxy=self.proxy, timeout=self.timeout)
+            else:
+                status_code, response_headers, body = await self.transport.request(method, url, data=params, headers=headers, proxy=self.proxy, timeout=self.timeout)
+
+            self.calls += 1
+            self.rate_limits.record(api, response_headers, status_code)
+
+            if status_code == 429:
+                continue
+
+            if status_code == 401 and not renewed and invalid_token(body):
+                logger.warn('[%s] bearer token rejected, renewing it'%self.app_key)
+                renewed = True
+                await self.authorize(renew = True)
+                continue
+
+            if status_code in (401, 403):
+                raise twython.exceptions.TwythonAuthError('[%s] %s'%(endpoint, body), error_code=status_code)
+
+            if status_code != 200:
+                raise twython.exceptions.TwythonError('[%s] %s'%(endpoint, body), error_code=status_code)
+
+            return json.loads(body)
+
+    def day_output_folder(self, now, place = None):
+
+        if place:
+            day_output_folder = os.path.abspath('%s/%s/%s'%(self.output_folder, now.strftime('%Y%m%d'), place))
+        else:
+            day_output_folder = os.path.abspath('%s/%s'%(self.output_folder, now.strftime('%Y%m%d')))
+
+        if not os.path.exists(day_output_folder):
+            os.makedirs(day_output_folder)
+
+        return day_output_folder
+
+    async def search_by_query(self, query, since_id = 0, geocode = None, lang = None, now = None, output_filename = None):
+        '''
+        call: /search/tweets; pages back from the newest tweet to since_id, returns the new since_id
+        '''
+        if not query:
+            raise Exception("search: query cannot be None")
+
+        now = now if now else datetime.datetime.now()
+
+        place, geo = geocode if geocode else (None, None)
+        day_output_folder = self.day_output_folder(now, place)
+
+        filename = os.path.abspath('%s/%s'%(day_output_folder, output_filename if output_filename else int(time.time())))
+
+        current_max_id = 0
+        current_since_id = since_id
+        cnt = 0
+
+        with self.open_output(filename, keep=True) as wf:
+            retry_cnt = MAX_RETRY_CNT
+            while retry_cnt > 0:
+                try:
+                    tweets = await self.request('search/tweets', params={'q': query, 'geocode': geo, 'since_id': since_id, 'lang': lang, 'max_id': current_max_id - 1 if current_max_id > 0 else None, 'result_type': 'recent', 'count': 100})
+                except Exception as exc:
+                    logger.error("exception: %s"%exc)
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        return since_id
+
+                    await asyncio.sleep(RETRY_WAIT)
+                    continue
+
+                prev_max_id = current_max_id
+
+                wf.write_records(tweets['statuses'])
+                for tweet in tweets['statuses']:
+                    if current_max_id == 0 or current_max_id > int(tweet['id']):
+                        current_max_id = int(tweet['id'])
+                    if current_since_id == 0 or current_since_id < int(tweet['id']):
+                        current_since_id = int(tweet['id'])
+
+                #no new tweets found
+                if (prev_max_id == current_max_id):
+                    break
+
+                cnt += len(tweets['statuses'])
+
+        self.tweets += cnt
+        logger.info("[%s]; since_id: [%d]; total tweets: %d "%(query, since_id, cnt))
+        return current_since_id
+
+    async def fetch_user_timeline(self, user_id = None, now = None, since_id = 1):
+        '''
+        call: /statuses/user_timeline; returns (since_id, remove), remove is True if the timeline kept failing (e.g., protected or suspended)
+        '''
+        if not user_id:
+            raise Exception("user_timeline: user_id cannot be None")
+
+        now = now if now else datetime.datetime.now()
+
+        filename = os.path.abspath('%s/%s'%(self.day_output_folder(now), user_id))
+
+        current_max_id = 0
+        current_since_id = since_id
+        cnt = 0
+
+        with self.open_output(filename, keep=True) as wf:
+            retry_cnt = MAX_RETRY_CNT
+            while retry_cnt > 0:
+                try:
+                    tweets = await self.request('statuses/user_timeline', params={'user_id': user_id, 'since_id': since_id, 'max_id': current_max_id - 1 if current_max_id > 0 else None, 'count': 200})
+                except Exception as exc:
+                    logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        return since_id, True
+
+                    await asyncio.sleep(RETRY_WAIT)
+                    continue
+
+                prev_max_id = current_max_id
+
+                wf.write_records(tweets)
+                for tweet in tweets:
+                    if current_max_id == 0 or current_max_id > int(tweet['id']):
+                        current_max_id = int(tweet['id'])
+                    if current_since_id == 0 or current_since_id < int(tweet['id']):
+                        current_since_id = int(tweet['id'])
+
+                #no new tweets found
+                if (prev_max_id == current_max_id):
+                    break
+
+                cnt += len(tweets)
+
+        self.tweets += cnt
+        logger.info("[%s] total tweets: %d; since_id: [%d]"%(user_id, cnt, since_id))
+        return current_since_id, False
+
+    async def fetch_users(self, parameter = 'screen_name', parameter_values = [], filename = None):
+        '''
+        call: /users/lookup (at most 100 per call)
+        '''
+        if not parameter_values:
+            raise Exception("users/lookup: parameter_values cannot be empty")
+
+        if len(parameter_values) > 100:
+            raise Exception("users/lookup: parameter_values cannot exceed 100 elements")
+
+        filename = os.path.abspath('%s/%s'%(self.output_folder, filename if filename else datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+
+        retry_cnt = MAX_RETRY_CNT
+        while retry_cnt > 0:
+            try:
+                result = await self.request('users/lookup', method='POST', params={parameter: parameter_values})
+            except Exception as exc:
+                logger.error("exception: %s; when fetching users"%(exc))
+                retry_cnt -= 1
+                if (retry_cnt == 0):
+                    logger.warn("exceed max retry... return")
+                    return 0
+
+                await asyncio.sleep(RETRY_WAIT)
+                continue
+
+            if (result):
+                with open(filename, 'a+') as f:
+                    f.write('%s\n'%json.dumps(result))
+
+            return len(result)
+
+    async def lookup_tweets_by_ids(self, tweets_id = None, now = None):
+        '''
+        call: /statuses/lookup (at most 100 per call); ids that don't exist (anymore) are just missing from the result; None if the lookup never got a response
+        '''
+        if not tweets_id:
+            raise Exception("tweets_history: tweets_id cannot be None")
+
+        now = now if now else datetime.datetime.now()
+
+        retry_cnt = MAX_RETRY_CNT
+        while retry_cnt > 0:
+            try:
+                tweets = await self.request('statuses/lookup', method='POST', params={'id': list(tweets_id)})
+                break
+            except Exception as exc:
+                logger.error("exception: %s; when fetching tweet_id: %d"%(exc, tweets_id[0]))
+                retry_cnt -= 1
+                if (retry_cnt == 0):
+                    logger.warn("exceed max retry... return")
+                    return None
+
+                await asyncio.sleep(RETRY_WAIT)
+
+        if tweets:
+            if (self.output_format == 'json'):
+                filename = os.path.abspath('%s/%s.json'%(self.output_folder, now.strftime('%Y%m%d')))
+            else:
+                filename = os.path.abspath('%s/%s'%(self.output_folder, now.strftime('%Y%m%d')))
+
+            # every crawler of the engine appends to the same open day file, one chunk per response
+            wf = shared_writer(filename, self.output_format, segment_size=self.segment_size, segment_interval=self.segment_interval)
+            if self.dedup_index is not None:
+                wf = DedupWriter(wf, self.dedup_index)
+            wf.write_records(tweets)
+            wf.flush()
+
+        self.tweets += len(tweets)
+        logger.info("total tweets: %d; since_id: [%d]"%(len(tweets), tweets_id[0]))
+        return len(tweets)
+
+    async def fetch_user_relationships(self, user_id = None, call = '/friends/ids', now = None, cursor_folder = None):
+        '''
+        call: /friends/ids, /friends/list, /followers/ids, and /followers/list; follows next_cursor to the end, saving it after every page in cursor_folder if given (see checkpoint.CursorStore)
+        '''
+        if not user_id:
+            raise Exception("user_relationship: user_id cannot be None")
+
+        if call not in ('/friends/ids', '/friends/list', '/followers/ids', '/followers/list'):
+            raise Exception("user_relationship: unknown call [%s]"%call)
+
+        now = now if now else datetime.datetime.now()
+
+        filename = os.path.abspath('%s/%s'%(self.day_output_folder(now), user_id))
+
+        key = 'ids' if call.endswith('/ids') else 'users'
+        count = 5000 if key == 'ids' else 200
+
+        cursor = -1
+        cnt = 0
+        mode = 'w'
+
+        cursors = CursorStore(cursor_folder) if cursor_folder else None
+        state = cursors.get(call, user_id) if cursors else None
+
+        if state:
+            if cursors.done(state):
+                return state['cnt']
+
+            # as twitter_tracker.py does: back to the file and size of the last saved cursor
+            cursor, cnt, filename, mode = state['cursor'], state['cnt'], state['filename'], 'a'
+            if state.get('size') is not None and os.path.exists(filename) and os.path.getsize(filename) > state['size']:
+                with open(filename, 'r+') as f:
+                    f.truncate(state['size'])
+
+            logger.info("[%s] [%s] resuming at cursor [%d] after %d"%(user_id, call, cursor, cnt))
+
+        if self.relationships_format == 'edges' and key == 'ids':
+            output = EdgePageWriter(shared_edge_writer(edges_prefix(self.day_output_folder(now), call)), user_id)
+        else:
+            output = self.open_output(filename, mode=mode)
+
+        with output as wf:
+            retry_cnt = MAX_RETRY_CNT
+            while cursor != 0 and retry_cnt > 0:
+                try:
+                    result = await self.request(call.strip('/'), params={'user_id': user_id, 'cursor': cursor, 'count': count})
+                except Exception as exc:
+                    logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        if cursors:
+                            cursors.give_up(call, user_id, {'cursor': cursor, 'cnt': cnt, 'filename': filename, 'size': None})
+                        return cnt
+
+                    await asyncio.sleep(RETRY_WAIT)
+                    continue
+
+                cnt += len(result[key])
+                cursor = result['next_cursor']
+                wf.write(result)
+
+                if cursors:
+                    wf.flush()
+                    cursors.save(call, user_id, {'cursor': cursor, 'cnt': cnt, 'filename': filename, 'size': os.path.getsize(filename) if isinstance(output, JsonLinesWriter) else None})
+
+        logger.info("[%s] total [%s]: %d; "%(user_id, call, cnt))
+
+        if self.relationships_diff and key == 'ids' and not isinstance(output, EdgePageWriter):
+            RelationshipStore(self.relationships_diff).update(call, user_id, relationship_ids(filename))
+            for f in output_files(filename):
+                os.remove(f)
+
+        return cnt
+
+    async def fetch_retweets(self, tweet_id = None, now = None):
+        '''
+        call: /statuses/retweets/:id; returns the ids of the retweets
+        '''
+        if not tweet_id:
+            raise Exception("retweet: retweet_id cannot be None")
+
+        now = now if now else datetime.datetime.now()
+
+        filename = os.path.abspath('%s/%s'%(self.day_output_folder(now), tweet_id))
+
+        retweet_ids = set()
+
+        retry_cnt = MAX_RETRY_CNT
+        while retry_cnt > 0:
+            try:
+                result = await self.request('statuses/retweets/%d'%tweet_id, params={'count': 100, 'trim_user': 1})
+            except Exception as exc:
+                logger.error("exception: %s; when fetching tweet_id: %d"%(exc, tweet_id))
+                retry_cnt -= 1
+                if (retry_cnt == 0):
+                    logger.warn("exceed max retry... return")
+                    break
+
+                await asyncio.sleep(RETRY_WAIT)
+                continue
+
+            logger.info("find %d retweets of [%d]"%(len(result), tweet_id))
+            retweet_ids.update(tweet['id'] for tweet in result)
+            self.tweets += len(result)
+
+            with open(filename, 'w') as f:
+                if result:
+                    f.write('%s\n'%json.dumps(result))
+
+            break
+
+        return retweet_ids
+
+def select_proxy(available, apikey_proxy_pairs_dict, timeout = 5, api_url = None):
+    '''
+    the first proxy of available that passes check_proxy_twython (as a url), None without proxies
+    '''
+    for proxy in apikey_proxy_pairs_dict[available]['proxies']:
+        passed, proxy = check_proxy_twython(proxy['proxy'], timeout, api_url)
+        if passed:
+            logger.info('[%s] is alive'%proxy)
+            return proxy['proxy_dict']['http']
+
+        logger.warn('proxy failed, retry next one')
+
+    if apikey_proxy_pairs_dict[available]['proxies']:
+        raise Exception('[%s]: none of the proxies is alive'%available)
+
+    return None
+
+class AsyncCrawlEngine(object):
+
+    def __init__(self, apikey_proxy_pairs_dict, output_folder, transport = None, wait_time = WAIT_TIME, **crawler_kwargs):
+
+        self.apikey_proxy_pairs_dict = apikey_proxy_pairs_dict
+        self.output_folder = output_folder
+        self.transport = transport if transport else default_transport()
+        self.crawler_kwargs = crawler_kwargs
+
+        # a plain dict: every crawler lives in this process
+        self.scheduler = QuotaScheduler(apikey_proxy_pairs_dict, rate_limits = {}, wait_time = wait_time)
+
+        self.crawlers = {}
+        self._released = None
+
+    async def start(self):
+        '''
+        one crawler per key; the proxies are checked concurrently
+        '''
+        self._released = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+        keys = list(self.apikey_proxy_pairs_dict.keys())
+        proxies = await asyncio.gather(*[loop.run_in_executor(None, select_proxy, available, self.apikey_proxy_pairs_dict, 5, self.crawler_kwargs.get('api_url')) for available in keys], return_exceptions = True)
+
+        for available, proxy in zip(keys, proxies):
+            if isinstance(proxy, Exception):
+                logger.error(proxy)
+                continue
+
+            self.crawlers[available] = AsyncTwitterCrawler(self.apikey_proxy_pairs_dict[available]['apikeys'], self.transport, self.output_folder, proxy = proxy, rate_limits = self.scheduler.rate_limits, **self.crawler_kwargs)
+
+        if not self.crawlers:
+            raise InvalidConfig('no usable api key')
+
+        self.scheduler.retain(list(self.crawlers.keys()))
+        logger.info("concurrent keys: [%d]"%(len(self.crawlers)))
+
+    async def acquire(self, endpoint):
+
+        while True:
+            self._released.clear()
+
+            available, wait_for = self.scheduler.try_acquire(endpoint)
+            if available:
+                return available
+
+            try:
+                await asyncio.wait_for(self._released.wait(), wait_for)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, available):
+        self.scheduler.release(available)
+        self._released.set()
+
+    async def _run(self, available, operation, args, kwargs):
+        try:
+            return await getattr(self.crawlers[available], operation)(*args, **kwargs)
+        except Exception as exc:
+            logger.error('[%s] %s: %s'%(available, operation, exc))
+            return None
+        finally:
+            self.release(available)
+
+    async def submit(self, endpoint, operation, *args, **kwargs):
+        '''
+        waits for a key that can call endpoint, then runs operation (an AsyncTwitterCrawler method name) on its crawler; returns the asyncio task, whose result is None if the operation raised
+        '''
+        available = await self.acquire(endpoint)
+
+        return asyncio.ensure_future(self._run(available, operation, args, kwargs))
+
+    def stats(self):
+        return {
+            'keys': len(self.crawlers),
+            'calls': sum(crawler.calls for crawler in self.crawlers.values()),
+            'tweets': sum(crawler.tweets for crawler in self.crawlers.values()),
+            'dispatched': dict(self.scheduler.dispatched)
+        }
+
+    async def close(self):
+        await self.transport.close()
+        close_shared_writers()
+        close_kept_writers()
+        close_shared_edge_writers()
+
+async def collect_tweets_by_search_terms(engine, search_configs_filename, output_folder, rounds = 0):
+    '''
+    cycles through the searches (forever if rounds is 0), as many in flight as there are keys
+    '''
+    # as in twitter_tracker.py: only the since_id of a finished search goes to the journal, search.json (and <day>/search.json) are rewritten on compaction
+    checkpoint = CheckpointJournal(search_configs_filename, day_folder = output_folder, day_name = 'search.json')
+    search_configs = checkpoint.configs
+
+    def done(task, search_config_id, now):
+        since_id = task.result()
+        if since_id is not None:
+            checkpoint.update(search_config_id, {'since_id': since_id}, now)
+
+    try:
+        tasks = []
+        search_config_ids = itertools.cycle(search_configs) if not rounds else [search_config_id for _ in range(rounds) for search_config_id in search_configs]
+        for search_config_id in search_config_ids:
+            search_config = search_configs[search_config_id]
+
+            search_terms = [term.lower() for term in search_config['terms']]
+            querystring = search_querystring(search_terms)
+
+            search_config['querystring'] = querystring
+            search_config['output_filename'] = search_config['output_filename'] if 'output_filename' in search_config else md5(querystring.encode('utf-8'))
+            search_config['geocode'] = tuple(search_config['geocode']) if ('geocode' in search_config and search_config['geocode']) else None
+            since_id = search_config['since_id'] if 'since_id' in search_config else 0
+
+            now = datetime.datetime.now()
+            task = await engine.submit('/search/tweets', 'search_by_query', querystring, since_id = since_id, geocode = search_config['geocode'], now = now, output_filename = search_config['output_filename'])
+            task.add_done_callback(functools.partial(done, search_config_id = search_config_id, now = now))
+
+            tasks = [t for t in tasks if not t.done()] + [task]
+
+        await asyncio.gather(*tasks)
+    finally:
+        checkpoint.close()
+
+async def collect_tweets_by_user_ids(engine, users_config_filename, output_folder, rounds = 0):
+
+    checkpoint = CheckpointJournal(users_config_filename, day_folder = output_folder, day_name = 'users.json')
+    users_config = checkpoint.configs
+
+    def done(task, user_config_id, now):
+        result = task.result()
+        if result is not None:
+            since_id, remove = result
+            checkpoint.update(user_config_id, {'since_id': since_id, 'remove': remove}, now)
+
+    try:
+        tasks = []
+        user_config_ids = itertools.cycle(users_config) if not rounds else [user_config_id for _ in range(rounds) for user_config_id in users_config]
+        for user_config_id in user_config_ids:
+            user_config = users_config[user_config_id]
+            if ('remove' in user_config and user_config['remove']):
+                if not rounds and all(users_config[u].get('remove') for u in users_config):
+                    break
+                continue
+
+            now = datetime.datetime.now()
+            task = await engine.submit('/statuses/user_timeline', 'fetch_user_timeline', user_config['user_id'], now = now, since_id = user_config['since_id'] if 'since_id' in user_config else 1)
+            task.add_done_callback(functools.partial(done, user_config_id = user_config_id, now = now))
+
+            tasks = [t for t in tasks if not t.done()] + [task]
+
+        await asyncio.gather(*tasks)
+    finally:
+        checkpoint.close()
+
+async def collect_users(engine, parameter, users_config_filename):
+
+    with open(os.path.abspath(users_config_filename), 'r') as users_config_rf:
+        users_config = list(set(json.load(users_config_rf)))
+
+    tasks = []
+    for chunk in chunks(users_config, 100):
+        filename = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        tasks.append(await engine.submit('/users/lookup', 'fetch_users', parameter, chunk, filename))
+
+    await asyncio.gather(*tasks)
+
+async def collect_user_relationships_by_user_ids(engine, call, user_ids_config_filename, cursor_folder = None):
+    '''
+    resumable the same way as twitter_tracker.py: the cursors are in <user_ids_config_filename>.cursors until every user is done or given up (or checkpoint.MAX_PASSES passes)
+    '''
+    with open(os.path.abspath(user_ids_config_filename), 'r') as user_ids_config_rf:
+        user_ids = set(json.load(user_ids_config_rf))
+
+    cursor_folder = cursor_folder if cursor_folder else '%s.cursors'%os.path.abspath(user_ids_config_filename)
+    cursors = CursorStore(cursor_folder)
+    run = cursors.begin(call)
+
+    logger.info("tracking [%d] users' [%s]; crawl [%s], pass [%d]"%(len(user_ids), call, run['run'], run['passes'] + 1))
+
+    tasks = []
+    for user_id in user_ids:
+        if cursors.done(cursors.get(call, user_id)):
+            continue
+
+        tasks.append(await engine.submit(call, 'fetch_user_relationships', user_id, call, now = datetime.datetime.now(), cursor_folder = cursor_folder))
+
+    await asyncio.gather(*tasks)
+
+    given_up = cursors.end_pass(call, user_ids)
+    if given_up is None:
+        logger.warn("[%s] unfinished users are kept in [%s], run again to resume them"%(call, cursor_folder))
+    elif given_up:
+        logger.warn("[%s] gave up on [%d] users: %s"%(call, len(given_up), given_up[:100]))
+
+async def collect_retweets_by_tweets_ids(engine, tweets_ids, level = 1, frontier_folder = None):
+    '''
+    level by level, on a frontier on disk (see frontier.py): every new retweet found on one level is looked up on the next, a restart resumes the level it stopped at; level <= 0: until no new retweets are found
+    '''
+    frontier = BfsFrontier(frontier_folder if frontier_folder else '%s/retweets.frontier'%engine.output_folder)
+    if frontier.finished:
+        logger.info('[%s] the last crawl is finished, starting over'%frontier.folder)
+        frontier.reset()
+
+    frontier.seed(tweets_ids)
+
+    def done(tweet_id, task):
+        # a failed lookup (None) stays pending
+        if task.result() is not None:
+            frontier.done(tweet_id, task.result())
+
+    try:
+        retry_cnt = MAX_RETRY_CNT
+        while level <= 0 or frontier.level < level:
+            tweets_ids = frontier.pending()
+            logger.info("[RETWEETS]: [%d] tweets on level %s"%(len(tweets_ids), frontier.level))
+
+            tasks = []
+            for tweet_id in tweets_ids:
+                task = await engine.submit('/statuses/retweets/:id', 'fetch_retweets', tweet_id, now = datetime.datetime.now())
+                task.add_done_callback(functools.partial(done, tweet_id))
+                tasks.append(task)
+
+            await asyncio.gather(*tasks)
+
+            tweets_ids = frontier.pending()
+            if tweets_ids:
+                retry_cnt -= 1
+                if retry_cnt > 0:
+                    continue
+
+                logger.warn("exceed max retry... giving up on [%d] tweets"%len(tweets_ids))
+                for tweet_id in tweets_ids:
+                    frontier.done(tweet_id)
+
+            retry_cnt = MAX_RETRY_CNT
+            if not frontier.next_level():
+                break
+        else:
+            frontier.finish()
+
+        logger.info("[RETWEETS]: %s"%json.dumps(frontier.stats()))
+    finally:
+        frontier.close()
+
+async def collect_tweets_by_ids(engine, tweets_config_filename):
+    '''
+    lookups of tweets_config['range'] ids (or snowflake candidates) from current_id to end; current_id, probed and hits are saved after each batch (one lookup per key)
+    '''
+    with open(os.path.abspath(tweets_config_filename), 'r') as tweets_config_rf:
+        tweets_config = json.load(tweets_config_rf)
+
+    batch = len(engine.crawlers)
+    current_id = tweets_config['current_id']
+
+    # with a snowflake entry, current_id and end index the plausible ids of a time window (see snowflake.py)
+    space = CandidateSpace.from_config(tweets_config['snowflake']) if tweets_config.get('snowflake') else None
+    end = tweets_config.get('end', len(space) - 1) if space else tweets_config['end']
+
+    while(current_id <= end):
+        next_point = current_id + batch * tweets_config['range']
+
+        starts = list(range(current_id, min(next_point, end + 1), tweets_config['range']))
+
+        tasks, probed = [], []
+        for start in starts:
+            stop = min(start + tweets_config['range'], end + 1)
+            tweets_id = space.ids(start, stop) if space else range(start, stop)
+            probed.append(len(tweets_id))
+            tasks.append(await engine.submit('/statuses/lookup', 'lookup_tweets_by_ids', tweets_id, now = datetime.datetime.now()))
+
+        # current_id only moves past the lookups that got a response, so a restart never skips ids
+        failed = None
+        for start, n, cnt in zip(starts, probed, await asyncio.gather(*tasks)):
+            if cnt is None:
+                failed = start
+                break
+
+            tweets_config['probed'] = tweets_config.get('probed', 0) + n
+            tweets_config['hits'] = tweets_config.get('hits', 0) + cnt
+
+        current_id = next_point if failed is None else failed
+        tweets_config['current_id'] = current_id
+
+        tmp_filename = '%s.tmp'%os.path.abspath(tweets_config_filename)
+        with open(tmp_filename, 'w') as tweets_config_wf:
+            json.dump(tweets_config, tweets_config_wf)
+
+        os.replace(tmp_filename, os.path.abspath(tweets_config_filename))
+
+        if failed is not None:
+            raise MaxRetryReached('the lookup at [%d] failed'%failed)
+
+async def run(command, command_config, output_folder, apikey_proxy_pairs_dict, level = 3, **engine_kwargs):
+
+    engine = AsyncCrawlEngine(apikey_proxy_pairs_dict, output_folder, **engine_kwargs)
+
+    try:
+        await engine.start()
+
+        if (command == 'search'):
+            await collect_tweets_by_search_terms(engine, command_config, output_folder)
+        elif (command == 'timeline'):
+            await collect_tweets_by_user_ids(engine, command_config, output_folder)
+        elif (command in ['users_by_user_id', 'users_by_screen_name']):
+            await collect_users(engine, command[len('users_by_'):], command_config)
+        elif (command in ['/friends/ids', '/friends/list', '/followers/ids', '/followers/list']):
+            await collect_user_relationships_by_user_ids(engine, command, command_config)
+        elif (command == '/statuses/retweets/:id'):
+            with open(os.path.abspath(command_config), 'r') as tweets_ids_rf:
+                tweets_ids = set(json.load(tweets_ids_rf))
+            await collect_retweets_by_tweets_ids(engine, tweets_ids, level, '%s.frontier'%os.path.abspath(command_config))
+        elif (command == 'history'):
+            await collect_tweets_by_ids(engine, command_config)
+        else:
+            raise NotImplemented('command [%s] is not supported'%command)
+    finally:
+        logger.info(engine.stats())
+        await engine.close()
+
+if __name__=="__main__":
+    from twitter_tracker import apikey_proxy_pairs
+
+    formatter = logging.Formatter('(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+    handler = logging.handlers.RotatingFileHandler(
+        'async_crawler.log', maxBytes=50 * 1024 * 1024, backupCount=10)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help="config.json that contains twitter api keys;", default="./config.json")
+    parser.add_argument('-p', '--proxies', help="the proxies.json file", default=None)
+    parser.add_argument('-o','--output', help="output folder data", default="./data/")
+    parser.add_argument('-cmd','--command', help="search, timeline, users_by_user_id, users_by_screen_name, /friends/ids, /friends/list, /followers/ids, /followers/list, /statuses/retweets/:id or history", default="search")
+    parser.add_argument('-cc','--command_config', help="existing progress data", default="search.json")
+    parser.add_argument('-l','--level', help = "typing a int to indicate how many layer of retweets you want to fetch", type = int, default = 3)
+    parser.add_argument('-wait','--wait_time', help="wait time to check available api keys", type=int, default=WAIT_TIME)
+    parser.add_argument('-t','--transport', help="http transport: aiohttp or requests (default: aiohttp if it's installed)", choices=['aiohttp', 'requests'], default=None)
+    parser.add_argument('-mc','--max_connections', help="open connections (and, for requests, threads)", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument('-f','--format', help="output format: %s"%(', '.join(OUTPUT_FORMATS)), choices=OUTPUT_FORMATS, default='json')
+    parser.add_argument('-ss','--segment_size', help="segment size in MB for compressed output", type=int, default=SEGMENT_SIZE // (1024 * 1024))
+    parser.add_argument('-si','--segment_interval', help="also rotate a compressed segment after this many seconds (0: by size only)", type=int, default=0)
+    parser.add_argument('-tc','--token_cache', help="folder of the bearer token cache", default=TOKEN_CACHE_FOLDER)
+    parser.add_argument('-api','--api_url', help="base url of the api, e.g., a fake_twitter.py server", default=API_URL)
+    parser.add_argument('-rf','--relationships_format', help="output of /friends/ids and /followers/ids: json (the -f format) or edges (a binary edge store, see edge_store.py)", choices=['json', 'edges'], default='json')
+    parser.add_argument('-rd','--relationships_diff', help="folder of the follower/friend histories (see relationship_diff.py): /friends/ids and /followers/ids (not -rf edges) only keep the ids added and removed since the last crawl of a user", default=None)
+    parser.add_argument('-di','--dedup_index', help="folder of a dedup index (see dedup_index.py); tweets already in it are dropped", default=None)
+
+    args = parser.parse_args()
+
+    with open(os.path.abspath(args.config), 'r') as config_f:
+        config = json.load(config_f)
+
+    proxies = []
+    if args.proxies:
+        with open(os.path.abspath(args.proxies), 'r') as proxy_f:
+            proxies = proxy_checker(json.load(proxy_f), args.api_url)
+            logger.info("there are [%d] live proxies"%len(proxies))
+
+    if args.transport == 'aiohttp':
+        transport = AiohttpTransport(args.max_connections)
+    elif args.transport == 'requests':
+        transport = RequestsTransport(args.max_connections)
+    else:
+        transport = default_transport(args.max_connections)
+
+    dedup_index = DedupIndex(args.dedup_index) if args.dedup_index else None
+
+    try:
+        # without proxies every key is used directly (twitter_tracker.py only uses one key then, one process can't tell them apart)
+        apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies) if proxies else dict((apikeys_name, {'apikeys': config['apikeys'][apikeys_name], 'proxies': []}) for apikeys_name in config['apikeys'])
+
+        asyncio.run(run(args.command, args.command_config, args.output, apikey_proxy_pairs_dict, level = args.level, transport = transport, wait_time = args.wait_time, output_format = args.format, segment_size = args.segment_size * 1024 * 1024, segment_interval = args.segment_interval if args.segment_interval > 0 else None, token_cache = args.token_cache, api_url = args.api_url, dedup_index = dedup_index, relationships_format = args.relationships_format, relationships_diff = args.relationships_diff))
+    except KeyboardInterrupt:
+        logger.warn('You pressed Ctrl+C!')
+    finally:
+        if dedup_index is not None:
+            dedup_index.close()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+checkpoint.py: progress of the search and timeline configs (since_id, remove, ...) without rewriting the whole -cc file after every task
+
+CheckpointJournal: configs is the dict from the json file (e.g., search.json, users.json) with the journal (<filename>.journal, one [config_id, changes] json line per update) replayed on top; update() only appends the fields of one config that changed; compact() writes the json file back in the same format (atomically), a copy to <day_folder>/<%Y%m%d>/<day_name> if given, and empties the journal
+
+compaction runs every compact_every updates or compact_interval seconds, and on close(); a crash between writing the json file and emptying the journal only replays updates that are already in the file
+
+LowWatermark: the contiguous progress of a sweep whose steps finish out of order (e.g., the history lookups); current is the start of the first step that isn't done, so resuming from it never skips anything
+
+CursorStore: the next_cursor of every (call, user) of a relationships crawl, one small json file each (<folder>/<call>/<user_id>.json, replaced atomically after every page), so a crawl that crashed resumes at the next page and appends to the file it was writing; cursor 0 means the user is done, given_up that it ran out of retries (e.g., suspended or protected); every state belongs to one crawl (<folder>/<call>/run.json, begin()), a state of another crawl is ignored, and the crawl ends (reset()) once every user is done or given up, or after max_passes passes over the users, so the next one starts over instead of inheriting "done"
+
+python checkpoint.py -f users.json compacts the journal into users.json; -e exports to another file instead
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, time, datetime, argparse, threading, shutil
+
+COMPACT_EVERY = 10000 # updates
+COMPACT_INTERVAL = 300 # seconds
+MAX_PASSES = 3 # passes over the users of a relationships crawl before the unfinished ones are given up
+
+class CheckpointJournal(object):
+
+    def __init__(self, filename, compact_every = COMPACT_EVERY, compact_interval = COMPACT_INTERVAL, day_folder = None, day_name = None):
+
+        self.filename = os.path.abspath(filename)
+        self.journal_filename = '%s.journal'%self.filename
+
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.day_folder = day_folder
+        self.day_name = day_name if day_name else os.path.basename(self.filename)
+
+        self._lock = threading.Lock()
+
+        self.configs = self.load()
+
+        self._journal = open(self.journal_filename, 'a')
+        self._updates = 0
+        self._last_compact = time.time()
+
+    def load(self):
+        '''
+        the json file with the journal replayed on top; stops at a truncated last line (a crash in the middle of an append)
+        '''
+        configs = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                configs = json.load(f)
+
+        replayed = 0
+        if os.path.exists(self.journal_filename):
+            with open(self.journal_filename, 'r') as f:
+                for line in f:
+                    try:
+                        config_id, changes = json.loads(line)
+                    except ValueError:
+                        logger.warn('[%s] truncated entry after %d updates, ignored'%(self.journal_filename, replayed))
+                        break
+
+                    configs.setdefault(config_id, {}).update(changes)
+                    replayed += 1
+
+        if replayed:
+            logger.info('[%s] replayed %d updates'%(self.journal_filename, replayed))
+
+        return configs
+
+    def update(self, config_id, config, now = None):
+        '''
+        merges config into configs[config_id]; only the fields that changed (compared in their json form, e.g., tuples as lists) are journaled
+        '''
+        config = json.loads(json.dumps(config))
+
+        with self._lock:
+            current = self.configs.setdefault(config_id, {})
+            changes = dict((k, v) for k, v in config.items() if k not in current or current[k] != v)
+
+            if not changes:
+                return
+
+            current.update(changes)
+
+            self._journal.write('%s\n'%json.dumps([config_id, changes]))
+            self._journal.flush()
+            self._updates += 1
+
+            if self._updates >= self.compact_every or time.time() - self._last_compact >= self.compact_interval:
+                self._compact(now)
+
+    def export(self, filename):
+
+        filename = os.path.abspath(filename)
+        tmp_filename = '%s.%d.tmp'%(filename, os.getpid())
+
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.configs, f)
+
+        os.replace(tmp_filename, filename)
+
+    def _compact(self, now = None):
+
+        self.export(self.filename)
+
+        self._journal.truncate(0)
+        self._journal.seek(0)
+
+        if self.day_folder:
+            now = now if now else datetime.datetime.now()
+            day_output_folder = os.path.abspath('%s/%s'%(self.day_folder, now.strftime('%Y%m%d')))
+
+            if not os.path.exists(day_output_folder):
+                os.makedirs(day_output_folder)
+
+            self.export('%s/%s'%(day_output_folder, self.day_name))
+
+        logger.info('[%s] compacted %d updates'%(self.filename, self._updates))
+
+        self._updates = 0
+        self._last_compact = time.time()
+
+    def compact(self, now = None):
+        with self._lock:
+            self._compact(now)
+
+    def close(self):
+        with self._lock:
+            if self._journal.closed:
+                return
+
+            self._compact()
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class LowWatermark(object):
+
+    def __init__(self, current, step):
+
+        self.current = current
+        self.step = step
+
+        self._done = set()
+        self._cond = threading.Condition()
+
+        self.error = None
+
+    def done(self, start):
+        '''
+        the step at start is done; True if current moved
+        '''
+        with self._cond:
+            self._done.add(start)
+
+            advanced = False
+            while self.current in self._done:
+                self._done.remove(self.current)
+                self.current += self.step
+                advanced = True
+
+            if advanced:
+                self._cond.notify_all()
+
+            return advanced
+
+    def fail(self, exc):
+        '''
+        a step failed: current can't move past it, so the sweep stops (wait_for raises exc)
+        '''
+        with self._cond:
+            self.error = exc
+            self._cond.notify_all()
+
+    def wait_for(self, start, window, timeout = None):
+        '''
+        blocks until the step at start is less than window steps ahead of current (i.e., at most window steps are done or in flight past current); raises the error of a failed step
+        '''
+        with self._cond:
+            ready = self._cond.wait_for(lambda: self.error is not None or start < self.current + window * self.step, timeout)
+
+            if self.error is not None:
+                raise self.error
+
+            return ready
+
+    def pending(self):
+        '''
+        steps done past current (waiting for the one at current)
+        '''
+        with self._cond:
+            return len(self._done)
+
+class CursorStore(object):
+
+    def __init__(self, folder, max_passes = MAX_PASSES):
+
+        self.folder = os.path.abspath(folder)
+        self.max_passes = max_passes
+
+        self._runs = {}
+
+    def call_folder(self, call):
+        return os.path.join(self.folder, call.strip('/').replace('/', '_'))
+
+    def state_filename(self, call, user_id):
+        return os.path.join(self.call_folder(call), '%s.json'%user_id)
+
+    def run_filename(self, call):
+        return os.path.join(self.call_folder(call), 'run.json')
+
+    def _write(self, filename, state):
+
+        folder = os.path.dirname(filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        tmp_filename = '%s.%d.tmp'%(filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(state, f)
+
+        os.replace(tmp_filename, filename)
+
+    def _run(self, call):
+        if call not in self._runs:
+            try:
+                with open(self.run_filename(call), 'r') as f:
+                    self._runs[call] = json.load(f)
+            except (IOError, ValueError):
+                return None
+
+        return self._runs[call]
+
+    def begin(self, call):
+        '''
+        the crawl of call: the unfinished one in folder (a restart resumes it), or a new one; returns its run.json
+        '''
+        self._runs.pop(call, None)
+
+        run = self._run(call)
+        if not run:
+            run = {'run': '%d'%int(time.time() * 1000), 'passes': 0}
+            self._write(self.run_filename(call), run)
+            self._runs[call] = run
+
+        return run
+
+    def get(self, call, user_id):
+        '''
+        the saved state (cursor, filename, cnt, size, given_up) of user_id in the current crawl, None if it hasn't started
+        '''
+        filename = self.state_filename(call, user_id)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, 'r') as f:
+                state = json.load(f)
+        except ValueError:
+            logger.warn('[%s] invalid cursor state, starting over'%filename)
+            return None
+
+        run = self._run(call)
+        if not run or state.get('run') != run['run']:
+            # left by an earlier crawl
+            return None
+
+        return state
+
+    def save(self, call, user_id, state):
+
+        run = self._run(call)
+        state['run'] = run['run'] if run else None
+
+        self._write(self.state_filename(call, user_id), state)
+
+    def give_up(self, call, user_id, state):
+        state['given_up'] = True
+        self.save(call, user_id, state)
+
+    def done(self, state):
+        return bool(state) and (state['cursor'] == 0 or state.get('given_up', False))
+
+    def unfinished(self, call, user_ids):
+        '''
+        the user_ids neither done nor given up
+        '''
+        return [user_id for user_id in user_ids if not self.done(self.get(call, user_id))]
+
+    def finished(self, call, user_ids):
+        '''
+        True if every one of user_ids got to cursor 0 or was given up
+        '''
+        return not self.unfinished(call, user_ids)
+
+    def end_pass(self, call, user_ids):
+        '''
+        a pass over user_ids is over; the crawl ends (reset) if they're all done or given up, or after max_passes; returns the user_ids it gave up on once it ends, None while it goes on
+        '''
+        unfinished = self.unfinished(call, user_ids)
+
+        run = self._run(call)
+        run['passes'] += 1
+        self._write(self.run_filename(call), run)
+
+        if unfinished and run['passes'] < self.max_passes:
+            return None
+
+        given_up = [user_id for user_id in user_ids if (self.get(call, user_id) or {}).get('given_up')]
+
+        self.reset(call)
+
+        return given_up + unfinished
+
+    def reset(self, call):
+        shutil.rmtree(self.call_folder(call), ignore_errors=True)
+        self._runs.pop(call, None)
+
+        # the folder too, once no other call is in it
+        try:
+            os.rmdir(self.folder)
+        except OSError:
+            pass
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filename', help="the -cc file (search.json, users.json, ...)", required=True)
+    parser.add_argument('-e', '--export', help="write the replayed configs here instead of compacting in place", default=None)
+
+    args = parser.parse_args()
+
+    checkpoint = CheckpointJournal(args.filename)
+
+    if args.export:
+        checkpoint.export(args.export)
+        logger.info('[%d] configs exported to [%s]'%(len(checkpoint.configs), args.export))
+    else:
+        checkpoint.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+compact.py: dedups and compacts an output tree (e.g., months of /mnt/data2/twitter) into n_shards shards of unique tweets, sorted by id, in compressed segments
+
+map: the tweets files (see dedup_index.is_tweets_file) are split into tasks of about MAP_BYTES, in path order, and run on a process pool; every task appends each line, as is, to the spill of its shard (hash of the tweet id), with the ids and line offsets as uint64 arrays next to it
+
+reduce: one task per shard; np.unique over the ids of its spills keeps the first copy of every tweet (earliest path), already in id order; the lines are copied out of the memory mapped spills into <output>/shard.<n> segments (see output_writer.py), and the spills are removed
+
+<output>/manifest.json lists the inputs, and the segments, records, duplicates and id range of every shard; it's written last, so an output folder without one is incomplete. the inputs are never modified
+
+python compact.py -d /mnt/data2/twitter/2019-01 /mnt/data2/twitter/2019-02 -o /mnt/data2/compacted/2019 -n 64 -w 16 -f zstd
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, time, argparse, shutil
+import multiprocessing as mp
+import concurrent.futures
+import numpy as np
+from output_writer import read_lines, open_writer, list_segments, OUTPUT_FORMATS, SEGMENT_SIZE
+from dedup_index import mix, is_tweets_file
+
+N_SHARDS = 64
+MAP_BYTES = 1 << 30 # input bytes per map task
+BATCH_SIZE = 10000 # lines per shard assignment
+SPILL_BUFFER = 1 << 22 # bytes buffered per shard before a write to its spill
+
+def list_inputs(folders, exclude = None):
+    '''
+    the tweets files under folders, in path order
+    '''
+    filenames = []
+    for folder in folders:
+        for root, dirs, files in os.walk(os.path.abspath(folder)):
+            filenames.extend(os.path.join(root, f) for f in files if not f.startswith('.'))
+
+    exclude = os.path.abspath(exclude) if exclude else None
+
+    return [filename for filename in sorted(filenames) if not (exclude and filename.startswith(exclude)) and is_tweets_file(filename)]
+
+def map_tasks(filenames, map_bytes = MAP_BYTES):
+    '''
+    consecutive files, about map_bytes (compressed) per task
+    '''
+    task = []
+    size = 0
+    for filename in filenames:
+        task.append(filename)
+        size += os.path.getsize(filename)
+
+        if size >= map_bytes:
+            yield task
+            task = []
+            size = 0
+
+    if task:
+        yield task
+
+def spill_name(spill_folder, shard, task_id):
+    return os.path.join(spill_folder, '%05d'%shard, '%08d'%task_id)
+
+class ShardSpill(object):
+    '''
+    the lines of one map task for one shard: <name>.jsonl, with <name>.ids and <name>.off (uint64 id and start offset of every line)
+    '''
+    def __init__(self, name):
+
+        self.name = name
+
+        folder = os.path.dirname(name)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._f = open('%s.jsonl'%name, 'wb')
+        self._buffer = []
+        self._buffered = 0
+        self.offset = 0
+
+        self.ids = []
+        self.offsets = []
+
+    def append(self, tweet_id, line):
+        self.ids.append(tweet_id)
+        self.offsets.append(self.offset + self._buffered)
+
+        self._buffer.append(line)
+        self._buffered += len(line)
+
+        if self._buffered >= SPILL_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._f.write(b''.join(self._buffer))
+            self.offset += self._buffered
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+        np.array(self.ids, dtype=np.uint64).tofile('%s.ids'%self.name)
+        np.array(self.offsets, dtype=np.uint64).tofile('%s.off'%self.name)
+
+def map_worker(task_id, filenames, spill_folder, n_shards):
+
+    spills = {}
+    lines = 0
+    skipped = 0
+
+    def assign(batch):
+        ids = np.array([tweet_id for tweet_id, _ in batch], dtype=np.uint64)
+        shards = (mix(ids) % np.uint64(n_shards)).tolist()
+
+        for shard, (tweet_id, line) in zip(shards, batch):
+            if shard not in spills:
+                spills[shard] = ShardSpill(spill_name(spill_folder, shard, task_id))
+            spills[shard].append(tweet_id, line)
+
+    batch = []
+    for filename in filenames:
+        for line in read_lines(filename):
+            try:
+                tweet_id = int(json.loads(line)['id'])
+            except (ValueError, KeyError, TypeError):
+                # a truncated last line, or not a tweet
+                skipped += 1
+                continue
+
+            batch.append((tweet_id, line if line.endswith(b'\n') else line + b'\n'))
+            lines += 1
+
+            if len(batch) >= BATCH_SIZE:
+                assign(batch)
+                batch = []
+
+    if batch:
+        assign(batch)
+
+    for spill in spills.values():
+        spill.close()
+
+    logger.info('[map %d] files: %d; lines: %d; skipped: %d'%(task_id, len(filenames), lines, skipped))
+
+    return task_id, lines, skipped
+
+def reduce_worker(shard, spill_folder, output_folder, output_format = 'gzip', segment_size = SEGMENT_SIZE):
+
+    folder = os.path.join(spill_folder, '%05d'%shard)
+    names = sorted(set(os.path.splitext(f)[0] for f in os.listdir(folder))) if os.path.exists(folder) else []
+
+    # task ids follow the path order, so np.unique's first index is the earliest copy
+    ids = []
+    starts = []
+    ends = []
+    sources = []
+    datas = []
+    for i, name in enumerate(names):
+        name = os.path.join(folder, name)
+
+        spill_ids = np.fromfile('%s.ids'%name, dtype=np.uint64)
+        spill_starts = np.fromfile('%s.off'%name, dtype=np.uint64)
+        size = os.path.getsize('%s.jsonl'%name)
+
+        ids.append(spill_ids)
+        starts.append(spill_starts)
+        ends.append(np.append(spill_starts[1:], np.uint64(size)))
+        sources.append(np.full(len(spill_ids), i, dtype=np.uint32))
+        datas.append(np.memmap('%s.jsonl'%name, dtype=np.uint8, mode='r') if size else None)
+
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.uint64)
+    ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.uint64)
+    sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.uint32)
+
+    unique_ids, first = np.unique(ids, return_index=True)
+
+    prefix = os.path.join(output_folder, 'shard.%05d'%shard)
+    filename = '%s.json'%prefix if output_format == 'json' else prefix
+
+    with open_writer(filename, output_format, mode='w', segment_size=segment_size) as wf:
+        for source, start, end in zip(sources[first].tolist(), starts[first].tolist(), ends[first].tolist()):
+            wf.write_line(datas[source][start:end - 1].tobytes().decode('utf-8'))
+
+    info = {
+        'records': len(unique_ids),
+        'duplicates': len(ids) - len(unique_ids),
+        'min_id': int(unique_ids[0]) if len(unique_ids) else None,
+        'max_id': int(unique_ids[-1]) if len(unique_ids) else None,
+        'files': [os.path.basename(f) for f in ([filename] if output_format == 'json' else list_segments(prefix))]
+    }
+
+    del datas
+    shutil.rmtree(folder, ignore_errors=True)
+
+    logger.info('[reduce %d] records: %d; duplicates: %d'%(shard, info['records'], info['duplicates']))
+
+    return shard, info
+
+def write_manifest(filename, manifest):
+    tmp_filename = '%s.tmp'%filename
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_filename, filename)
+
+def compact(folders, output_folder, n_shards = N_SHARDS, n_workers = mp.cpu_count(), output_format = 'gzip', segment_size = SEGMENT_SIZE, map_bytes = MAP_BYTES):
+
+    output_folder = os.path.abspath(output_folder)
+    manifest_filename = os.path.join(output_folder, 'manifest.json')
+
+    if os.path.exists(manifest_filename):
+        os.remove(manifest_filename)
+
+    spill_folder = os.path.join(output_folder, '.spill')
+    shutil.rmtree(spill_folder, ignore_errors=True)
+    os.makedirs(spill_folder)
+
+    started = time.time()
+
+    filenames = list_inputs(folders, exclude = output_folder)
+    tasks = list(map_tasks(filenames, map_bytes))
+    logger.info('inputs: %d files (%d bytes); map tasks: %d; shards: %d; workers: %d'%(len(filenames), sum(os.path.getsize(f) for f in filenames), len(tasks), n_shards, n_workers))
+
+    lines = 0
+    skipped = 0
+    shards = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for task_id, task_lines, task_skipped in executor.map(map_worker, range(len(tasks)), tasks, [spill_folder] * len(tasks), [n_shards] * len(tasks)):
+            lines += task_lines
+            skipped += task_skipped
+
+        logger.info('map: %d lines in %.1f secs'%(lines, time.time() - started))
+
+        futures_ = [executor.submit(reduce_worker, shard, spill_folder, output_folder, output_format, segment_size) for shard in range(n_shards)]
+        for future_ in concurrent.futures.as_completed(futures_):
+            shard, info = future_.result()
+            shards['%d'%shard] = info
+
+    shutil.rmtree(spill_folder, ignore_errors=True)
+
+    manifest = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'inputs': [{'filename': f, 'size': os.path.getsize(f)} for f in filenames],
+        'n_shards': n_shards,
+        'shard_of': 'splitmix64(id) %% %d'%n_shards,
+        'format': output_format,
+        'lines': lines,
+        'skipped': skipped,
+        'records': sum(info['records'] for info in shards.values()),
+        'duplicates': sum(info['duplicates'] for info in shards.values()),
+        'shards': dict(sorted(shards.items(), key=lambda item: int(item[0])))
+    }
+
+    write_manifest(manifest_filename, manifest)
+
+    logger.info('records: %d; duplicates: %d; skipped: %d; %.1f secs'%(manifest['records'], manifest['duplicates'], skipped, time.time() - started))
+
+    return manifest
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data', help="output folders to compact", nargs='+', required=True)
+    parser.add_argument('-o', '--output', help="folder of the compacted shards", required=True)
+    parser.add_argument('-n', '--shards', help="number of shards", type=int, default=N_SHARDS)
+    parser.add_argument('-w', '--workers', help="number of processes", type=int, default=mp.cpu_count())
+    parser.add_argument('-f', '--format', help="output format: %s"%(', '.join(OUTPUT_FORMATS)), choices=OUTPUT_FORMATS, default='gzip')
+    parser.add_argument('-ss', '--segment_size', help="segment size in MB for compressed output", type=int, default=SEGMENT_SIZE // (1024 * 1024))
+    parser.add_argument('-mb', '--map_bytes', help="input MB per map task", type=int, default=MAP_BYTES // (1024 * 1024))
+
+    args = parser.parse_args()
+
+    compact(args.data, args.output, args.shards, args.workers, args.format, args.segment_size * 1024 * 1024, args.map_bytes * 1024 * 1024)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+county_index.py: tags geotagged tweets with their county, a batch of points at a time, instead of one tweet at a time against every county
+
+CountyIndex: the bboxes of the counties (county.csv, County,Bbox) or their polygons (the census county geojson, gz_2010_us_050_00_20m.json, read with explode/bbox of test_data/geo/process_geojson.py) on a grid of cell_size degrees; every cell keeps the counties whose bbox touches it (a CSR: offsets into the county list, see edge_store.py). lookup() takes numpy arrays of lngs and lats: every point is expanded into (point, county) pairs of its cell, the pairs are tested against the bboxes, and then against the polygons (even-odd ray casting, over all the rings of the county, so holes and islands are right); a point in more than one county (bboxes overlap, polygons shouldn't) goes to the smallest. -1 is no county
+
+tag_files(): the tweets files of day folders on a process pool, one task per file; only the lines with a point ("Point" in the raw line, a few percent of the tweets) are parsed at all; writes <output>/<relative path of the file>.counties, one {"id": ..., "county": ..., "county_id": ...} line per tagged tweet, and <output>/counties.json with the tweets per county
+
+python county_index.py -d ./data/20190101 -o ./counties tags a day folder with the bboxes of county.csv (-g gz_2010_us_050_00_20m.json for the polygons); -n 1000000 benchmarks lookup() on random points
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, sys, csv, json, time, argparse
+import multiprocessing as mp
+import concurrent.futures
+import numpy as np
+from output_writer import read_lines
+
+CELL_SIZE = 0.25 # degrees
+BATCH_SIZE = 100000 # points per lookup
+PIP_BLOCK = 1 << 22 # (point, edge) pairs per ray casting block
+
+class CountyIndex(object):
+
+    def __init__(self, names, ids, bboxes, polygons = None, cell_size = CELL_SIZE):
+        '''
+        bboxes: (min_lng, min_lat, max_lng, max_lat) of every county; polygons: [[ring, ...], ...] of every county, a ring an (n, 2) array of (lng, lat), or None to stop at the bboxes
+        '''
+        self.names = list(names)
+        self.ids = list(ids)
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = cell_size
+
+        # a point in overlapping counties goes to the smallest one
+        self.areas = (self.bboxes[:, 2] - self.bboxes[:, 0]) * (self.bboxes[:, 3] - self.bboxes[:, 1])
+
+        self.x0, self.y0 = self.bboxes[:, 0].min(), self.bboxes[:, 1].min()
+        self.nx = int(np.ceil((self.bboxes[:, 2].max() - self.x0) / cell_size)) + 1
+        self.ny = int(np.ceil((self.bboxes[:, 3].max() - self.y0) / cell_size)) + 1
+
+        cells = []
+        counties = []
+        for county, (min_x, min_y, max_x, max_y) in enumerate(self.bboxes):
+            ix0, ix1 = self._cell(min_x, self.x0), self._cell(max_x, self.x0)
+            iy0, iy1 = self._cell(min_y, self.y0), self._cell(max_y, self.y0)
+
+            ix, iy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1))
+            cells.append((iy * self.nx + ix).ravel())
+            counties.append(np.full(cells[-1].shape, county))
+
+        cells = np.concatenate(cells)
+        counties = np.concatenate(counties)
+
+        order = np.argsort(cells, kind='stable')
+        self.cell_counties = counties[order].astype(np.int32)
+        self.cell_offsets = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_offsets[1:])
+
+        self.edges = None
+        if polygons is not None:
+            self._index_edges(polygons)
+
+    def _cell(self, v, v0):
+        return int(np.floor((v - v0) / self.cell_size))
+
+    def _index_edges(self, polygons):
+        '''
+        (x1, y1, x2, y2) of every ring edge, the edges of county i at edge_offsets[i]:edge_offsets[i + 1]
+        '''
+        edges = []
+        counts = []
+        for rings in polygons:
+            county_edges = [np.hstack([ring[:-1], ring[1:]]) for ring in (np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings) if len(ring) > 1]
+            county_edges = np.concatenate(county_edges) if county_edges else np.zeros((0, 4))
+            edges.append(county_edges)
+            counts.append(len(county_edges))
+
+        self.edges = np.concatenate(edges)
+        self.edge_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.edge_offsets[1:])
+
+    @classmethod
+    def from_csv(cls, county_csv, cell_size = CELL_SIZE):
+        '''
+        the bboxes of county.csv (County,Bbox); the county_id is the row number (the names repeat from state to state)
+        '''
+        names, ids, bboxes = [], [], []
+        with open(county_csv, newline='', encoding='utf-8', errors='ignore') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                if not row['Bbox'].strip():
+                    logger.warn('[%s] row %d has no bbox, skipped'%(row['County'], i))
+                    continue
+
+                names.append(row['County'].strip())
+                ids.append(i)
+                # a county across the antimeridian (Aleutians West) gets a bbox around the whole band, only its polygons are right
+                bboxes.append(json.loads(row['Bbox']))
+
+        return cls(names, ids, bboxes, cell_size = cell_size)
+
+    @classmethod
+    def from_geojson(cls, geoJSON_file, cell_size = CELL_SIZE):
+        '''
+        the polygons of the census county geojson; the county_id is its GEO_ID
+        '''
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'geo'))
+        from process_geojson import explode, bbox
+
+        with open(geoJSON_file, 'rb') as gf:
+            us = json.loads(gf.read().decode('utf-8','ignore'))
+
+        names, ids, bboxes, polygons = [], [], [], []
+        for county in us['features']:
+            geometry = county['geometry']
+            polygons_ = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+
+            names.append(county['properties']['NAME'].strip())
+            ids.append(county['properties']['GEO_ID'])
+            bboxes.append(bbox(county))
+            polygons.append([list(explode(ring)) for polygon in polygons_ for ring in polygon])
+
+        return cls(names, ids, bboxes, polygons, cell_size = cell_size)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _in_polygons(self, points, counties, lngs, lats):
+        '''
+        which (point, county) pairs are inside the polygons of the county
+        '''
+        inside = np.zeros(len(points), dtype=bool)
+
+        order = np.argsort(counties, kind='stable')
+        bounds = np.flatnonzero(np.diff(counties[order])) + 1
+        for group in np.split(order, bounds):
+            if not len(group):
+                continue
+
+            county = counties[group[0]]
+            x1, y1, x2, y2 = self.edges[self.edge_offsets[county] : self.edge_offsets[county + 1]].T
+            if not len(x1):
+                continue
+
+            step = max(PIP_BLOCK // len(x1), 1)
+            for i in range(0, len(group), step):
+                block = group[i : i + step]
+                px = lngs[points[block]][:, None]
+                py = lats[points[block]][:, None]
+
+                # the edges a ray from the point to +x crosses
+                spans = (y1 > py) != (y2 > py)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crosses = spans & (px < (x2 - x1) * (py - y1) / (y2 - y1) + x1)
+
+                inside[block] = crosses.sum(axis=1) % 2 == 1
+
+        return inside
+
+    def lookup(self, lngs, lats):
+        '''
+        the county (an index into names/ids) of every point, -1 if none
+        '''
+        lngs = np.asarray(lngs, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+
+        result = np.full(len(lngs), -1, dtype=np.int32)
+
+        ix = np.floor((lngs - self.x0) / self.cell_size)
+        iy = np.floor((lats - self.y0) / self.cell_size)
+        on_grid = np.flatnonzero((ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny))
+        if not len(on_grid):
+            return result
+
+        cells = (iy[on_grid] * self.nx + ix[on_grid]).astype(np.int64)
+        starts = self.cell_offsets[cells]
+        counts = self.cell_offsets[cells + 1] - starts
+
+        # every point against every county of its cell
+        points = np.repeat(on_grid, counts)
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        counties = self.cell_counties[positions]
+
+        b = self.bboxes[counties]
+        px, py = lngs[points], lats[points]
+        hit = (px >= b[:, 0]) & (px <= b[:, 2]) & (py >= b[:, 1]) & (py <= b[:, 3])
+        points, counties = points[hit], counties[hit]
+
+        if self.edges is not None and len(points):
+            hit = self._in_polygons(points, counties, lngs, lats)
+            points, counties = points[hit], counties[hit]
+
+        # the smallest county of every point first, then the first pair of every point
+        order = np.lexsort((self.areas[counties], points))
+        points, counties = points[order], counties[order]
+        first = np.ones(len(points), dtype=bool)
+        first[1:] = points[1:] != points[:-1]
+
+        result[points[first]] = counties[first]
+
+        return result
+
+def tweet_point(line):
+    '''
+    (id, lng, lat) of a tweet line with a point, else None
+    '''
+    # the coordinates of a geotagged tweet are a GeoJSON Point; nothing else is worth parsing
+    if b'"Point"' not in line:
+        return None
+
+    try:
+        tweet = json.loads(line)
+        lng, lat = tweet['coordinates']['coordinates']
+        return int(tweet['id']), float(lng), float(lat)
+    except (ValueError, KeyError, TypeError):
+        # a truncated last line, or a tweet without coordinates (the point was in a quoted tweet, the place, ...)
+        return None
+
+# the index of the pool workers (see init_worker)
+COUNTY_INDEX = None
+
+def init_worker(county_index):
+    global COUNTY_INDEX
+    COUNTY_INDEX = county_index
+
+def tag_worker(filename, output_filename):
+    '''
+    the tagged tweets of filename into output_filename; returns (filename, lines, points, {county: tweets})
+    '''
+    folder = os.path.dirname(output_filename)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    lines = 0
+    points = 0
+    counts = {}
+
+    def tag(batch, wf):
+        ids, lngs, lats = zip(*batch)
+        counties = COUNTY_INDEX.lookup(lngs, lats).tolist()
+
+        for tweet_id, county in zip(ids, counties):
+            if county < 0:
+                continue
+
+            counts[county] = counts.get(county, 0) + 1
+            wf.write('%s\n'%json.dumps({'id': tweet_id, 'county': COUNTY_INDEX.names[county], 'county_id': COUNTY_INDEX.ids[county]}))
+
+    with open(output_filename, 'w') as wf:
+        batch = []
+        for line in read_lines(filename):
+            lines += 1
+
+            point = tweet_point(line)
+            if not point:
+                continue
+
+            batch.append(point)
+            points += 1
+
+            if len(batch) >= BATCH_SIZE:
+                tag(batch, wf)
+                batch = []
+
+        if batch:
+            tag(batch, wf)
+
+    return filename, lines, points, counts
+
+def tag_files(folders, output_folder, county_index, n_workers = mp.cpu_count()):
+
+    from compact import list_inputs
+
+    output_folder = os.path.abspath(output_folder)
+
+    started = time.time()
+
+    filenames = list_inputs(folders, exclude = output_folder)
+    logger.info('inputs: %d files (%d bytes); counties: %d; workers: %d'%(len(filenames), sum(os.path.getsize(f) for f in filenames), len(county_index), n_workers))
+
+    root = os.path.commonpath([os.path.abspath(folder) for folder in folders])
+    root = root if os.path.isdir(root) else os.path.dirname(root)
+
+    lines = 0
+    points = 0
+    counts = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(county_index,)) as executor:
+        futures_ = [executor.submit(tag_worker, filename, '%s.counties'%os.path.join(output_folder, os.path.relpath(filename, root))) for filename in filenames]
+
+        for future_ in concurrent.futures.as_completed(futures_):
+            filename, file_lines, file_points, file_counts = future_.result()
+            lines += file_lines
+            points += file_points
+
+            for county, cnt in file_counts.items():
+                counts[county] = counts.get(county, 0) + cnt
+
+            logger.info('[%s] lines: %d; points: %d; tagged: %d'%(filename, file_lines, file_points, sum(file_counts.values())))
+
+    elapsed = time.time() - started
+    tagged = sum(counts.values())
+
+    summary = {
+        'inputs': filenames,
+        'lines': lines,
+        'points': points,
+        'tagged': tagged,
+        'counties': dict(('%s'%county_index.ids[county], {'name': county_index.names[county], 'tweets': cnt}) for county, cnt in sorted(counts.items(), key=lambda item: -item[1]))
+    }
+
+    with open(os.path.join(output_folder, 'counties.json'), 'w') as wf:
+        json.dump(summary, wf, indent=2)
+
+    logger.info('lines: %d; points: %d; tagged: %d; %.1f secs (%.0f tweets/min)'%(lines, points, tagged, elapsed, lines / elapsed * 60 if elapsed else 0))
+
+    return summary
+
+def benchmark(county_index, n = 1000000):
+    '''
+    lookup() of n random points over the bboxes, in BATCH_SIZE batches; returns points/min
+    '''
+    rng = np.random.RandomState(0)
+    # the contiguous US, where nearly every point is in some county
+    lngs = rng.uniform(-124.7, -67.0, n)
+    lats = rng.uniform(25.1, 49.4, n)
+
+    started = time.time()
+    tagged = 0
+    for i in range(0, n, BATCH_SIZE):
+        tagged += int((county_index.lookup(lngs[i : i + BATCH_SIZE], lats[i : i + BATCH_SIZE]) >= 0).sum())
+    elapsed = time.time() - started
+
+    logger.info('points: %d; tagged: %d; %.2f secs; %.0f points/min'%(n, tagged, elapsed, n / elapsed * 60))
+
+    return n / elapsed * 60
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--county_csv', help="county.csv (County,Bbox)", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'county.csv'))
+    parser.add_argument('-g', '--geojson', help="census county geojson (gz_2010_us_050_00_20m.json), to test the polygons instead of the bboxes of county.csv", default=None)
+    parser.add_argument('-cs', '--cell_size', help="grid cell size in degrees", type=float, default=CELL_SIZE)
+    parser.add_argument('-d', '--data', help="output folders (e.g., day folders) to tag", nargs='+', default=[])
+    parser.add_argument('-o', '--output', help="folder of the .counties files", default=None)
+    parser.add_argument('-w', '--workers', help="number of processes", type=int, default=mp.cpu_count())
+    parser.add_argument('-n', '--number', help="benchmark lookup() on this many random points", type=int, default=0)
+
+    args = parser.parse_args()
+
+    started = time.time()
+    county_index = CountyIndex.from_geojson(args.geojson, args.cell_size) if args.geojson else CountyIndex.from_csv(args.county_csv, args.cell_size)
+    logger.info('counties: %d; grid: %d x %d; %.2f secs'%(len(county_index), county_index.nx, county_index.ny, time.time() - started))
+
+    if args.number:
+        benchmark(county_index, args.number)
+
+    if args.data:
+        if not args.output:
+            parser.error('-o is required with -d')
+
+        tag_files(args.data, args.output, county_index, args.workers)
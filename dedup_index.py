@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+dedup_index.py: a persistent index of the tweet ids already written, across files, days and runs, in bounded memory
+
+DedupIndex: sorted runs of unique uint64 ids on disk (<folder>/run.<n>.u64, memory mapped), an in-memory Bloom filter in front of them, and a set of the ids added since the last run was written; add(ids) returns which ids weren't in the index yet and adds them
+
+most ids of a fresh response aren't in the index and are answered by the Bloom filter alone; the others are checked with a binary search in each run. once max_runs runs are on disk, the two smallest are merged, so lookups stay at a few binary searches
+
+flush() writes the pending ids as a new run; close() also saves the Bloom filter (it's rebuilt from the runs if it's missing or stale, e.g., after a crash). ids added after the last flush() are lost in a crash, they just won't be recognized as duplicates
+
+DedupWriter: wraps a writer (e.g., the DailyWriter of twitter_streamer.py) and drops records whose id is in the index; one process at a time can write to an index
+
+python dedup_index.py -i ./dedup -d /mnt/data2/twitter reports the duplicates across the output tree (files already ingested into the index are skipped, or only their new lines scanned if they grew); -r rewrites the files without them
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, math, time, argparse, gzip, io
+import numpy as np
+from output_writer import read_records, read_lines
+from exceptions import InvalidConfig
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CAPACITY = 100000000 # ids the bloom filter is sized for; more still works, with more false positives (i.e., more binary searches)
+ERROR_RATE = 0.01
+RUN_SIZE = 1 << 20 # pending ids per run
+MAX_RUNS = 16
+BATCH_SIZE = 10000 # records per add() when scanning files
+SAVE_EVERY = 1000 # files ingested between two saves of the manifest (and flushes of the index)
+
+def mix(ids):
+    '''
+    splitmix64 of an uint64 array
+    '''
+    z = ids + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class BloomFilter(object):
+
+    def __init__(self, capacity = CAPACITY, error_rate = ERROR_RATE):
+
+        m = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+
+        self.m = max(64, (m + 63) // 64 * 64)
+        self.k = max(1, int(round(float(self.m) / capacity * math.log(2))))
+        self.bits = np.zeros(self.m // 8, dtype=np.uint8)
+
+    def _positions(self, ids):
+        '''
+        k x len(ids) bit positions, by double hashing
+        '''
+        h1 = mix(ids)
+        h2 = mix(ids ^ np.uint64(0x5851F42D4C957F2D)) | np.uint64(1)
+
+        i = np.arange(self.k, dtype=np.uint64)[:, None]
+        return (h1[None, :] + i * h2[None, :]) % np.uint64(self.m)
+
+    def add(self, ids):
+        positions = self._positions(ids).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def might_contain(self, ids):
+        positions = self._positions(ids)
+        return ((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=0).astype(bool)
+
+    def save(self, filename):
+        tmp_filename = '%s.tmp'%filename
+        self.bits.tofile(tmp_filename)
+        os.replace(tmp_filename, filename)
+
+    def load(self, filename):
+        bits = np.fromfile(filename, dtype=np.uint8)
+        if bits.size != self.bits.size:
+            return False
+
+        self.bits = bits
+        return True
+
+class DedupIndex(object):
+
+    def __init__(self, folder, capacity = CAPACITY, error_rate = ERROR_RATE, run_size = RUN_SIZE, max_runs = MAX_RUNS):
+
+        self.folder = os.path.abspath(folder)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self.manifest_filename = os.path.join(self.folder, 'index.json')
+        self.bloom_filename = os.path.join(self.folder, 'bloom.bin')
+
+        self.manifest = {'runs': [], 'next_run': 0, 'count': 0, 'capacity': capacity, 'error_rate': error_rate, 'bloom': None, 'ingested': {}}
+        if os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename, 'r') as f:
+                self.manifest.update(json.load(f))
+
+        self.run_size = run_size
+        self.max_runs = max_runs
+
+        self.runs = [self._open_run(name) for name in self.manifest['runs']]
+        self._pending = set()
+
+        # sized when the index was created; a different capacity would need a rebuild of the filter anyway
+        self.bloom = BloomFilter(self.manifest['capacity'], self.manifest['error_rate'])
+        if self.manifest['bloom'] != self.manifest['runs'] or not os.path.exists(self.bloom_filename) or not self.bloom.load(self.bloom_filename):
+            self._rebuild_bloom()
+
+        # the saved filter is only valid until the runs change
+        self.manifest['bloom'] = None
+
+    def __len__(self):
+        return self.manifest['count'] + len(self._pending)
+
+    def _open_run(self, name):
+        filename = os.path.join(self.folder, name)
+
+        if not os.path.getsize(filename):
+            return np.zeros(0, dtype=np.uint64)
+
+        return np.memmap(filename, dtype=np.uint64, mode='r')
+
+    def _rebuild_bloom(self):
+        if self.runs:
+            logger.info('[%s] rebuilding the bloom filter from %d runs'%(self.folder, len(self.runs)))
+
+        for run in self.runs:
+            for i in range(0, len(run), self.run_size):
+                self.bloom.add(np.asarray(run[i : i + self.run_size]))
+
+    def _save_manifest(self):
+        tmp_filename = '%s.tmp'%self.manifest_filename
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.manifest, f)
+
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def _write_run(self, ids):
+        name = 'run.%06d.u64'%self.manifest['next_run']
+        self.manifest['next_run'] += 1
+
+        filename = os.path.join(self.folder, name)
+        ids.astype(np.uint64).tofile('%s.tmp'%filename)
+        os.replace('%s.tmp'%filename, filename)
+
+        return name
+
+    def contains(self, ids):
+        '''
+        a bool array, True where the id is in the index
+        '''
+        ids = np.asarray(ids, dtype=np.uint64)
+        found = np.zeros(len(ids), dtype=bool)
+
+        if not len(ids):
+            return found
+
+        # the bloom filter has every id of the runs and of the pending set, so it rules out most new ids alone
+        candidates = np.nonzero(self.bloom.might_contain(ids))[0]
+
+        if candidates.size and self._pending:
+            found[candidates] = [int(tweet_id) in self._pending for tweet_id in ids[candidates]]
+
+        for run in self.runs:
+            candidates = candidates[~found[candidates]]
+            if not candidates.size:
+                break
+
+            if not len(run):
+                continue
+
+            positions = np.minimum(np.searchsorted(run, ids[candidates]), len(run) - 1)
+            found[candidates] = run[positions] == ids[candidates]
+
+        return found
+
+    def add(self, ids):
+        '''
+        adds ids; a bool array, True where the id is new (the first of repeats within ids counts as new)
+        '''
+        ids = np.asarray(ids, dtype=np.uint64)
+        new = np.zeros(len(ids), dtype=bool)
+
+        if not len(ids):
+            return new
+
+        unique_ids, first = np.unique(ids, return_index=True)
+        unseen = ~self.contains(unique_ids)
+
+        new_ids = unique_ids[unseen]
+        new[first[unseen]] = True
+
+        if new_ids.size:
+            self.bloom.add(new_ids)
+            self._pending.update(new_ids.tolist())
+
+            if len(self._pending) >= self.run_size:
+                self.flush()
+
+        return new
+
+    def flush(self):
+        '''
+        writes the pending ids as a new run
+        '''
+        if not self._pending:
+            return
+
+        ids = np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending))
+        ids.sort()
+
+        name = self._write_run(ids)
+
+        self.manifest['runs'].append(name)
+        self.manifest['count'] += len(ids)
+        self.runs.append(self._open_run(name))
+        self._pending = set()
+
+        while len(self.runs) > self.max_runs:
+            self._merge_smallest()
+
+        self._save_manifest()
+
+    def _merge_smallest(self):
+        '''
+        the two smallest runs into one; runs are disjoint (only new ids are ever added), so this is a plain merge
+        '''
+        a, b = sorted(range(len(self.runs)), key=lambda i: len(self.runs[i]))[:2]
+        merged = np.concatenate([np.asarray(self.runs[a]), np.asarray(self.runs[b])])
+        merged.sort(kind='mergesort')
+
+        name = self._write_run(merged)
+        old = [self.manifest['runs'][a], self.manifest['runs'][b]]
+
+        for i in sorted([a, b], reverse=True):
+            del self.runs[i]
+            del self.manifest['runs'][i]
+
+        self.runs.append(self._open_run(name))
+        self.manifest['runs'].append(name)
+
+        # the new manifest first, so a crash never leaves it pointing to a removed run
+        self._save_manifest()
+        for name in old:
+            os.remove(os.path.join(self.folder, name))
+
+        logger.info('[%s] merged %s into %s (%d ids)'%(self.folder, old, self.manifest['runs'][-1], len(merged)))
+
+    def close(self):
+        self.flush()
+
+        self.bloom.save(self.bloom_filename)
+        self.manifest['bloom'] = list(self.manifest['runs'])
+        self._save_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class DedupWriter(object):
+    '''
+    a writer that drops records whose id is already in index; records without an id (e.g., stream notices) are passed through
+    '''
+    def __init__(self, writer, index):
+
+        self.writer = writer
+        self.index = index
+
+        self.duplicates = 0
+
+    def write(self, record):
+        self.write_records([record])
+
+    def write_records(self, records):
+
+        with_id = [record for record in records if 'id' in record]
+        new = self.index.add([record['id'] for record in with_id])
+
+        kept = [record for record, is_new in zip(with_id, new) if is_new]
+        kept += [record for record in records if 'id' not in record]
+
+        self.duplicates += len(with_id) - int(new.sum())
+
+        if hasattr(self.writer, 'write_records'):
+            self.writer.write_records(kept)
+        else:
+            for record in kept:
+                self.writer.write(record)
+
+    def rate(self):
+        return self.writer.rate()
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        # the index belongs to the caller, who closes it
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def open_rewrite(filename):
+    '''
+    a text file to rewrite filename to, in the same compression
+    '''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='utf-8')
+
+    if filename.endswith('.zst'):
+        if not zstandard:
+            raise InvalidConfig('rewriting %s requires the zstandard package'%filename)
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(filename, 'wb'), closefd=True), encoding='utf-8')
+
+    return open(filename, 'w')
+
+def is_tweets_file(filename):
+    '''
+    json lines of tweets, judged by the first record (skips the -cc configs, friends/followers and retweets files, ...)
+    '''
+    for record in read_records(filename):
+        return isinstance(record, dict) and 'id' in record and ('text' in record or 'full_text' in record)
+
+    return False
+
+def batches(records, n):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def dedup_file(index, filename, remove = False, skip = 0):
+    '''
+    adds the ids of filename to index, after its first skip lines (already ingested); (total, duplicates, lines: the complete lines of filename now); remove rewrites filename without the duplicates
+    '''
+    total = 0
+    duplicates = 0
+    lines = 0
+
+    tmp_filename = os.path.join(os.path.dirname(filename), '.%s.dedup%s'%(os.path.basename(filename), os.path.splitext(filename)[1])) if remove else None
+    wf = open_rewrite(tmp_filename) if remove else None
+
+    def records():
+        nonlocal lines
+        for line in read_lines(filename):
+            if lines < skip:
+                lines += 1
+                if wf:
+                    wf.write(line.decode('utf-8'))
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                logger.warn('[%s] is truncated: %s'%(filename, exc))
+                return
+
+            lines += 1
+            yield record
+
+    try:
+        for batch in batches(records(), BATCH_SIZE):
+            new = index.add([record['id'] for record in batch])
+
+            total += len(batch)
+            duplicates += len(batch) - int(new.sum())
+
+            if wf:
+                wf.write(''.join(['%s\n'%json.dumps(record) for record, is_new in zip(batch, new) if is_new]))
+    finally:
+        if wf:
+            wf.close()
+
+    if remove:
+        if duplicates:
+            os.replace(tmp_filename, filename)
+        else:
+            os.remove(tmp_filename)
+
+    return total, duplicates, lines - (duplicates if remove else 0)
+
+def file_state(filename):
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+def dedup_tree(index, folders, remove = False, save_every = SAVE_EVERY):
+    '''
+    every tweets file under folders, in path order (i.e., days in order, so the first copy of a tweet is kept); a file already ingested is skipped unless its size or mtime changed (e.g., today's file, a segment being written), then only its new lines are scanned; the manifest is saved every save_every files
+    '''
+    total = 0
+    duplicates = 0
+
+    filenames = []
+    for folder in folders:
+        for root, dirs, files in os.walk(os.path.abspath(folder)):
+            filenames.extend(os.path.join(root, f) for f in files if not f.startswith('.'))
+
+    ingested = index.manifest['ingested']
+    unsaved = 0
+
+    for filename in sorted(filenames):
+        if filename.startswith(index.folder):
+            continue
+
+        # before the scan: lines appended meanwhile change it again, and are scanned next time
+        state = file_state(filename)
+
+        seen = ingested.get(filename)
+        skip = 0
+        if isinstance(seen, dict):
+            if seen['size'] == state['size'] and seen['mtime'] == state['mtime']:
+                continue
+
+            if state['size'] < seen['size']:
+                # rewritten (not appended to) since: its ids are in the index already
+                logger.warn('[%s] shrank since it was ingested, not scanned again'%filename)
+                skip = float('inf')
+            else:
+                skip = seen['records']
+        elif seen is not None:
+            # ingested without its size (an older index): taken as it is now
+            skip = float('inf')
+
+        if not is_tweets_file(filename):
+            continue
+
+        file_total, file_duplicates, records = dedup_file(index, filename, remove, skip)
+
+        total += file_total
+        duplicates += file_duplicates
+
+        if remove and file_duplicates:
+            state = file_state(filename)
+
+        # in memory until the next save: it's persisted with (never before) its ids, by the next flush
+        state['records'] = records
+        ingested[filename] = state
+
+        unsaved += 1
+        if unsaved >= save_every:
+            index.flush()
+            index._save_manifest()
+            unsaved = 0
+
+        if file_duplicates:
+            logger.info('[%s] total: [%d]; duplicate: [%d]'%(filename, file_total, file_duplicates))
+
+    if unsaved:
+        index.flush()
+        index._save_manifest()
+
+    return total, duplicates
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index', help="folder of the dedup index", required=True)
+    parser.add_argument('-d', '--data', help="output folders to scan", nargs='+', default=[])
+    parser.add_argument('-r', '--remove', help="rewrite the files without the duplicates", action='store_true')
+    parser.add_argument('-cap', '--capacity', help="ids the bloom filter is sized for (only when the index is created)", type=int, default=CAPACITY)
+
+    args = parser.parse_args()
+
+    with DedupIndex(args.index, capacity = args.capacity) as index:
+        if args.data:
+            total, duplicates = dedup_tree(index, args.data, args.remove)
+            logger.info('total: [%d]; duplicate: [%d]; %s'%(total, duplicates, 'removed' if args.remove else 'reported'))
+
+        logger.info('[%s] ids: %d; runs: %d; files ingested: %d'%(index.folder, len(index), len(index.runs), len(index.manifest['ingested'])))
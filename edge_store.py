@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+edge_store.py: friends/followers graphs as uint64 (src, dst) edges instead of json pages
+
+EdgeWriter: appends the edges of every cursor page to <prefix>.<n>.edges (raw little-endian uint64 pairs, 16 bytes an edge); like SegmentWriter (see output_writer.py) every writer starts its own segment (several processes can share a prefix) and rotates it once it passes segment_size bytes; a crash can at most leave a partial last edge, which read_edges() ignores
+
+build_csr(): the edges of a set of segments as a CSR adjacency index in a folder: nodes.u64 (the sorted, unique srcs), offsets.u64 (len(nodes) + 1) and targets.u64 (the sorted, unique dsts of each src, nodes[i]'s are targets[offsets[i]:offsets[i + 1]]), plus csr.json; CsrGraph memory maps them, so loading a graph costs nothing until it's read
+
+for /friends/ids the src is the crawled user and the dsts are its friends; for /followers/ids the src is the crawled user and the dsts are its followers (i.e., src is always the user the call was made for, keep the two calls in separate stores)
+
+python edge_store.py -i <output>/20190101/edges.friends_ids -o friends.csr builds the index of all the segments of a prefix (or of several prefixes); -q <user_id> prints the targets of a user
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, re, json, argparse
+import numpy as np
+
+SEGMENT_SIZE = 256 * 1024 * 1024 # bytes per segment
+EDGE_BYTES = 16
+
+def segment_number(filename):
+    return int(filename.rsplit('.', 2)[-2])
+
+def list_edge_segments(prefix):
+    '''
+    segments written by EdgeWriter(prefix), in order
+    '''
+    folder, name = os.path.split(os.path.abspath(prefix))
+    if not os.path.exists(folder):
+        return []
+
+    pattern = re.compile(r'^%s\.\d+\.edges$'%re.escape(name))
+    segments = [os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f)]
+
+    return sorted(segments, key=segment_number)
+
+class EdgeWriter(object):
+
+    def __init__(self, prefix, segment_size = SEGMENT_SIZE):
+
+        self.prefix = os.path.abspath(prefix)
+        self.segment_size = segment_size
+
+        folder = os.path.dirname(self.prefix)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._f = None
+        self._segment_bytes = 0
+
+        self.counter = 0
+
+    def _open_segment(self):
+        if self._f:
+            self._f.close()
+
+        segments = list_edge_segments(self.prefix)
+        seq = segment_number(segments[-1]) + 1 if segments else 0
+
+        # other processes may be opening segments with the same prefix
+        while True:
+            self.filename = '%s.%05d.edges'%(self.prefix, seq)
+            try:
+                self._f = open(self.filename, 'xb')
+                break
+            except FileExistsError:
+                seq += 1
+
+        self._segment_bytes = 0
+
+    def write_edges(self, src, dsts):
+        '''
+        (src, dst) for every dst, as one write
+        '''
+        if not len(dsts):
+            return
+
+        if not self._f or self._segment_bytes >= self.segment_size:
+            self._open_segment()
+
+        edges = np.empty((len(dsts), 2), dtype='<u8')
+        edges[:, 0] = src
+        edges[:, 1] = dsts
+
+        data = edges.tobytes()
+        self._f.write(data)
+        self._f.flush()
+
+        self._segment_bytes += len(data)
+        self.counter += len(dsts)
+
+    def flush(self):
+        if self._f:
+            self._f.flush()
+
+    def close(self):
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class EdgePageWriter(object):
+    '''
+    the cursor pages of /friends/ids or /followers/ids of src as edges, through an EdgeWriter that outlives it (see shared_edge_writer)
+    '''
+    def __init__(self, edge_writer, src):
+
+        self.edge_writer = edge_writer
+        self.src = src
+
+    def write(self, page):
+        self.edge_writer.write_edges(self.src, page['ids'])
+
+    def flush(self):
+        self.edge_writer.flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# one open segment per prefix for the life of the process (e.g., a pool worker), instead of a segment per user
+_shared_edge_writers = {}
+
+def shared_edge_writer(prefix, segment_size = SEGMENT_SIZE):
+    '''
+    the open EdgeWriter of prefix in this process; opening a new one closes the others (the day rolled over)
+    '''
+    writer = _shared_edge_writers.get(prefix)
+
+    if writer is None:
+        for other in list(_shared_edge_writers):
+            _shared_edge_writers.pop(other).close()
+
+        writer = _shared_edge_writers[prefix] = EdgeWriter(prefix, segment_size)
+
+    return writer
+
+def close_shared_edge_writers():
+    for prefix in list(_shared_edge_writers):
+        _shared_edge_writers.pop(prefix).close()
+
+def edges_prefix(day_output_folder, call):
+    '''
+    <day_output_folder>/edges.friends_ids or edges.followers_ids
+    '''
+    return os.path.join(day_output_folder, 'edges.%s'%call.strip('/').replace('/', '_'))
+
+def read_edges(filename):
+    '''
+    the (n, 2) uint64 edges of a segment, memory mapped; a partial last edge is ignored
+    '''
+    n = os.path.getsize(filename) // EDGE_BYTES
+    if not n:
+        return np.zeros((0, 2), dtype='<u8')
+
+    return np.memmap(filename, dtype='<u8', mode='r', shape=(n, 2))
+
+def build_csr(filenames, output_folder):
+    '''
+    the CSR index of the edges of filenames (duplicate edges are dropped); returns its CsrGraph
+    '''
+    output_folder = os.path.abspath(output_folder)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    edges = [read_edges(filename) for filename in filenames]
+    edges = np.concatenate(edges) if edges else np.zeros((0, 2), dtype='<u8')
+
+    # sorted by (src, dst); a structured view sorts the pairs in place without an index array
+    pairs = np.ascontiguousarray(edges).view([('src', '<u8'), ('dst', '<u8')]).ravel()
+    pairs = np.unique(pairs)
+
+    nodes, counts = np.unique(pairs['src'], return_counts=True)
+    offsets = np.zeros(len(nodes) + 1, dtype='<u8')
+    np.cumsum(counts, out=offsets[1:])
+
+    for name, array in [('nodes', nodes), ('offsets', offsets), ('targets', pairs['dst'])]:
+        filename = os.path.join(output_folder, '%s.u64'%name)
+        np.ascontiguousarray(array, dtype='<u8').tofile('%s.tmp'%filename)
+        os.replace('%s.tmp'%filename, filename)
+
+    # written last, so a folder without it is incomplete
+    with open(os.path.join(output_folder, 'csr.json'), 'w') as f:
+        json.dump({'nodes': len(nodes), 'edges': len(pairs), 'duplicates': len(edges) - len(pairs), 'segments': [os.path.abspath(filename) for filename in filenames]}, f)
+
+    logger.info('[%s] nodes: %d; edges: %d; duplicates: %d'%(output_folder, len(nodes), len(pairs), len(edges) - len(pairs)))
+
+    return CsrGraph(output_folder)
+
+class CsrGraph(object):
+
+    def __init__(self, folder):
+
+        self.folder = os.path.abspath(folder)
+
+        with open(os.path.join(self.folder, 'csr.json'), 'r') as f:
+            self.info = json.load(f)
+
+        self.nodes = self._map('nodes')
+        self.offsets = self._map('offsets')
+        self.targets = self._map('targets')
+
+    def _map(self, name):
+        filename = os.path.join(self.folder, '%s.u64'%name)
+        if not os.path.getsize(filename):
+            return np.zeros(0, dtype='<u8')
+
+        return np.memmap(filename, dtype='<u8', mode='r')
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index_of(self, src):
+        '''
+        the position of src in nodes, -1 if it has no edges
+        '''
+        i = int(np.searchsorted(self.nodes, np.uint64(src)))
+        return i if i < len(self.nodes) and self.nodes[i] == np.uint64(src) else -1
+
+    def neighbors(self, src):
+        i = self.index_of(src)
+        if i < 0:
+            return self.targets[0:0]
+
+        return self.targets[self.offsets[i] : self.offsets[i + 1]]
+
+    def degree(self, src):
+        i = self.index_of(src)
+        return int(self.offsets[i + 1] - self.offsets[i]) if i >= 0 else 0
+
+    def degrees(self):
+        return np.diff(self.offsets)
+
+    def has_edge(self, src, dst):
+        targets = self.neighbors(src)
+        j = int(np.searchsorted(targets, np.uint64(dst)))
+        return j < len(targets) and targets[j] == np.uint64(dst)
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help="edge segment prefixes (or segment files)", nargs='+', default=[])
+    parser.add_argument('-o', '--output', help="folder of the CSR index", required=True)
+    parser.add_argument('-q', '--query', help="user ids to print the targets of", nargs='+', type=int, default=[])
+
+    args = parser.parse_args()
+
+    if args.input:
+        filenames = []
+        for prefix in args.input:
+            filenames.extend([prefix] if prefix.endswith('.edges') else list_edge_segments(prefix))
+
+        graph = build_csr(filenames, args.output)
+    else:
+        graph = CsrGraph(args.output)
+
+    for user_id in args.query:
+        logger.info('[%d] degree: %d; %s'%(user_id, graph.degree(user_id), graph.neighbors(user_id).tolist()))
@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+fake_twitter.py: a local stand-in for the twitter REST and streaming apis, for load testing without burning real quota
+
+serves oauth2/token, search/tweets, statuses/user_timeline, statuses/lookup, users/lookup, friends|followers/ids|list, statuses/retweets/:id, geo/search, and the statuses/sample and statuses/filter streams; GET /stats returns what has been served so far
+
+responses are synthetic (but consistent: tweet ids are snowflakes, search and timelines grow over time, since_id/max_id/cursor paging works), or recorded: <recorded>/<endpoint>.json is served as is for that endpoint (e.g., recorded/search/tweets.json), and <recorded>/statuses/sample.jsonl is replayed on the streams
+
+rate limits are per (app key, endpoint) with the real x-rate-limit-* headers and 429s; latency, 503s, spurious 429s, bearer token expiry and protected users (401 Not authorized) are configurable
+
+python fake_twitter.py -port 8000 -latency 0.05 -error_rate 0.01; then point the crawlers at it: twitter_tracker.py -api http://localhost:8000, twitter_streamer.py -su http://localhost:8000
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+
+import os, json, time, argparse, random, base64, threading, copy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from util import md5
+from snowflake import TWEPOCH, snowflake, snowflake_ms, machine_of
+
+RETWEET_WORKER = 0x3ff # the worker id bits of the synthetic retweets
+
+DEFAULT_CONFIG = {
+    # calls per window, per app key (application-only auth limits)
+    'rate_limits': {
+        '/search/tweets': 450,
+        '/statuses/user_timeline': 1500,
+        '/statuses/lookup': 300,
+        '/users/lookup': 300,
+        '/friends/ids': 15,
+        '/friends/list': 15,
+        '/followers/ids': 15,
+        '/followers/list': 15,
+        '/statuses/retweets/:id': 300,
+        '/geo/search': 15
+    },
+    'window': 900, # seconds
+    'latency': 0.0, # seconds per response
+    'error_rate': 0.0, # fraction of responses that are 503s
+    'throttle_rate': 0.0, # fraction of responses that are 429s even with budget left
+    'token_ttl': 0, # seconds a bearer token stays valid (0: forever)
+    'search_size': 2000, # tweets of a query that are searchable
+    'search_rate': 10, # new tweets per query per second
+    'timeline_size': 3200, # tweets of a user timeline that can be paged through
+    'timeline_rate': 0.01, # new tweets per user per second
+    'lookup_hit_rate': 0.3, # fraction of ids that statuses/lookup finds
+    'lookup_machines': [], # if set, statuses/lookup only finds ids of these snowflake machines...
+    'lookup_sequences': 0, # ... and (if set) with a sequence below this, like real tweet ids
+    'relationships_size': 12000, # at most this many friends/followers per user
+    'protected_users': [], # user ids whose timeline and friends/followers are 401 Not authorized (protected or suspended)
+    'retweets_size': 4, # retweets of an original tweet; halves on every level of retweets
+    'stream_rate': 1000, # tweets per second per stream connection
+    'stream_limit': 0, # close a stream connection after this many tweets (0: never)
+    'recorded': None # folder of recorded responses
+}
+
+def twitter_time(ms):
+    return time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(ms / 1000.0))
+
+def seed_of(value):
+    return int(md5(('%s'%value).encode('utf-8'))[:8], 16)
+
+def make_user(user_id, screen_name = None):
+    return {
+        'id': user_id,
+        'id_str': '%d'%user_id,
+        'screen_name': screen_name if screen_name else 'user_%d'%user_id,
+        'name': 'User %d'%user_id,
+        'followers_count': seed_of(user_id) % 5000,
+        'friends_count': seed_of(user_id + 1) % 2000,
+        'statuses_count': seed_of(user_id + 2) % 20000,
+        'created_at': twitter_time(TWEPOCH),
+        'protected': False
+    }
+
+def make_tweet(tweet_id, user_id, text = None, coordinates = None):
+    tweet = {
+        'id': tweet_id,
+        'id_str': '%d'%tweet_id,
+        'created_at': twitter_time(snowflake_ms(tweet_id)),
+        'text': text if text else 'synthetic tweet %d'%tweet_id,
+        'lang': 'en',
+        'user': make_user(user_id),
+        'retweet_count': 0,
+        'favorite_count': 0,
+        'entities': {'hashtags': [], 'urls': [], 'user_mentions': []},
+        'coordinates': None,
+        'place': None
+    }
+
+    if coordinates:
+        tweet['coordinates'] = {'type': 'Point', 'coordinates': coordinates}
+
+    return tweet
+
+class TweetSequence(object):
+    '''
+    the tweets of one query or user: tweet k is created at start + k * interval, with a snowflake id (so ids grow with k); only the newest size of them are reachable, like search and timelines
+    '''
+    def __init__(self, seed, rate, size, now_ms):
+
+        self.interval = max(1, int(1000 / rate)) # ms; ids only grow with k if it's at least 1ms
+        self.size = size
+        self.worker = seed & 0x3fe # never RETWEET_WORKER
+        self.start = int(now_ms) - size * self.interval
+
+    def id_of(self, k):
+        return snowflake(self.start + k * self.interval, self.worker, k)
+
+    def k_at_or_below(self, tweet_id):
+        k = (snowflake_ms(tweet_id) - self.start) // self.interval
+        if k >= 0 and self.id_of(k) > tweet_id:
+            k -= 1
+        return k
+
+    def page(self, now_ms, since_id = 0, max_id = None, count = 100):
+        '''
+        the ids of since_id < id <= max_id, newest first
+        '''
+        newest = (int(now_ms) - self.start) // self.interval
+        oldest = newest - self.size + 1
+
+        hi = min(newest, self.k_at_or_below(max_id)) if max_id else newest
+        lo = max(oldest, self.k_at_or_below(since_id) + 1) if since_id else oldest
+
+        return [self.id_of(k) for k in range(hi, max(lo, hi - count + 1) - 1, -1)]
+
+class FakeTwitter(object):
+
+    def __init__(self, config = None):
+
+        config = config if config else {}
+
+        self.config = copy.deepcopy(DEFAULT_CONFIG)
+        self.config.update(dict((k, v) for k, v in config.items() if k != 'rate_limits'))
+        self.config['rate_limits'].update(config.get('rate_limits', {}))
+
+        self.lock = threading.Lock()
+        self.tokens = {} # access_token -> (app_key, issued at)
+        self.windows = {} # (app_key, endpoint) -> (reset, remaining)
+        self.sequences = {}
+        self.random = random.Random(0)
+
+        self.stats = {'calls': {}, 'keys': {}, 'rate_limited': 0, 'errors': 0, 'unauthorized': 0, 'tokens': 0, 'tweets': 0, 'stream_tweets': 0, 'stream_connections': 0}
+
+    def count(self, key, n = 1, endpoint = None, app_key = None):
+        with self.lock:
+            if endpoint:
+                self.stats['calls'][endpoint] = self.stats['calls'].get(endpoint, 0) + n
+                self.stats['keys'][app_key] = self.stats['keys'].get(app_key, 0) + n
+            else:
+                self.stats[key] += n
+
+    def issue_token(self, app_key):
+
+        with self.lock:
+            self.stats['tokens'] += 1
+            access_token = 'AAAA%s'%md5(('%s:%d:%f'%(app_key, self.stats['tokens'], time.time())).encode('utf-8'))
+            self.tokens[access_token] = (app_key, time.time())
+
+        return access_token
+
+    def app_key_of(self, authorization):
+        '''
+        the app key behind a bearer token (None if unknown or expired), or the oauth_consumer_key of an oauth1 header
+        '''
+        if not authorization:
+            return None
+
+        if authorization.startswith('Bearer '):
+            with self.lock:
+                app_key, issued = self.tokens.get(authorization[7:], (None, 0))
+
+            if app_key and self.config['token_ttl'] and time.time() - issued > self.config['token_ttl']:
+                return None
+
+            return app_key
+
+        if authorization.startswith('OAuth '):
+            for part in authorization[6:].split(','):
+                name, _, value = part.strip().partition('=')
+                if name == 'oauth_consumer_key':
+                    return value.strip('"')
+
+        return None
+
+    def take(self, app_key, endpoint):
+        '''
+        one call from the budget of (app_key, endpoint); (allowed, limit, remaining, reset)
+        '''
+        limit = self.config['rate_limits'].get(endpoint, 900)
+        now = time.time()
+
+        with self.lock:
+            reset, remaining = self.windows.get((app_key, endpoint), (0, limit))
+            if now >= reset:
+                reset, remaining = int(now) + self.config['window'], limit
+
+            allowed = remaining > 0
+            if allowed:
+                remaining -= 1
+
+            self.windows[(app_key, endpoint)] = (reset, remaining)
+
+        return allowed, limit, remaining, reset
+
+    def sequence(self, kind, seed):
+
+        with self.lock:
+            if (kind, seed) not in self.sequences:
+                if kind == 'search':
+                    self.sequences[(kind, seed)] = TweetSequence(seed_of(seed), self.config['search_rate'], self.config['search_size'], time.time() * 1000)
+                else:
+                    self.sequences[(kind, seed)] = TweetSequence(seed_of(seed), self.config['timeline_rate'], self.config['timeline_size'], time.time() * 1000)
+
+            return self.sequences[(kind, seed)]
+
+    def recorded(self, endpoint):
+
+        if not self.config['recorded']:
+            return None
+
+        filename = os.path.join(self.config['recorded'], '%s.json'%endpoint.strip('/'))
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    def search(self, params):
+
+        query = params.get('q', '')
+        tweets_id = self.sequence('search', query).page(time.time() * 1000, int(params.get('since_id', 0) or 0), int(params.get('max_id', 0) or 0), min(int(params.get('count', 15)), 100))
+
+        statuses = [make_tweet(tweet_id, seed_of(tweet_id) % 100000000, text = '%s %d'%(query, tweet_id)) for tweet_id in tweets_id]
+
+        return {'statuses': statuses, 'search_metadata': {'count': len(statuses), 'query': query, 'max_id': tweets_id[0] if tweets_id else 0, 'since_id': int(params.get('since_id', 0) or 0)}}
+
+    def user_timeline(self, params):
+
+        user_id = int(params.get('user_id', 0) or seed_of(params.get('screen_name', '')))
+        tweets_id = self.sequence('timeline', user_id).page(time.time() * 1000, int(params.get('since_id', 0) or 0), int(params.get('max_id', 0) or 0), min(int(params.get('count', 20)), 200))
+
+        return [make_tweet(tweet_id, user_id) for tweet_id in tweets_id]
+
+    def exists(self, tweet_id):
+
+        if self.config['lookup_machines'] and machine_of(tweet_id) not in self.config['lookup_machines']:
+            return False
+
+        if self.config['lookup_sequences'] and (tweet_id & 0xfff) >= self.config['lookup_sequences']:
+            return False
+
+        return ((tweet_id * 2654435761) % (2 ** 32)) < self.config['lookup_hit_rate'] * (2 ** 32)
+
+    def lookup(self, params):
+
+        tweets_id = [int(tweet_id) for tweet_id in params.get('id', '').split(',') if tweet_id][:100]
+
+        return [make_tweet(tweet_id, seed_of(tweet_id) % 100000000) for tweet_id in tweets_id if self.exists(tweet_id)]
+
+    def users(self, params):
+
+        if params.get('user_id'):
+            return [make_user(int(user_id)) for user_id in params['user_id'].split(',')[:100] if user_id]
+
+        return [make_user(seed_of(screen_name) % 100000000, screen_name) for screen_name in params.get('screen_name', '').split(',')[:100] if screen_name]
+
+    def relationships(self, endpoint, params):
+
+        user_id = int(params.get('user_id', 0) or seed_of(params.get('screen_name', '')))
+        total = seed_of('%s%d'%(endpoint, user_id)) % (self.config['relationships_size'] + 1)
+
+        ids = endpoint.endswith('/ids')
+        count = min(int(params.get('count', 5000 if ids else 20)), 5000 if ids else 200)
+
+        cursor = int(params.get('cursor', -1))
+        start = 0 if cursor == -1 else cursor
+        end = min(start + count, total)
+
+        related = [seed_of('%d:%d'%(user_id, i)) for i in range(start, end)]
+        next_cursor = end if end < total else 0
+        previous_cursor = -start if start > 0 else 0
+
+        result = {'next_cursor': next_cursor, 'next_cursor_str': '%d'%next_cursor, 'previous_cursor': previous_cursor, 'previous_cursor_str': '%d'%previous_cursor}
+        if ids:
+            result['ids'] = related
+        else:
+            result['users'] = [make_user(related_id) for related_id in related]
+
+        return result
+
+    def retweets(self, tweet_id, params):
+        '''
+        retweets_size retweets of an original tweet; a retweet (worker bits RETWEET_WORKER) of level n has retweets_size >> n of its own
+        '''
+        level = (tweet_id >> 8) & 0xf if ((tweet_id >> 12) & 0x3ff) == RETWEET_WORKER else 0
+        n = min(self.config['retweets_size'] >> level, int(params.get('count', 100)))
+
+        ms = snowflake_ms(tweet_id)
+        retweets = []
+        for i in range(n):
+            retweet_id = snowflake(ms + 1000 * (i + 1), RETWEET_WORKER, ((level + 1) << 8) | (seed_of(tweet_id) + i) & 0xff)
+            retweet = make_tweet(retweet_id, seed_of(retweet_id) % 100000000)
+            retweet['retweeted_status'] = make_tweet(tweet_id, seed_of(tweet_id) % 100000000)
+            retweets.append(retweet)
+
+        return retweets
+
+    def geo(self, params):
+
+        query = params.get('query', '')
+        lat = (seed_of(query) % 18000) / 100.0 - 90
+        lon = (seed_of(query[::-1]) % 36000) / 100.0 - 180
+
+        return {'result': {'places': [{
+            'id': md5(query.encode('utf-8'))[:16],
+            'name': query,
+            'full_name': query,
+            'place_type': 'city',
+            'country_code': 'US',
+            'bounding_box': {'type': 'Polygon', 'coordinates': [[[lon, lat], [lon + 0.5, lat], [lon + 0.5, lat + 0.5], [lon, lat + 0.5]]]}
+        }]}, 'query': {'params': params}}
+
+    def respond(self, endpoint, params):
+        '''
+        (status_code, body) of a REST endpoint
+        '''
+        recorded = self.recorded(endpoint)
+        if recorded is not None:
+            return 200, recorded
+
+        if endpoint in ('/statuses/user_timeline', '/friends/ids', '/friends/list', '/followers/ids', '/followers/list') and int(params.get('user_id', 0) or 0) in self.config['protected_users']:
+            return 401, {'request': '/1.1%s.json'%endpoint, 'error': 'Not authorized.'}
+
+        if endpoint == '/search/tweets':
+            result = self.search(params)
+            self.count('tweets', len(result['statuses']))
+        elif endpoint == '/statuses/user_timeline':
+            result = self.user_timeline(params)
+            self.count('tweets', len(result))
+        elif endpoint == '/statuses/lookup':
+            result = self.lookup(params)
+            self.count('tweets', len(result))
+        elif endpoint == '/users/lookup':
+            result = self.users(params)
+        elif endpoint in ('/friends/ids', '/friends/list', '/followers/ids', '/followers/list'):
+            result = self.relationships(endpoint, params)
+        elif endpoint.startswith('/statuses/retweets/'):
+            result = self.retweets(int(endpoint.rsplit('/', 1)[1]), params)
+            self.count('tweets', len(result))
+        elif endpoint == '/geo/search':
+            result = self.geo(params)
+        else:
+            return 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]}
+
+        return 200, result
+
+    def stream_tweets(self, params):
+        '''
+        an endless iterator of stream tweets; recorded ones (in a loop) if there are any; with locations, the coordinates fall inside the first box
+        '''
+        if self.config['recorded']:
+            filename = os.path.join(self.config['recorded'], 'statuses', 'sample.jsonl')
+            if os.path.exists(filename):
+                while True:
+                    with open(filename, 'r') as f:
+                        for line in f:
+                            if line.strip():
+                                yield json.loads(line)
+
+        box = None
+        if params.get('locations'):
+            box = [float(x) for x in params['locations'].split(',')[:4]]
+
+        rng = random.Random()
+        sequence = 0
+        while True:
+            sequence = (sequence + 1) & 0xfff
+            tweet_id = snowflake(time.time() * 1000, rng.randint(0, 0x3fe), sequence)
+
+            coordinates = [rng.uniform(box[0], box[2]), rng.uniform(box[1], box[3])] if box else None
+            yield make_tweet(tweet_id, rng.randint(1, 100000000), text = params.get('track'), coordinates = coordinates)
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format%args)
+
+    def params(self):
+
+        url = urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            if 'json' not in (self.headers.get('Content-Type') or ''):
+                params.update(dict((k, v[-1]) for k, v in parse_qs(body).items()))
+
+        return url.path, params
+
+    def send_json(self, status_code, body, headers = None):
+
+        data = json.dumps(body).encode('utf-8')
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', '%d'%len(data))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_GET(self):
+        self.handle_request()
+
+    def handle_request(self):
+
+        twitter = self.server.twitter
+        config = twitter.config
+        path, params = self.params()
+
+        if path == '/stats':
+            with twitter.lock:
+                return self.send_json(200, twitter.stats)
+
+        if path == '/oauth2/token':
+            return self.token()
+
+        if not path.startswith('/1.1/') or not path.endswith('.json'):
+            return self.send_json(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]})
+
+        endpoint = path[4:-5]
+
+        if endpoint in ('/statuses/sample', '/statuses/filter'):
+            return self.stream(params)
+
+        if config['latency']:
+            time.sleep(config['latency'])
+
+        app_key = twitter.app_key_of(self.headers.get('Authorization'))
+        if not app_key:
+            twitter.count('unauthorized')
+            return self.send_json(401, {'errors': [{'code': 89, 'message': 'Invalid or expired token.'}]})
+
+        name = '/statuses/retweets/:id' if endpoint.startswith('/statuses/retweets/') else endpoint
+        twitter.count(None, endpoint = name, app_key = app_key)
+
+        if config['error_rate'] and twitter.random.random() < config['error_rate']:
+            twitter.count('errors')
+            return self.send_json(503, {'errors': [{'code': 130, 'message': 'Over capacity'}]})
+
+        allowed, limit, remaining, reset = twitter.take(app_key, name)
+
+        if config['throttle_rate'] and twitter.random.random() < config['throttle_rate']:
+            allowed = False
+
+        headers = {'x-rate-limit-limit': '%d'%limit, 'x-rate-limit-remaining': '%d'%remaining, 'x-rate-limit-reset': '%d'%reset}
+
+        if not allowed:
+            twitter.count('rate_limited')
+            return self.send_json(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, headers)
+
+        status_code, body = twitter.respond(endpoint, params)
+        self.send_json(status_code, body, headers)
+
+    def token(self):
+
+        authorization = self.headers.get('Authorization', '')
+
+        try:
+            app_key = base64.b64decode(authorization[6:]).decode('utf-8').split(':')[0] if authorization.startswith('Basic ') else None
+        except Exception:
+            app_key = None
+
+        if not app_key:
+            return self.send_json(403, {'errors': [{'code': 99, 'message': 'Unable to verify your credentials'}]})
+
+        self.send_json(200, {'token_type': 'bearer', 'access_token': self.server.twitter.issue_token(app_key)})
+
+    def stream(self, params):
+        '''
+        chunked json lines at stream_rate tweets/sec, sent in batches every 10ms
+        '''
+        twitter = self.server.twitter
+        config = twitter.config
+
+        twitter.count('stream_connections')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        tweets = twitter.stream_tweets(params)
+        batch = max(1, int(config['stream_rate'] / 100))
+        sent = 0
+
+        try:
+            while not config['stream_limit'] or sent < config['stream_limit']:
+                started = time.time()
+
+                data = ''.join('%s\r\n'%json.dumps(next(tweets)) for _ in range(batch)).encode('utf-8')
+                self.wfile.write(b'%x\r\n%s\r\n'%(len(data), data))
+                self.wfile.flush()
+
+                sent += batch
+                twitter.count('stream_tweets', batch)
+
+                time.sleep(max(0, batch / float(config['stream_rate']) - (time.time() - started)))
+
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        self.close_connection = True
+
+class FakeTwitterServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address = ('127.0.0.1', 0), config = None, twitter = None):
+        '''
+        pass the twitter of another server to share its state, e.g., extra listeners used as proxies (an absolute-uri proxy request is served like a direct one)
+        '''
+        self.twitter = twitter if twitter else FakeTwitter(config)
+        super(FakeTwitterServer, self).__init__(address, FakeTwitterHandler)
+
+    @property
+    def url(self):
+        return 'http://%s:%d'%self.server_address[:2]
+
+    def start(self):
+        '''
+        serve from a daemon thread; returns the base url (for api_url / stream_url)
+        '''
+        thread = threading.Thread(target=self.serve_forever, name='fake-twitter')
+        thread.daemon = True
+        thread.start()
+
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-host','--host', help="address to listen on", default="127.0.0.1")
+    parser.add_argument('-port','--port', help="port to listen on", type=int, default=8000)
+    parser.add_argument('-cfg','--config', help="json file that overrides DEFAULT_CONFIG (e.g., rate_limits)", default=None)
+    parser.add_argument('-latency','--latency', help="seconds per response", type=float, default=None)
+    parser.add_argument('-error_rate','--error_rate', help="fraction of 503s", type=float, default=None)
+    parser.add_argument('-throttle_rate','--throttle_rate', help="fraction of spurious 429s", type=float, default=None)
+    parser.add_argument('-window','--window', help="rate limit window in seconds", type=int, default=None)
+    parser.add_argument('-token_ttl','--token_ttl', help="seconds a bearer token stays valid (0: forever)", type=int, default=None)
+    parser.add_argument('-stream_rate','--stream_rate', help="tweets per second per stream connection", type=int, default=None)
+    parser.add_argument('-r','--recorded', help="folder of recorded responses", default=None)
+
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(os.path.abspath(args.config), 'r') as config_f:
+            config = json.load(config_f)
+
+    for name in ['latency', 'error_rate', 'throttle_rate', 'window', 'token_ttl', 'stream_rate', 'recorded']:
+        if getattr(args, name) is not None:
+            config[name] = getattr(args, name)
+
+    server = FakeTwitterServer((args.host, args.port), config)
+    logger.info('fake twitter on %s'%server.url)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+frontier.py: a disk-backed, level-synchronous BFS frontier (e.g., retweets of retweets), resumable after a crash or Ctrl+C
+
+BfsFrontier(folder):
+  <folder>/level.<n>.ids: the ids to expand on level n (uint64, appended as they are found on level n - 1)
+  <folder>/level.<n>.done: the ids of level n already expanded
+  <folder>/visited/: a DedupIndex (see dedup_index.py) of every id ever put on a level, so nothing is expanded twice
+  <folder>/state.json: the current level; it only moves once every id of the level is done (the per-level checkpoint)
+
+pending() is what's left of the current level; done(id, children) appends the unvisited children to the next level, then marks id done; a crash in between only expands id again, its children are already visited
+
+python frontier.py -f tweets_ids.json.frontier prints the progress of a crawl
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, argparse, threading, shutil
+import numpy as np
+from dedup_index import DedupIndex
+
+CAPACITY = 10000000 # ids the bloom filter of the visited set is sized for
+
+class BfsFrontier(object):
+
+    def __init__(self, folder, capacity = CAPACITY):
+
+        self.folder = os.path.abspath(folder)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self.state_filename = os.path.join(self.folder, 'state.json')
+
+        self.state = {'level': 0, 'finished': False}
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, 'r') as f:
+                self.state.update(json.load(f))
+
+        self.capacity = capacity
+        self.visited = DedupIndex(os.path.join(self.folder, 'visited'), capacity = capacity)
+
+        # the ids of the current and the next level may have been found after the last flush of the index
+        for level in [self.level, self.level + 1]:
+            self.visited.add(self.ids(level))
+
+        self._lock = threading.Lock()
+        self._next = open(self.ids_filename(self.level + 1), 'ab')
+        self._done = open(self.done_filename(self.level), 'ab')
+
+    @property
+    def level(self):
+        return self.state['level']
+
+    @property
+    def finished(self):
+        return self.state['finished']
+
+    def ids_filename(self, level):
+        return os.path.join(self.folder, 'level.%d.ids'%level)
+
+    def done_filename(self, level):
+        return os.path.join(self.folder, 'level.%d.done'%level)
+
+    def _read(self, filename):
+        if not os.path.exists(filename):
+            return np.zeros(0, dtype=np.uint64)
+
+        # a crash in the middle of an append leaves a partial id
+        ids = np.fromfile(filename, dtype=np.uint8)
+        return ids[: len(ids) // 8 * 8].view(np.uint64)
+
+    def ids(self, level):
+        return self._read(self.ids_filename(level))
+
+    def _save_state(self):
+        tmp_filename = '%s.tmp'%self.state_filename
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.state, f)
+
+        os.replace(tmp_filename, self.state_filename)
+
+    def seed(self, ids):
+        '''
+        the ids of level 0; ignored once the crawl has started
+        '''
+        if self.level > 0 or len(self.ids(0)):
+            return 0
+
+        with self._lock:
+            new_ids = np.asarray(sorted(ids), dtype=np.uint64)
+            new_ids = new_ids[self.visited.add(new_ids)]
+
+            with open(self.ids_filename(0), 'ab') as f:
+                f.write(new_ids.tobytes())
+
+            return len(new_ids)
+
+    def pending(self):
+        '''
+        the ids of the current level that aren't done
+        '''
+        with self._lock:
+            self._done.flush()
+            return np.setdiff1d(self.ids(self.level), self._read(self.done_filename(self.level))).tolist()
+
+    def done(self, node_id, children = []):
+        '''
+        node_id was expanded into children; returns how many of them are new
+        '''
+        with self._lock:
+            children = np.asarray(sorted(children), dtype=np.uint64)
+            new_ids = children[self.visited.add(children)]
+
+            if len(new_ids):
+                self._next.write(new_ids.tobytes())
+                self._next.flush()
+
+            self._done.write(np.asarray([node_id], dtype=np.uint64).tobytes())
+            self._done.flush()
+
+            return len(new_ids)
+
+    def next_level(self):
+        '''
+        the checkpoint of a finished level; False if the next level is empty (the crawl is finished)
+        '''
+        with self._lock:
+            self._next.close()
+            self._done.close()
+
+            # the index first: once the level moves, only the new current and next levels are re-added on a restart
+            self.visited.flush()
+
+            self.state['level'] += 1
+            self.state['finished'] = not len(self.ids(self.state['level']))
+            self._save_state()
+
+            self._next = open(self.ids_filename(self.level + 1), 'ab')
+            self._done = open(self.done_filename(self.level), 'ab')
+
+            return not self.finished
+
+    def finish(self):
+        '''
+        stops before the next level (e.g., the level limit is reached)
+        '''
+        with self._lock:
+            self.state['finished'] = True
+            self._save_state()
+
+    def stats(self):
+        return {'level': self.level, 'finished': self.finished, 'visited': len(self.visited), 'levels': dict((level, len(self.ids(level))) for level in range(self.level + 2) if os.path.exists(self.ids_filename(level))), 'done': len(self._read(self.done_filename(self.level)))}
+
+    def close(self):
+        with self._lock:
+            self._next.close()
+            self._done.close()
+            self.visited.close()
+
+    def reset(self):
+        '''
+        forgets the crawl (e.g., to start a finished one over)
+        '''
+        self.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.__init__(self.folder, self.capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--folder', help="folder of the frontier", required=True)
+
+    args = parser.parse_args()
+
+    with BfsFrontier(args.folder) as frontier:
+        logger.info(json.dumps(frontier.stats()))
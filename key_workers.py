@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+key_workers.py: one long-lived process per api key, instead of a new process (and a new crawler, proxy check and bearer token) for every unit of work
+
+KeyWorkerPool: submit(available, task, *args) runs task(crawler, *args) in the process bound to available, and returns a concurrent.futures.Future of (available, result), i.e., the same thing the *_worker functions return through a ProcessPoolExecutor; result is None if the task raised
+
+the crawler is built once per process by crawler_factory(available, apikey_proxy_pairs_dict, **factory_kwargs), and rebuilt only after a task fails (e.g., the proxy died)
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import signal, threading, itertools, time
+import multiprocessing as mp
+import concurrent.futures
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+POLL_INTERVAL = 5 # seconds; how often the collector checks that every process is still alive
+
+def key_worker_loop(available, apikey_proxy_pairs_dict, crawler_factory, factory_kwargs, task_queue, result_queue):
+
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    crawler = None
+
+    while True:
+        item = task_queue.get()
+        if item is None:
+            break
+
+        task_id, task, args = item
+
+        try:
+            if crawler is None:
+                crawler = crawler_factory(available, apikey_proxy_pairs_dict, **factory_kwargs)
+
+            result_queue.put((task_id, task(crawler, *args), None))
+        except Exception as exc:
+            logger.error('[%s] %s'%(available, exc))
+            crawler = None
+            result_queue.put((task_id, None, '%s'%exc))
+
+class KeyWorkerPool(object):
+
+    def __init__(self, keys, apikey_proxy_pairs_dict, crawler_factory, **factory_kwargs):
+
+        self.apikey_proxy_pairs_dict = apikey_proxy_pairs_dict
+        self.crawler_factory = crawler_factory
+        self.factory_kwargs = factory_kwargs
+
+        self.result_queue = mp.Queue()
+        self.task_queues = {}
+        self.processes = {}
+
+        self._pending = {} # task_id -> (available, future)
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._shutdown = False
+
+        for available in keys:
+            self._start(available)
+
+        self._collector = threading.Thread(target=self._collect, name='key-workers-collector')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def _start(self, available):
+
+        self.task_queues[available] = mp.Queue()
+
+        process = mp.Process(target=key_worker_loop, name='key-worker-%s'%available, args=(available, self.apikey_proxy_pairs_dict, self.crawler_factory, self.factory_kwargs, self.task_queues[available], self.result_queue))
+        process.daemon = True
+        process.start()
+
+        self.processes[available] = process
+        logger.info('[%s] key worker started: [%d]'%(available, process.pid))
+
+    def submit(self, available, task, *args):
+
+        if self._shutdown:
+            raise RuntimeError('cannot submit after shutdown')
+
+        if available not in self.task_queues:
+            raise KeyError('no key worker for [%s]'%available)
+
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (available, future)
+
+        self.task_queues[available].put((task_id, task, args))
+
+        return future
+
+    def _resolve(self, task_id, result):
+
+        with self._lock:
+            available, future = self._pending.pop(task_id, (None, None))
+
+        if future:
+            future.set_result((available, result))
+
+    def _restart_dead(self):
+        '''
+        a process that died (e.g., killed by the oom killer) takes its queued tasks with it; resolve those with None and start a new one
+        '''
+        for available, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            logger.warn('[%s] key worker [%d] died (exitcode: %s), restarting'%(available, process.pid, process.exitcode))
+
+            with self._lock:
+                lost = [task_id for task_id in self._pending if self._pending[task_id][0] == available]
+
+            for task_id in lost:
+                self._resolve(task_id, None)
+
+            self._start(available)
+
+    def _collect(self):
+
+        # on a timer, not only when the queue is idle: the other workers can keep it busy while a dead one's futures never resolve
+        last_check = time.time()
+
+        while True:
+            try:
+                item = self.result_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._shutdown and not self._pending:
+                    break
+
+                item = False
+
+            if item is None:
+                break
+
+            if item:
+                task_id, result, error = item
+                self._resolve(task_id, result)
+
+            if not self._shutdown and time.time() - last_check >= POLL_INTERVAL:
+                self._restart_dead()
+                last_check = time.time()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, wait=True):
+
+        if self._shutdown:
+            return
+
+        self._shutdown = True
+
+        for available in self.task_queues:
+            self.task_queues[available].put(None)
+
+        if wait:
+            for available in self.processes:
+                self.processes[available].join()
+
+            self.result_queue.put(None)
+            self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+        return False
@@ -0,0 +1,710 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+output_writer.py: long-lived, buffered writers for tweets
+
+JsonLinesWriter: keeps one file open (append mode) and buffers json lines; the buffer is flushed to disk once it passes buffer_size bytes or flush_interval seconds, whichever comes first; write_records() buffers a whole response at once
+
+DailyWriter: the <output_folder>/<%Y-%m>/<%Y%m%d>.json layout used by TwitterStreamer; keeps the current day file open and rolls over to a new file at midnight
+
+SegmentWriter: compressed (gzip or zstd) json lines, written as independently decodable frames into segments rotated by size or time; read them back with read_records()
+
+open_writer(): JsonLinesWriter or SegmentWriter, depending on output_format (json, gzip, zstd); shared_writer(): the same, but kept open for the life of the process; kept_writer(): compressed files written by one task after another (a search, a user timeline) stay open between tasks, so they go on in the same segment
+
+QueuedWriter: wraps another writer; write() only puts the record on a bounded queue and a writer thread does the serialization and disk I/O, so a slow disk doesn't back up the caller (e.g., the stream socket)
+
+python output_writer.py -n 200000 compares the per-tweet open/append path with DailyWriter and QueuedWriter (tweets/sec)
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, time, datetime, re, io, collections
+import threading, queue, tempfile
+import gzip, zlib
+from exceptions import InvalidConfig
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUFFER_SIZE = 1024 * 1024 # bytes
+FLUSH_INTERVAL = 5 # seconds
+QUEUE_SIZE = 100000 # records
+OVERFLOW_POLICIES = ['block', 'spill', 'drop']
+SEGMENT_SIZE = 256 * 1024 * 1024 # compressed bytes per segment
+OUTPUT_FORMATS = ['json', 'gzip', 'zstd']
+SEGMENT_EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+MAX_KEPT_WRITERS = 256 # segments kept open per process by kept_writer()
+
+class JsonLinesWriter(object):
+
+    def __init__(self, filename, buffer_size = BUFFER_SIZE, flush_interval = FLUSH_INTERVAL, mode = 'a'):
+
+        self.filename = os.path.abspath(filename)
+
+        folder = os.path.dirname(self.filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self._f = open(self.filename, mode)
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.time()
+
+        self.counter = 0
+
+    def write(self, record):
+        self.write_line(json.dumps(record))
+
+    def write_line(self, line):
+        self._buffer.append('%s\n'%line)
+        self._buffered += len(line) + 1
+        self.counter += 1
+
+        if self._buffered >= self.buffer_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_records(self, records):
+        '''
+        the records of one response as a single buffered chunk
+        '''
+        if not records:
+            return
+
+        chunk = ''.join(['%s\n'%json.dumps(record) for record in records])
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        self.counter += len(records)
+
+        if self._buffered >= self.buffer_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._f.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+        self._f.flush()
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._f.closed:
+            return
+
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# folder: {prefix name: the next segment number to try}; a folder is listed once per process, not on every segment opened in it (a day folder holds the segments of every user)
+_next_segments = {}
+_next_segments_lock = threading.Lock()
+SEGMENT_PATTERN = re.compile(r'^(.+)\.(\d+)\.json\.(gz|zst)$')
+
+def next_segments(folder):
+    '''
+    {prefix name: the number after its last segment} of the segments in folder, listed the first time folder is asked for; call with _next_segments_lock held
+    '''
+    if folder not in _next_segments:
+        seqs = {}
+        for f in os.listdir(folder):
+            m = SEGMENT_PATTERN.match(f)
+            if m:
+                seqs[m.group(1)] = max(seqs.get(m.group(1), 0), int(m.group(2)) + 1)
+
+        _next_segments[folder] = seqs
+
+    return _next_segments[folder]
+
+class SegmentWriter(object):
+    '''
+    <prefix>.<n>.json.gz (or .json.zst)
+
+    every flush() compresses the buffered lines into one frame (a gzip member or a zstd frame) and appends it with a single write; a crash can at most truncate the last frame of the open segment, and a segment is never reopened (a new writer starts a new segment), so earlier data is never touched
+
+    the open segment is closed once it passes segment_size bytes or is older than segment_interval seconds (None: no time limit)
+    '''
+
+    def __init__(self, prefix, compression = 'gzip', segment_size = SEGMENT_SIZE, segment_interval = None, buffer_size = BUFFER_SIZE, flush_interval = FLUSH_INTERVAL, mode = 'a'):
+
+        if compression not in SEGMENT_EXTENSIONS:
+            raise InvalidConfig('unknown compression: %s'%compression)
+
+        if compression == 'zstd' and not zstandard:
+            raise InvalidConfig('zstd output requires the zstandard package')
+
+        self.prefix = os.path.abspath(prefix)
+        self.compression = compression
+        self.segment_size = segment_size
+        self.segment_interval = segment_interval
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        folder = os.path.dirname(self.prefix)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        if mode == 'w':
+            for filename in list_segments(self.prefix):
+                os.remove(filename)
+
+            with _next_segments_lock:
+                next_segments(folder).pop(os.path.basename(self.prefix), None)
+
+        self._compressor = zstandard.ZstdCompressor() if compression == 'zstd' else None
+
+        self._f = None
+        self._segment_bytes = 0
+        self._segment_opened = 0
+
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.time()
+
+        self.counter = 0
+
+    def _compress(self, data):
+        if self._compressor:
+            return self._compressor.compress(data)
+        return gzip.compress(data)
+
+    def _open_segment(self):
+        if self._f:
+            self._f.close()
+
+        with _next_segments_lock:
+            seqs = next_segments(os.path.dirname(self.prefix))
+            seq = seqs.get(os.path.basename(self.prefix), 0)
+
+            # other processes may be opening segments with the same prefix
+            while True:
+                self.filename = '%s.%05d.json.%s'%(self.prefix, seq, SEGMENT_EXTENSIONS[self.compression])
+                try:
+                    self._f = open(self.filename, 'xb')
+                    break
+                except FileExistsError:
+                    seq += 1
+
+            seqs[os.path.basename(self.prefix)] = seq + 1
+
+        self._segment_bytes = 0
+        self._segment_opened = time.time()
+
+    def _segment_full(self):
+        if self._segment_bytes >= self.segment_size:
+            return True
+
+        return self.segment_interval is not None and time.time() - self._segment_opened >= self.segment_interval
+
+    def write(self, record):
+        self.write_line(json.dumps(record))
+
+    def write_line(self, line):
+        self._buffer.append('%s\n'%line)
+        self._buffered += len(line) + 1
+        self.counter += 1
+
+        if self._buffered >= self.buffer_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_records(self, records):
+        '''
+        the records of one response as a single buffered chunk
+        '''
+        if not records:
+            return
+
+        chunk = ''.join(['%s\n'%json.dumps(record) for record in records])
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        self.counter += len(records)
+
+        if self._buffered >= self.buffer_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            if not self._f or self._segment_full():
+                self._open_segment()
+
+            frame = self._compress(''.join(self._buffer).encode('utf-8'))
+            self._f.write(frame)
+            self._f.flush()
+
+            self._segment_bytes += len(frame)
+            self._buffer = []
+            self._buffered = 0
+
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def segment_number(filename):
+    return int(filename.rsplit('.', 3)[-3])
+
+def list_segments(prefix):
+    '''
+    segments written by SegmentWriter(prefix), in order
+    '''
+    folder, name = os.path.split(os.path.abspath(prefix))
+    if not os.path.exists(folder):
+        return []
+
+    pattern = re.compile(r'^%s\.\d+\.json\.(gz|zst)$'%re.escape(name))
+    segments = [os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f)]
+
+    return sorted(segments, key=segment_number)
+
+def zstd_chunks(filename, chunk_size = 1 << 16):
+    '''
+    the decompressed data of a .zst file, frame after frame; what was decoded before a corrupt or truncated frame is still returned
+    '''
+    dctx = zstandard.ZstdDecompressor()
+
+    with open(filename, 'rb') as f:
+        dobj = dctx.decompressobj()
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+
+            while data:
+                chunk = dobj.decompress(data)
+                if chunk:
+                    yield chunk
+
+                data = b''
+                if dobj.eof:
+                    data = dobj.unused_data
+                    dobj = dctx.decompressobj()
+
+def split_lines(chunks):
+
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+
+        for line in lines:
+            yield line + b'\n'
+
+    if pending:
+        yield pending
+
+def read_lines(filename):
+    '''
+    yields the lines (bytes) of a .json, .json.gz or .json.zst file one at a time, without decompressing the whole file; a truncated last frame (e.g., the writer crashed) ends the iteration
+    '''
+    if filename.endswith('.zst'):
+        if not zstandard:
+            raise InvalidConfig('reading %s requires the zstandard package'%filename)
+
+        try:
+            for line in split_lines(zstd_chunks(filename)):
+                yield line
+        except zstandard.ZstdError as exc:
+            logger.warn('[%s] is truncated: %s'%(filename, exc))
+        return
+
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rb')
+        errors = (EOFError, zlib.error, OSError)
+    else:
+        f = open(filename, 'rb')
+        errors = ()
+
+    with f:
+        try:
+            for line in f:
+                yield line
+        except errors as exc:
+            logger.warn('[%s] is truncated: %s'%(filename, exc))
+
+def read_records(filename):
+    '''
+    the records of read_lines(filename); a truncated last line ends the iteration
+    '''
+    for line in read_lines(filename):
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            logger.warn('[%s] is truncated: %s'%(filename, exc))
+            return
+
+        yield record
+
+def open_writer(filename, output_format = 'json', mode = 'a', **kwargs):
+    '''
+    json: a JsonLinesWriter on filename; gzip/zstd: a SegmentWriter with filename as the prefix of its segments
+    '''
+    if output_format == 'json':
+        kwargs.pop('segment_size', None)
+        kwargs.pop('segment_interval', None)
+        return JsonLinesWriter(filename, mode = mode, **kwargs)
+
+    return SegmentWriter(filename, compression = output_format, mode = mode, **kwargs)
+
+# writers that stay open for the life of the process (e.g., the day file of the history lookups, written by every call of a pool worker or key worker), instead of an open per call, which for compressed output also meant a segment per call
+_shared_writers = {}
+
+def shared_writer(filename, output_format = 'json', **kwargs):
+    '''
+    the open writer of filename in this process; opening a new one closes the others (the day rolled over)
+    '''
+    writer = _shared_writers.get(filename)
+
+    if writer is None:
+        close_shared_writers()
+        writer = _shared_writers[filename] = open_writer(filename, output_format, **kwargs)
+
+    return writer
+
+def close_shared_writers():
+    for filename in list(_shared_writers):
+        _shared_writers.pop(filename).close()
+
+class KeptWriter(object):
+    '''
+    a writer of kept_writer(); close() (e.g., the end of a with block) only flushes it, the segment stays open for the next task
+    '''
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, record):
+        self.writer.write(record)
+
+    def write_line(self, line):
+        self.writer.write_line(line)
+
+    def write_records(self, records):
+        self.writer.write_records(records)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# filename -> writer, the least recently used first
+_kept_writers = collections.OrderedDict()
+
+def kept_writer(filename, output_format = 'json', max_open = MAX_KEPT_WRITERS, **kwargs):
+    '''
+    gzip/zstd: the open SegmentWriter of filename in this process, so every pass of a search or a timeline appends to the same segment until it's rotated, instead of a new small segment per pass; past max_open, the least recently used is closed
+
+    json: a new JsonLinesWriter, as open_writer() (an append is cheap, and there are no segments)
+    '''
+    if output_format == 'json':
+        return open_writer(filename, output_format, **kwargs)
+
+    writer = _kept_writers.pop(filename, None)
+    if writer is None:
+        while len(_kept_writers) >= max_open:
+            _kept_writers.popitem(last=False)[1].close()
+
+        writer = open_writer(filename, output_format, **kwargs)
+
+    _kept_writers[filename] = writer
+
+    return KeptWriter(writer)
+
+def close_kept_writers():
+    while _kept_writers:
+        _kept_writers.popitem()[1].close()
+
+def next_midnight(now):
+    tomorrow = now.date() + datetime.timedelta(days=1)
+    return time.mktime(tomorrow.timetuple())
+
+class DailyWriter(object):
+
+    def __init__(self, output_folder, buffer_size = BUFFER_SIZE, flush_interval = FLUSH_INTERVAL, output_format = 'json', segment_size = SEGMENT_SIZE, segment_interval = None):
+
+        self.output_folder = os.path.abspath(output_folder)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.output_format = output_format
+        self.segment_size = segment_size
+        self.segment_interval = segment_interval
+
+        self._writer = None
+        self._rollover_at = 0
+
+        self.counter = 0
+        self.started = time.time()
+
+    def _open(self, now):
+        if self._writer:
+            self._writer.close()
+
+        if self.output_format == 'json':
+            output_file = os.path.abspath('%s/%s/%s.json'%(self.output_folder, now.strftime('%Y-%m'), now.strftime('%Y%m%d')))
+        else:
+            output_file = os.path.abspath('%s/%s/%s'%(self.output_folder, now.strftime('%Y-%m'), now.strftime('%Y%m%d')))
+        logger.info('writing to: [%s] (%s)'%(output_file, self.output_format))
+
+        self._writer = open_writer(output_file, self.output_format, buffer_size = self.buffer_size, flush_interval = self.flush_interval, segment_size = self.segment_size, segment_interval = self.segment_interval)
+        self._rollover_at = next_midnight(now)
+
+    def write(self, record):
+
+        if time.time() >= self._rollover_at:
+            self._open(datetime.datetime.now())
+
+        self._writer.write(record)
+        self.counter += 1
+
+    def rate(self):
+        '''
+        tweets/sec since this writer was created
+        '''
+        elapsed = time.time() - self.started
+        return self.counter / elapsed if elapsed > 0 else 0.0
+
+    def flush(self):
+        if self._writer:
+            self._writer.flush()
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._rollover_at = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class QueuedWriter(object):
+    '''
+    when the queue is full (overflow):
+        block: wait until the writer thread makes room (the caller sees the backpressure)
+        spill: append the record to a spill file; the writer thread reads it back once the queue is drained (records can be written out of order)
+        drop: discard the record and count it in self.dropped
+
+    a write that fails on the writer thread (disk full, a record that can't be serialized, ...) is logged and counted in self.errors, and the thread goes on draining the queue; the next write() raises the error instead of taking its record
+    '''
+
+    def __init__(self, writer, queue_size = QUEUE_SIZE, overflow = 'block', spill_folder = None, flush_interval = FLUSH_INTERVAL):
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow must be one of %s'%(OVERFLOW_POLICIES))
+
+        self.writer = writer
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spill_folder = spill_folder
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize = queue_size)
+
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self.spilled = 0 # records currently in the spill file
+        self.dropped = 0
+        self.max_depth = 0
+
+        self.errors = 0
+        self.error = None
+
+        self._thread = threading.Thread(target=self._run, name='QueuedWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, record):
+
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+
+        if self.overflow == 'block':
+            self._queue.put(record)
+        else:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                if self.overflow == 'spill':
+                    self._spill(record)
+                else:
+                    self.dropped += 1
+
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _spill(self, record):
+        with self._spill_lock:
+            if not self._spill_file:
+                self._spill_file = tempfile.NamedTemporaryFile(mode='w+', prefix='spill.', suffix='.json', dir=self.spill_folder, delete=False)
+                logger.warn('queue is full, spilling to [%s]'%self._spill_file.name)
+
+            self._spill_file.write('%s\n'%json.dumps(record))
+            self.spilled += 1
+
+    def _drain_spill(self):
+        with self._spill_lock:
+            spill_file = self._spill_file
+            self._spill_file = None
+            self.spilled = 0
+
+        spill_file.seek(0)
+        for line in spill_file:
+            self.writer.write(json.loads(line))
+
+        spill_file.close()
+        os.remove(spill_file.name)
+
+    def _guarded(self, func, *args):
+
+        try:
+            func(*args)
+        except Exception as exc:
+            logger.error('[QueuedWriter] %s'%exc)
+            self.errors += 1
+            self.error = exc
+
+    def _run(self):
+
+        while True:
+            try:
+                record = self._queue.get(timeout = self.flush_interval)
+            except queue.Empty:
+                if self._spill_file:
+                    self._guarded(self._drain_spill)
+                self._guarded(self.writer.flush)
+                continue
+
+            if record is None:
+                break
+
+            self._guarded(self.writer.write, record)
+
+            if self._spill_file and self._queue.empty():
+                self._guarded(self._drain_spill)
+
+        if self._spill_file:
+            self._guarded(self._drain_spill)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'queue_size': self.queue_size,
+            'spilled': self.spilled,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+    def rate(self):
+        return self.writer.rate()
+
+    def flush(self):
+        # the writer thread owns the file; it flushes whenever the queue is idle
+        pass
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        # the inner writer is closed whatever happened to the thread, so its buffer and the day file are not lost
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def per_tweet_append(output_folder, tweet):
+    '''
+    the original TwitterStreamer.on_success path, one open/append per tweet; kept for benchmarking
+    '''
+    now = datetime.datetime.now()
+    month_folder = os.path.abspath('%s/%s'%(output_folder, now.strftime('%Y-%m')))
+    if not os.path.exists(month_folder):
+        os.makedirs(month_folder)
+
+    output_file = os.path.abspath('%s/%s.json'%(month_folder, now.strftime("%Y%m%d")))
+
+    with open(output_file, 'a+') as f:
+        f.write('%s\n'%json.dumps(tweet))
+
+def benchmark(output_folder, n = 100000):
+
+    tweet = {'id': 1, 'id_str': '1', 'text': 'x' * 140, 'user': {'id': 1, 'screen_name': 'benchmark'}, 'entities': {'hashtags': [], 'urls': []}}
+
+    started = time.time()
+    for i in range(n):
+        tweet['id'] = i
+        per_tweet_append('%s/per_tweet'%output_folder, tweet)
+    per_tweet = n / (time.time() - started)
+
+    started = time.time()
+    with DailyWriter('%s/buffered'%output_folder) as writer:
+        for i in range(n):
+            tweet['id'] = i
+            writer.write(tweet)
+    buffered = n / (time.time() - started)
+
+    started = time.time()
+    with QueuedWriter(DailyWriter('%s/queued'%output_folder)) as writer:
+        for i in range(n):
+            writer.write(dict(tweet, id=i))
+        enqueued = n / (time.time() - started)
+    queued = n / (time.time() - started)
+
+    logger.info('per tweet open/append: %.1f tweets/sec'%per_tweet)
+    logger.info('DailyWriter: %.1f tweets/sec (%.1fx)'%(buffered, buffered / per_tweet))
+    logger.info('QueuedWriter: %.1f tweets/sec enqueued; %.1f tweets/sec written'%(enqueued, queued))
+
+    return per_tweet, buffered, queued
+
+if __name__=="__main__":
+    import argparse, tempfile
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o','--output', help="output folder for the benchmark (default: a temp folder)", default=None)
+    parser.add_argument('-n','--number', help="number of tweets to write", type=int, default=100000)
+
+    args = parser.parse_args()
+
+    output_folder = args.output if args.output else tempfile.mkdtemp()
+
+    benchmark(output_folder, args.number)
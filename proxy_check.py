@@ -12,7 +12,7 @@ from util import full_stack
 import requests, concurrent.futures, os, json
 import twython
 
-def check_proxy_twython(proxy, timeout):
+def check_proxy_twython(proxy, timeout, api_url = None):
     #APP_KEY = "TMsmNlRUDt3HckXGMduLrqKPz"
     #APP_SCRET = "dUk0pYMioi3oHvjIFXzfN5DPowGIy04A63FtoNH9zYePR14QOo"
     APP_KEY = "Zt9Zfm2dmvx3PWc5o9VS3AEkz"
@@ -39,6 +39,9 @@ def check_proxy_twython(proxy, timeout):
     }
 
     twitter = twython.Twython(APP_KEY, APP_SCRET, oauth_version=2, client_args=client_args)
+    if api_url:
+        # e.g., a fake_twitter.py server
+        twitter.request_token_url = '%s/oauth2/token'%api_url.rstrip('/')
 
     try:
         ACCESS_TOKEN = twitter.obtain_access_token()
@@ -89,7 +92,7 @@ def check_proxy(proxy, timeout):
         logger.info("proxy [%s] failed: %s"%(p['proxy'], exc))
         return False, None
 
-def proxy_checker(proxies):
+def proxy_checker(proxies, api_url = None):
     '''
         proxies is a list of {key:value}, where the key is the ip of the proxy (including port), e.g., 192.168.1.1:8080, and the value is the type of the proxy (http/https)
     '''
@@ -101,7 +104,7 @@ def proxy_checker(proxies):
     results = []
     with concurrent.futures.ProcessPoolExecutor(max_workers=mp.cpu_count()*10) as executor:
 
-        future_to_proxy = {executor.submit(check_proxy_twython, proxy, 5): proxy for proxy in proxies if list(proxy.values())[0] == 'http'}
+        future_to_proxy = {executor.submit(check_proxy_twython, proxy, 5, api_url): proxy for proxy in proxies if list(proxy.values())[0] == 'http'}
 
         for future in future_to_proxy:
             future.add_done_callback(lambda f: results.append(f.result()))
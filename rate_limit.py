@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+rate_limit.py: per (app key, endpoint) rate limit budgets, recorded from the x-rate-limit-* headers that come back with every response
+
+RateLimitTracker: record() after every response, wait() before every request; wait() only sleeps when the budget of that endpoint is used up, and then exactly until its x-rate-limit-reset
+
+the budgets live in a dict-like store keyed by (app_key, endpoint), so several trackers (e.g., in different processes, with a multiprocessing.Manager().dict()) can share them
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import re, time
+
+RESET_MARGIN = 1 # seconds past x-rate-limit-reset before calling again
+DEFAULT_RESET_WAIT = 60 # a 429 without x-rate-limit-reset
+
+def endpoint_name(endpoint):
+    '''
+    twython endpoint -> the name used by /application/rate_limit_status, e.g., statuses/retweets/123 -> /statuses/retweets/:id
+    '''
+    endpoint = endpoint.split('?')[0]
+    endpoint = re.sub(r'^https://[^/]+/1\.1/', '', endpoint)
+    endpoint = re.sub(r'\.json$', '', endpoint)
+    endpoint = re.sub(r'/\d+$', '/:id', endpoint)
+
+    return '/%s'%endpoint.strip('/')
+
+def parse_headers(headers):
+    '''
+    (limit, remaining, reset) or None if the response doesn't carry them
+    '''
+    try:
+        return int(headers['x-rate-limit-limit']), int(headers['x-rate-limit-remaining']), int(headers['x-rate-limit-reset'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class RateLimitTracker(object):
+
+    def __init__(self, app_key, store = None):
+        self.app_key = app_key
+        self.store = store if store is not None else {}
+
+    def record(self, endpoint, headers, status_code = 200):
+
+        budget = parse_headers(headers)
+
+        if status_code == 429:
+            limit, _, reset = budget if budget else (0, 0, int(time.time()) + DEFAULT_RESET_WAIT)
+            budget = (limit, 0, reset)
+
+        if budget:
+            self.store[(self.app_key, endpoint)] = budget
+
+    def budget(self, endpoint, now = None):
+        '''
+        (limit, remaining, reset) of endpoint; None if nothing has been recorded yet; a window that has already reset is reported as full
+        '''
+        budget = self.store.get((self.app_key, endpoint))
+        if not budget:
+            return None
+
+        limit, remaining, reset = budget
+        now = now if now else time.time()
+        if now > reset + RESET_MARGIN:
+            return limit, limit, reset
+
+        return budget
+
+    def wait_for(self, endpoint, now = None):
+        '''
+        seconds to wait before endpoint can be called again
+        '''
+        now = now if now else time.time()
+        budget = self.budget(endpoint, now)
+
+        if not budget or budget[1] > 0:
+            return 0
+
+        return budget[2] + RESET_MARGIN - now
+
+    def wait(self, endpoint):
+        wait_for = self.wait_for(endpoint)
+
+        if wait_for > 0:
+            logger.warn('[%s] rate limit of [%s] used up, sleep for %d'%(self.app_key, endpoint, wait_for))
+            time.sleep(wait_for)
+
+        return wait_for
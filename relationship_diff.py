@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+relationship_diff.py: friends/followers ids of the same users crawled again and again (e.g., every week), kept as the latest snapshot plus the added/removed ids of every crawl instead of a full snapshot per crawl
+
+RelationshipHistory(folder): one user and call
+  <folder>/latest.u64: the sorted ids of the last crawl
+  <folder>/deltas.u64: one record per crawl, [ms, n_added, n_removed, n_total, added..., removed...] (uint64); the first record is the first crawl (its ids are the snapshot itself, no arrays)
+
+update() diffs a fresh crawl against latest with sorted-array set operations (np.setdiff1d); snapshot(ms) rebuilds the ids of any earlier crawl by undoing the deltas after it, from the newest back. latest is replaced (atomically) only after its delta is appended, a crash in between is finished or rolled back on the next open
+
+RelationshipStore(folder): <folder>/<call>/<user_id>/ for every user
+
+python relationship_diff.py -s followers.history -c /followers/ids -i ./data/20190101 ingests the user files of a crawl (json pages or compressed segments, see twitter_tracker.py; -rm removes them once ingested), -g <csr folder> a CSR index (see edge_store.py) instead; -u <user_id> -at "2019-01-01" prints (-o writes) the ids of a user as they were then; -l lists the crawls of the users
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, re, json, time, argparse
+import numpy as np
+from output_writer import read_records, list_segments
+from snowflake import to_ms
+
+HEADER = 4 # uint64s per record before the arrays
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class RelationshipHistory(object):
+
+    def __init__(self, folder):
+
+        self.folder = os.path.abspath(folder)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self.latest_filename = os.path.join(self.folder, 'latest.u64')
+        self.deltas_filename = os.path.join(self.folder, 'deltas.u64')
+
+        self.records = self._load_records()
+        self._recover()
+
+    def _load_records(self):
+        '''
+        (ms, n_added, n_removed, n_total, offset of the arrays) of every complete record; a partial last record (a crash in the middle of an append) is cut off
+        '''
+        if not os.path.exists(self.deltas_filename):
+            return []
+
+        data = np.fromfile(self.deltas_filename, dtype='<u8')
+
+        records = []
+        i = 0
+        while i + HEADER <= len(data):
+            ms, n_added, n_removed, n_total = data[i : i + HEADER].tolist()
+            end = i + HEADER + n_added + n_removed
+            if end > len(data):
+                break
+
+            records.append((ms, n_added, n_removed, n_total, i + HEADER))
+            i = end
+
+        if i * 8 != os.path.getsize(self.deltas_filename):
+            logger.warn('[%s] partial record after %d crawls, cut off'%(self.deltas_filename, len(records)))
+            with open(self.deltas_filename, 'r+b') as f:
+                f.truncate(i * 8)
+
+        return records
+
+    def _recover(self):
+        '''
+        a latest.<n>.tmp left by a crash: its delta made it to the log if there are n records, finish the update; otherwise it never happened
+        '''
+        for f in os.listdir(self.folder):
+            m = re.match(r'^latest\.(\d+)\.tmp$', f)
+            if not m:
+                continue
+
+            if int(m.group(1)) == len(self.records):
+                os.replace(os.path.join(self.folder, f), self.latest_filename)
+            else:
+                os.remove(os.path.join(self.folder, f))
+
+    def _read(self, filename):
+        if not os.path.exists(filename):
+            return np.zeros(0, dtype='<u8')
+
+        return np.fromfile(filename, dtype='<u8')
+
+    def latest(self):
+        return self._read(self.latest_filename)
+
+    def delta(self, i):
+        '''
+        (added, removed) of the i-th crawl
+        '''
+        ms, n_added, n_removed, n_total, offset = self.records[i]
+        data = np.memmap(self.deltas_filename, dtype='<u8', mode='r', offset=offset * 8, shape=(n_added + n_removed,)) if n_added + n_removed else np.zeros(0, dtype='<u8')
+
+        return data[:n_added], data[n_added:]
+
+    def update(self, ids, ms = None):
+        '''
+        the ids of a fresh crawl; returns (added, removed) against the last one
+        '''
+        ms = ms if ms is not None else now_ms()
+
+        ids = np.unique(np.asarray(ids, dtype='<u8'))
+
+        if self.records:
+            latest = self.latest()
+            added = np.setdiff1d(ids, latest, assume_unique=True)
+            removed = np.setdiff1d(latest, ids, assume_unique=True)
+            header = [ms, len(added), len(removed), len(ids)]
+        else:
+            added = removed = np.zeros(0, dtype='<u8')
+            header = [ms, 0, 0, len(ids)]
+
+        tmp_filename = os.path.join(self.folder, 'latest.%d.tmp'%(len(self.records) + 1))
+        ids.tofile(tmp_filename)
+
+        offset = os.path.getsize(self.deltas_filename) // 8 if os.path.exists(self.deltas_filename) else 0
+        with open(self.deltas_filename, 'ab') as f:
+            f.write(np.concatenate([np.asarray(header, dtype='<u8'), added, removed]).astype('<u8').tobytes())
+
+        os.replace(tmp_filename, self.latest_filename)
+
+        self.records.append(tuple(header) + (offset + HEADER,))
+
+        return added, removed
+
+    def snapshot(self, ms = None):
+        '''
+        the ids as of the last crawl at or before ms (the latest if None); empty before the first crawl
+        '''
+        ids = self.latest()
+        if ms is None:
+            return ids
+
+        for i in range(len(self.records) - 1, -1, -1):
+            if self.records[i][0] <= ms:
+                break
+
+            if i == 0:
+                return np.zeros(0, dtype='<u8')
+
+            added, removed = self.delta(i)
+            ids = np.union1d(np.setdiff1d(ids, added, assume_unique=True), removed)
+
+        return ids
+
+    def history(self):
+        return [{'ms': ms, 'added': n_added, 'removed': n_removed, 'total': n_total} for ms, n_added, n_removed, n_total, _ in self.records]
+
+    def size(self):
+        '''
+        bytes on disk
+        '''
+        return sum(os.path.getsize(f) for f in [self.latest_filename, self.deltas_filename] if os.path.exists(f))
+
+class RelationshipStore(object):
+
+    def __init__(self, folder):
+
+        self.folder = os.path.abspath(folder)
+
+    def call_folder(self, call):
+        return os.path.join(self.folder, call.strip('/').replace('/', '_'))
+
+    def history(self, call, user_id):
+        return RelationshipHistory(os.path.join(self.call_folder(call), '%s'%user_id))
+
+    def users(self, call):
+        folder = self.call_folder(call)
+        if not os.path.exists(folder):
+            return []
+
+        return sorted(int(f) for f in os.listdir(folder) if f.isdigit())
+
+    def update(self, call, user_id, ids, ms = None):
+
+        added, removed = self.history(call, user_id).update(ids, ms)
+
+        logger.info('[%s] [%s] added: %d; removed: %d'%(user_id, call, len(added), len(removed)))
+
+        return added, removed
+
+def output_files(filename):
+    '''
+    the files of a user's crawl: filename (json) or its compressed segments
+    '''
+    return [filename] if os.path.exists(filename) else list_segments(filename)
+
+def relationship_ids(filename):
+    '''
+    the ids of every page of a user's crawl
+    '''
+    pages = [np.asarray(page['ids'], dtype='<u8') for f in output_files(filename) for page in read_records(f) if page.get('ids')]
+
+    return np.concatenate(pages) if pages else np.zeros(0, dtype='<u8')
+
+def user_files(folder):
+    '''
+    user_id -> the crawl output in folder (<user_id>, or <user_id>.<n>.json.gz|zst segments)
+    '''
+    users = set()
+    for f in os.listdir(folder):
+        m = re.match(r'^(\d+)(\.\d+\.json\.(gz|zst))?$', f)
+        if m:
+            users.add(int(m.group(1)))
+
+    return dict((user_id, os.path.join(folder, '%d'%user_id)) for user_id in sorted(users))
+
+def ingest_folder(store, call, folder, ms = None, remove = False):
+    '''
+    the user files of a crawl; ms defaults to the time each file was written
+    '''
+    folder = os.path.abspath(folder)
+
+    cnt = 0
+    for user_id, filename in user_files(folder).items():
+        files = output_files(filename)
+
+        store.update(call, user_id, relationship_ids(filename), ms if ms is not None else int(max(os.path.getmtime(f) for f in files) * 1000))
+        cnt += 1
+
+        if remove:
+            for f in files:
+                os.remove(f)
+
+    return cnt
+
+def ingest_csr(store, call, csr_folder, ms = None):
+
+    from edge_store import CsrGraph
+
+    graph = CsrGraph(csr_folder)
+    ms = ms if ms is not None else int(os.path.getmtime(os.path.join(graph.folder, 'csr.json')) * 1000)
+
+    for i, user_id in enumerate(graph.nodes.tolist()):
+        store.update(call, user_id, graph.targets[graph.offsets[i] : graph.offsets[i + 1]], ms)
+
+    return len(graph)
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--store', help="folder of the relationship histories", required=True)
+    parser.add_argument('-c', '--call', help="/friends/ids or /followers/ids", default='/followers/ids')
+    parser.add_argument('-i', '--input', help="day folders of crawls to ingest, in crawl order", nargs='+', default=[])
+    parser.add_argument('-g', '--graph', help="CSR index folders (see edge_store.py) to ingest, in crawl order", nargs='+', default=[])
+    parser.add_argument('-t', '--time', help="time of the ingested crawl ('%%Y-%%m-%%d %%H:%%M:%%S' utc), instead of the file times", default=None)
+    parser.add_argument('-rm', '--remove', help="remove the ingested user files", action="store_true")
+    parser.add_argument('-u', '--users', help="user ids to rebuild the snapshot of", nargs='+', type=int, default=[])
+    parser.add_argument('-at', '--at', help="rebuild the snapshot as of this time ('%%Y-%%m-%%d %%H:%%M:%%S' utc; default: the latest)", default=None)
+    parser.add_argument('-o', '--output', help="folder to write the rebuilt snapshots to (<user_id>, one {\"ids\": [...]} line), instead of printing them", default=None)
+    parser.add_argument('-l', '--list', help="list the crawls of every user", action="store_true")
+
+    args = parser.parse_args()
+
+    store = RelationshipStore(args.store)
+    ms = to_ms(args.time) if args.time else None
+
+    for folder in args.input:
+        logger.info('[%s] %d users ingested'%(folder, ingest_folder(store, args.call, folder, ms, args.remove)))
+
+    for folder in args.graph:
+        logger.info('[%s] %d users ingested'%(folder, ingest_csr(store, args.call, folder, ms)))
+
+    at = to_ms(args.at) if args.at else None
+    for user_id in args.users:
+        ids = store.history(args.call, user_id).snapshot(at).tolist()
+
+        if args.output:
+            if not os.path.exists(args.output):
+                os.makedirs(args.output)
+
+            with open(os.path.join(args.output, '%d'%user_id), 'w') as f:
+                f.write('%s\n'%json.dumps({'ids': ids}))
+
+        logger.info('[%d] %d ids%s'%(user_id, len(ids), '' if args.output else ': %s'%ids))
+
+    if args.list:
+        for user_id in store.users(args.call):
+            history = store.history(args.call, user_id)
+            logger.info('[%d] %d bytes; %s'%(user_id, history.size(), json.dumps(history.history())))
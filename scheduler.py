@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+scheduler.py: hands api keys out to units of work by remaining quota
+
+QuotaScheduler: acquire(endpoint) returns the idle key (a name in apikey_proxy_pairs_dict) that can serve the endpoint soonest, i.e., the one with the most remaining budget, or the earliest reset if every idle key is used up; release(key) puts it back
+
+the budgets come from the x-rate-limit-* headers the crawlers record (see rate_limit.py) into self.rate_limits, a multiprocessing.Manager().dict() shared with the worker processes
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import time, threading
+import multiprocessing as mp
+from rate_limit import RateLimitTracker
+
+WAIT_TIME = 30 # seconds; re-check budgets at least this often while waiting
+
+class QuotaScheduler(object):
+
+    def __init__(self, apikey_proxy_pairs_dict, rate_limits = None, wait_time = WAIT_TIME):
+
+        self.wait_time = wait_time
+
+        if rate_limits is None:
+            self._manager = mp.Manager() # keep a reference, the dict lives as long as the manager
+            rate_limits = self._manager.dict()
+
+        self.rate_limits = rate_limits
+
+        self.trackers = dict((available, RateLimitTracker(apikey_proxy_pairs_dict[available]['apikeys']['app_key'], rate_limits)) for available in apikey_proxy_pairs_dict)
+
+        self._idle = set(self.trackers.keys())
+        self._cond = threading.Condition()
+
+        self.dispatched = dict((available, 0) for available in self.trackers)
+
+    def _rank(self, available, endpoint, now):
+        '''
+        (seconds until available can call endpoint, -remaining); keys with nothing recorded yet come first
+        '''
+        tracker = self.trackers[available]
+        budget = tracker.budget(endpoint, now)
+
+        if not budget:
+            return 0, -float('inf')
+
+        return tracker.wait_for(endpoint, now), -budget[1]
+
+    def try_acquire(self, endpoint):
+        '''
+        (key, 0) if an idle key can call endpoint now, otherwise (None, seconds to wait before trying again); never blocks
+        '''
+        with self._cond:
+            if not self._idle:
+                return None, self.wait_time
+
+            now = time.time()
+            ranks = dict((available, self._rank(available, endpoint, now)) for available in self._idle)
+            available = min(ranks, key=ranks.get)
+            wait_for = ranks[available][0]
+
+            if wait_for > 0:
+                return None, min(wait_for, self.wait_time)
+
+            self._idle.remove(available)
+            self.dispatched[available] += 1
+            return available, 0
+
+    def acquire(self, endpoint):
+
+        with self._cond:
+            while True:
+                available, wait_for = self.try_acquire(endpoint)
+                if available:
+                    return available
+
+                if self._idle:
+                    logger.info('[%s] used up on every idle key, next check in %ds'%(endpoint, wait_for))
+                self._cond.wait(wait_for)
+
+    def release(self, available):
+        with self._cond:
+            self._idle.add(available)
+            self._cond.notify_all()
+
+    def retain(self, keys):
+        '''
+        only hand out keys from now on, e.g., the ones that have a long-lived worker (see key_workers.py)
+        '''
+        with self._cond:
+            self._idle &= set(keys)
+            self.trackers = dict((available, self.trackers[available]) for available in keys)
+
+    def idle(self):
+        with self._cond:
+            return len(self._idle)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+search_cadence.py: how often to run every search of search.json, by what its recent passes found, instead of all of them in turn at the same rate
+
+SearchCadence: an ActivityScheduler (see timeline_scheduler.py) where every search has its own interval; hits is the recent yield (new tweets per pass, decayed by DECAY per pass); after every pass the interval is multiplied by target_yield / hits, at most BACKOFF times longer (a dry search backs off exponentially: 1, 2, 4, ... min_interval) or BACKOFF times shorter (a hot one is polled faster), within [min_interval, max_staleness]; max_staleness bounds the wait of the driest search (keep it well under the 7 days /search/tweets looks back, or tweets are lost)
+
+unlike the timelines, a search is never run before its interval is up: next() waits for the earliest due one (and notices a search that becomes due earlier in the meantime)
+
+the state is kept in the search configs (checked, interval, hits, calls, yield); python search_cadence.py -cc search.json prints the queue
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import time, argparse
+from timeline_scheduler import ActivityScheduler
+
+TARGET_YIELD = 50 # new tweets per pass
+MIN_INTERVAL = 60 # seconds
+MAX_STALENESS = 12 * 3600 # seconds; even a search that never finds anything runs this often
+BACKOFF = 2.0 # at most x2 (or /2) a pass
+DECAY = 0.5
+
+class SearchCadence(ActivityScheduler):
+
+    def __init__(self, search_configs, target_yield = TARGET_YIELD, min_interval = MIN_INTERVAL, max_staleness = MAX_STALENESS, backoff = BACKOFF, decay = DECAY, update = None):
+
+        self.backoff = backoff
+
+        super(SearchCadence, self).__init__(search_configs, target_yield = target_yield, min_interval = min_interval, max_interval = max_staleness, decay = decay, update = update)
+
+    def interval(self, search_config):
+        return min(max(search_config.get('interval', self.min_interval), self.min_interval), self.max_interval)
+
+    def due(self, search_config):
+        checked = search_config.get('checked')
+        return checked + self.interval(search_config) if checked else 0
+
+    def ready(self, search_config):
+        return self.due(search_config)
+
+    def expected(self, search_config, now = None):
+        return search_config.get('hits', float('inf'))
+
+    def observe(self, current, search_config, tweets, calls, oldest_id, now):
+
+        hits = current['hits'] * self.decay + tweets * (1 - self.decay) if 'hits' in current else float(tweets)
+        factor = min(max(self.target_yield / hits, 1.0 / self.backoff), self.backoff) if hits > 0 else self.backoff
+
+        search_config['hits'] = hits
+        search_config['interval'] = min(max(self.interval(current) * factor, self.min_interval), self.max_interval)
+
+    def next(self, timeout = None):
+        '''
+        (search_config_id, 0) once the earliest search is due; (None, 0) once there's nothing left to run
+        '''
+        with self._cond:
+            while True:
+                if not self._heap:
+                    if not self._in_flight:
+                        return None, 0
+
+                    self._cond.wait(timeout)
+                    continue
+
+                due, search_config_id = self._heap[0]
+                wait = due - time.time()
+                if wait <= 0:
+                    break
+
+                # a search done meanwhile can be due sooner
+                self._cond.wait(min(wait, timeout) if timeout else wait)
+
+            return super(SearchCadence, self).next()
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-cc', '--command_config', help="search.json of the search command", required=True)
+    parser.add_argument('-n', '--top', help="print the first n searches of the queue", type=int, default=20)
+
+    args = parser.parse_args()
+
+    from checkpoint import CheckpointJournal
+
+    checkpoint = CheckpointJournal(args.command_config)
+    cadence = SearchCadence(checkpoint.configs)
+
+    now = time.time()
+    queue = cadence.queue(now)
+    logger.info('searches: %d; due now: %d'%(len(queue), sum(1 for due, _, _ in queue if due <= now)))
+
+    for due, hits, search_config_id in queue[:args.top]:
+        search_config = checkpoint.configs[search_config_id]
+        logger.info('[%s] due in %d secs; every %d secs; hits: %.1f/pass; yield: %.1f/call'%(search_config_id, max(due - now, 0), cadence.interval(search_config), search_config.get('hits', 0.0), search_config.get('yield', 0.0)))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+snowflake.py: the layout of tweet ids (since late 2010): 41 bits of ms since TWEPOCH, 10 bits of machine (5 datacenter + 5 worker) and a 12 bit per-ms sequence
+
+CandidateSpace: the plausible ids of a time window, i.e., every ms_step-th ms (ms_step = 1/sample_rate) x the given machines x sequences 0..sequences-1; candidate k is an index into that space (time first, so a sweep over k walks forward in time), which lets the history command chunk and resume a sweep over it the same way as a raw id range
+
+since only a few machines and sequences are ever used, probing the candidates instead of consecutive integers finds far more tweets per statuses/lookup call; profile() counts the machines and sequences of tweets already collected, so the next sweep only probes the ones that show up
+
+the history config (-cc) switches to candidates with a "snowflake" entry:
+
+{"range": 100, "current_id": 0, "snowflake": {"start": "2019-01-01 00:00:00", "end": "2019-01-02 00:00:00", "sample_rate": 0.01, "machines": [0, 1, 2], "sequences": 2}}
+
+current_id (and end, if given) are candidate indexes then; "probed" and "hits" are counted in the config either way
+
+python snowflake.py -d 1095977932836810752 decodes ids; -i <files> profiles collected tweets and suggests machines and sequences; -cc <history config> reports the hit rate of a sweep
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json, time, calendar, argparse, collections
+from exceptions import InvalidConfig
+
+TWEPOCH = 1288834974657 # ms; 2010-11-04 01:42:54.657 UTC
+
+MACHINES = 1 << 10
+SEQUENCES = 1 << 12
+
+def snowflake(ms, machine, sequence):
+    return ((int(ms) - TWEPOCH) << 22) | ((machine & 0x3ff) << 12) | (sequence & 0xfff)
+
+def snowflake_ms(tweet_id):
+    return (tweet_id >> 22) + TWEPOCH
+
+def decode(tweet_id):
+    '''
+    (ms, datacenter, worker, sequence)
+    '''
+    tweet_id = int(tweet_id)
+    return snowflake_ms(tweet_id), (tweet_id >> 17) & 0x1f, (tweet_id >> 12) & 0x1f, tweet_id & 0xfff
+
+def machine_of(tweet_id):
+    return (int(tweet_id) >> 12) & 0x3ff
+
+def to_ms(value):
+    '''
+    ms since the unix epoch, from ms or a '%Y-%m-%d %H:%M:%S' (or '%Y-%m-%d') utc string
+    '''
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']:
+        try:
+            return calendar.timegm(time.strptime(value, fmt)) * 1000
+        except ValueError:
+            pass
+
+    raise InvalidConfig('snowflake: invalid time [%s]'%value)
+
+class CandidateSpace(object):
+
+    def __init__(self, start_ms, end_ms, machines = None, sequences = 1, sample_rate = 1.0):
+
+        self.start_ms = max(to_ms(start_ms), TWEPOCH)
+        self.end_ms = to_ms(end_ms)
+        self.machines = sorted(set(machines)) if machines else list(range(MACHINES))
+        self.sequences = min(int(sequences), SEQUENCES)
+        self.ms_step = max(1, int(round(1.0 / sample_rate)))
+
+        if self.end_ms < self.start_ms:
+            raise InvalidConfig('snowflake: end is before start')
+
+        if not self.sequences:
+            raise InvalidConfig('snowflake: sequences must be at least 1')
+
+        self.per_ms = len(self.machines) * self.sequences
+        self.n_ms = (self.end_ms - self.start_ms) // self.ms_step + 1
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['start'], config['end'], config.get('machines'), config.get('sequences', 1), config.get('sample_rate', 1.0))
+
+    def __len__(self):
+        return self.n_ms * self.per_ms
+
+    def id_of(self, k):
+
+        ms, rest = divmod(k, self.per_ms)
+        machine, sequence = divmod(rest, self.sequences)
+
+        return snowflake(self.start_ms + ms * self.ms_step, self.machines[machine], sequence)
+
+    def ids(self, start, stop):
+        '''
+        the candidates start <= k < stop, in id order
+        '''
+        return [self.id_of(k) for k in range(max(start, 0), min(stop, len(self)))]
+
+    def ms_of(self, k):
+        return self.start_ms + (k // self.per_ms) * self.ms_step
+
+def hit_rate(config):
+    return float(config.get('hits', 0)) / config['probed'] if config.get('probed') else 0.0
+
+def profile(tweets_id):
+    '''
+    counts of the machines and sequences of tweets_id
+    '''
+    machines = collections.Counter()
+    sequences = collections.Counter()
+
+    for tweet_id in tweets_id:
+        machines[machine_of(tweet_id)] += 1
+        sequences[int(tweet_id) & 0xfff] += 1
+
+    return machines, sequences
+
+def suggest(counter, coverage = 0.99):
+    '''
+    the fewest keys of counter that cover coverage of the counts
+    '''
+    total = sum(counter.values())
+    keys = []
+    covered = 0
+
+    for key, cnt in counter.most_common():
+        if total and covered >= coverage * total:
+            break
+        keys.append(key)
+        covered += cnt
+
+    return keys
+
+def tweets_id_of(filenames):
+
+    from output_writer import read_records
+
+    for filename in filenames:
+        for tweet in read_records(filename):
+            if tweet.get('id'):
+                yield tweet['id']
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--decode', help="tweet ids to decode", nargs='+', type=int, default=[])
+    parser.add_argument('-i', '--input', help="collected tweets (.json, .json.gz, .json.zst) to profile", nargs='+', default=[])
+    parser.add_argument('-cov', '--coverage', help="fraction of the profiled tweets the suggested machines and sequences cover", type=float, default=0.99)
+    parser.add_argument('-cc', '--command_config', help="a history config to report the hit rate of", default=None)
+
+    args = parser.parse_args()
+
+    for tweet_id in args.decode:
+        ms, datacenter, worker, sequence = decode(tweet_id)
+        logger.info('[%d] %s.%03d UTC; datacenter: %d; worker: %d; sequence: %d'%(tweet_id, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ms // 1000)), ms % 1000, datacenter, worker, sequence))
+
+    if args.input:
+        machines, sequences = profile(tweets_id_of(args.input))
+        logger.info('tweets: %d; machines: %d; sequences: %d'%(sum(machines.values()), len(machines), len(sequences)))
+        logger.info('machines covering %.2f: %s'%(args.coverage, json.dumps(sorted(suggest(machines, args.coverage)))))
+        logger.info('sequences covering %.2f: %d'%(args.coverage, max(suggest(sequences, args.coverage) or [0]) + 1))
+
+    if args.command_config:
+        with open(os.path.abspath(args.command_config), 'r') as f:
+            history_config = json.load(f)
+
+        logger.info('probed: %d; hits: %d; hit rate: %.4f'%(history_config.get('probed', 0), history_config.get('hits', 0), hit_rate(history_config)))
+
+        if history_config.get('snowflake'):
+            space = CandidateSpace.from_config(history_config['snowflake'])
+            current_id = min(history_config.get('current_id', 0), len(space) - 1)
+            logger.info('candidates: %d; current_id: %d (%s UTC)'%(len(space), current_id, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(space.ms_of(current_id) // 1000))))
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+circle_cover.py: a few geocode circles ("lat,lng,radiusmi" of /search/tweets) that cover a set of county bounding boxes, instead of one enclosing circle per county (see find_county_by_name in process_geojson.py), which overlap heavily with their neighbours
+
+every bbox is sampled on a grid every SPACING miles; the candidate centers are the same grid over all the bboxes plus the center of every bbox; a greedy set cover picks the candidate covering the most uncovered samples (within max_radius - pad) until every sample is covered, a circle covering nothing of its own is dropped, every sample goes to its nearest circle, and every circle moves to the middle of its samples (if that's tighter) and shrinks to its farthest sample + pad; pad is half the diagonal of a grid cell, so every point of every bbox is covered, not only the samples
+
+python circle_cover.py -g gz_2010_us_050_00_20m.json -s 04 35 -o geocodes.json covers the counties of Arizona and New Mexico (-c ../../county.csv -n Cochise Pima for counties by name, -b "minx,miny,maxx,maxy" for bboxes); the geocodes are written as the ["name", "lat,lng,radiusmi"] pairs of the geocodes of search_json.py, with how many searches they save over one circle per county and the overlap left
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, csv, json, math, argparse
+import numpy as np
+
+EARTH_RADIUS = 3958.8 # miles
+MILES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+MAX_RADIUS = 100.0 # miles, the largest circle to search
+SPACING = 10.0 # miles between the samples of a bbox
+CHUNK = 4096 # candidates per distance matrix block
+
+def distances(lats1, lngs1, lats2, lngs2):
+    '''
+    great circle distances in miles, len(lats1) x len(lats2)
+    '''
+    lats1, lngs1, lats2, lngs2 = [np.radians(np.asarray(a, dtype=np.float64)) for a in [lats1, lngs1, lats2, lngs2]]
+
+    a = np.sin((lats2[None, :] - lats1[:, None]) / 2) ** 2 + np.cos(lats1)[:, None] * np.cos(lats2)[None, :] * np.sin((lngs2[None, :] - lngs1[:, None]) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def sample_bbox(bbox, spacing = SPACING):
+    '''
+    (lats, lngs) of a grid over bbox (min_x, min_y, max_x, max_y; x is lng), its edges included, no two samples more than spacing miles apart along either axis
+    '''
+    min_x, min_y, max_x, max_y = bbox
+
+    ny = int(math.ceil((max_y - min_y) * MILES_PER_DEGREE / spacing)) + 1
+    # the widest row of the box (nearest the equator) sets the lng step
+    widest = min(abs(min_y), abs(max_y)) if min_y * max_y > 0 else 0.0
+    nx = int(math.ceil((max_x - min_x) * MILES_PER_DEGREE * math.cos(math.radians(widest)) / spacing)) + 1
+
+    lngs, lats = np.meshgrid(np.linspace(min_x, max_x, nx), np.linspace(min_y, max_y, ny))
+
+    return lats.ravel(), lngs.ravel()
+
+def bbox_circle(bbox):
+    '''
+    (lat, lng, radius) of the circle around the center of bbox through its farthest corner, one circle per county
+    '''
+    min_x, min_y, max_x, max_y = bbox
+    lat, lng = (min_y + max_y) / 2.0, (min_x + max_x) / 2.0
+
+    radius = distances([lat], [lng], [min_y, min_y, max_y, max_y], [min_x, max_x, min_x, max_x]).max()
+
+    return lat, lng, float(radius)
+
+def cover_counts(circles, lats, lngs):
+    '''
+    how many of circles cover every point
+    '''
+    counts = np.zeros(len(lats), dtype=np.int64)
+    for lat, lng, radius in circles:
+        counts += distances([lat], [lng], lats, lngs)[0] <= radius
+
+    return counts
+
+def overlap(circles, spacing = SPACING):
+    '''
+    (share of the area of the union of circles covered more than once, total area of the circles / area of their union), on a grid over the circles
+    '''
+    if not circles:
+        return 0.0, 1.0
+
+    lats, lngs = [], []
+    for lat, lng, radius in circles:
+        dlat = radius / MILES_PER_DEGREE
+        dlng = radius / (MILES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        lats.append((lat - dlat, lat + dlat))
+        lngs.append((lng - dlng, lng + dlng))
+
+    min_y, max_y = min(a for a, _ in lats), max(b for _, b in lats)
+    min_x, max_x = min(a for a, _ in lngs), max(b for _, b in lngs)
+    lats, lngs = sample_bbox((min_x, min_y, max_x, max_y), spacing / 2.0)
+
+    counts = cover_counts(circles, lats, lngs)
+    # a grid cell is cos(lat) times narrower away from the equator
+    weights = np.cos(np.radians(lats))
+
+    union = weights[counts > 0].sum()
+    if not union:
+        return 0.0, 1.0
+
+    return float(weights[counts > 1].sum() / union), float((weights * counts).sum() / union)
+
+def circle_cover(bboxes, max_radius = MAX_RADIUS, spacing = SPACING):
+    '''
+    [(lat, lng, radius)] covering every bbox, no radius above max_radius
+    '''
+    pad = spacing * math.sqrt(2) / 2
+    if max_radius <= pad:
+        raise Exception("max_radius must be more than %.1f miles with a %.1f miles spacing"%(pad, spacing))
+
+    samples = [sample_bbox(bbox, spacing) for bbox in bboxes]
+    lats = np.concatenate([s[0] for s in samples])
+    lngs = np.concatenate([s[1] for s in samples])
+
+    centers = [((min_y + max_y) / 2.0, (min_x + max_x) / 2.0) for min_x, min_y, max_x, max_y in bboxes]
+    candidate_lats = np.concatenate([lats, [lat for lat, _ in centers]])
+    candidate_lngs = np.concatenate([lngs, [lng for _, lng in centers]])
+
+    # candidate x sample, in blocks to keep the float matrix small
+    covers = np.zeros((len(candidate_lats), len(lats)), dtype=bool)
+    for i in range(0, len(candidate_lats), CHUNK):
+        covers[i : i + CHUNK] = distances(candidate_lats[i : i + CHUNK], candidate_lngs[i : i + CHUNK], lats, lngs) <= max_radius - pad
+
+    gains = covers.sum(axis=1)
+    uncovered = np.ones(len(lats), dtype=bool)
+
+    chosen = []
+    while uncovered.any():
+        best = int(np.argmax(gains))
+        newly = covers[best] & uncovered
+
+        chosen.append(best)
+        uncovered &= ~newly
+        # only the samples covered just now stop counting
+        gains -= covers[:, newly].sum(axis=1)
+
+    # the later circles can cover everything of an earlier one
+    chosen.reverse()
+    for best in list(chosen):
+        others = [c for c in chosen if c != best]
+        if others and covers[others].any(axis=0)[covers[best]].all():
+            chosen.remove(best)
+
+    # every sample to its nearest circle, every circle shrunk to its farthest sample
+    d = distances(candidate_lats[chosen], candidate_lngs[chosen], lats, lngs)
+    d[~covers[chosen]] = np.inf
+    nearest = np.argmin(d, axis=0)
+
+    circles = []
+    for i, best in enumerate(chosen):
+        mine = nearest == i
+        if not mine.any():
+            continue
+
+        lat, lng, radius = float(candidate_lats[best]), float(candidate_lngs[best]), float(d[i, mine].max())
+
+        # the middle of its samples is often a tighter center than the grid point
+        mid_lat, mid_lng = (lats[mine].min() + lats[mine].max()) / 2.0, (lngs[mine].min() + lngs[mine].max()) / 2.0
+        mid_radius = float(distances([mid_lat], [mid_lng], lats[mine], lngs[mine]).max())
+        if mid_radius < radius:
+            lat, lng, radius = float(mid_lat), float(mid_lng), mid_radius
+
+        circles.append((lat, lng, min(radius + pad, max_radius)))
+
+    return circles
+
+def county_bboxes(county_csv, names = None):
+    '''
+    [(name, bbox)] of county.csv (County,Bbox), the counties named in names (every one with that name, county.csv has no state) or all of them
+    '''
+    wanted = set(name.strip().lower() for name in names) if names else None
+
+    bboxes = []
+    with open(county_csv, newline='', encoding='utf-8', errors='ignore') as f:
+        for row in csv.DictReader(f):
+            name = row['County'].strip()
+            if wanted is None or name.lower() in wanted:
+                bboxes.append((name, tuple(json.loads(row['Bbox']))))
+
+    if wanted:
+        for name in wanted - set(name.lower() for name, _ in bboxes):
+            logger.warn('[%s] not in %s'%(name, county_csv))
+
+    return bboxes
+
+def geojson_bboxes(geoJSON_file, states = None):
+    '''
+    [(name, bbox)] of the counties of states (STATE fips codes, e.g., 04) in the census county geojson (gz_2010_us_050_00_20m.json)
+    '''
+    from process_geojson import bbox
+
+    with open(geoJSON_file, 'rb') as gf:
+        us = json.loads(gf.read().decode('utf-8','ignore'))
+
+    return [('%s_%s'%(county['properties']['NAME'].strip().lower().replace(' ', '_'), county['properties']['STATE']), bbox(county)) for county in us['features'] if not states or county['properties']['STATE'] in states]
+
+def to_geocodes(circles, prefix = 'cover'):
+    return [['%s_%d'%(prefix, i), '%s,%s,%smi'%(lat, lng, radius)] for i, (lat, lng, radius) in enumerate(circles)]
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--county_csv', help="county.csv (County,Bbox)", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'county.csv'))
+    parser.add_argument('-n', '--names', help="the counties of county.csv to cover, by name", nargs='+', default=[])
+    parser.add_argument('-g', '--geojson', help="census county geojson (gz_2010_us_050_00_20m.json), instead of county.csv", default=None)
+    parser.add_argument('-s', '--states', help="the states (fips, e.g., 04) of the geojson counties to cover", nargs='+', default=[])
+    parser.add_argument('-b', '--bboxes', help="bboxes to cover, as min_lng,min_lat,max_lng,max_lat", nargs='+', default=[])
+    parser.add_argument('-r', '--max_radius', help="the largest circle, in miles", type=float, default=MAX_RADIUS)
+    parser.add_argument('-sp', '--spacing', help="miles between the samples of a bbox (smaller: tighter circles, slower)", type=float, default=SPACING)
+    parser.add_argument('-o', '--output', help="json file to write the geocodes to", default=None)
+
+    args = parser.parse_args()
+
+    if args.geojson:
+        bboxes = geojson_bboxes(args.geojson, args.states)
+    elif args.names:
+        bboxes = county_bboxes(args.county_csv, args.names)
+    else:
+        bboxes = []
+
+    bboxes.extend(('bbox_%d'%i, tuple(float(x) for x in b.split(','))) for i, b in enumerate(args.bboxes))
+
+    if not bboxes:
+        parser.error('nothing to cover (-n, -g or -b)')
+
+    circles = circle_cover([bbox for _, bbox in bboxes], args.max_radius, args.spacing)
+
+    # one circle per county, as before
+    per_county = [bbox_circle(bbox) for _, bbox in bboxes]
+    too_big = sum(1 for _, _, radius in per_county if radius > args.max_radius)
+
+    before, before_depth = overlap(per_county, args.spacing)
+    after, after_depth = overlap(circles, args.spacing)
+
+    logger.info('counties: %d (%d of them wider than %.1f miles); circles: %d; searches saved per query: %d (%.1f%%)'%(len(bboxes), too_big, args.max_radius, len(circles), len(bboxes) - len(circles), 100.0 * (len(bboxes) - len(circles)) / len(bboxes)))
+    logger.info('overlap (area covered more than once): %.1f%% -> %.1f%%; circle area / covered area: %.2f -> %.2f'%(100 * before, 100 * after, before_depth, after_depth))
+
+    geocodes = to_geocodes(circles)
+    if args.output:
+        with open(args.output, 'w') as wf:
+            json.dump(geocodes, wf)
+    else:
+        for geocode in geocodes:
+            logger.info(json.dumps(geocode))
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+benchmark.py: end to end throughput of every twitter_tracker.py -cmd mode and of twitter_streamer.py, against a local fake_twitter.py
+
+every run starts the real script as a subprocess (-api/-su pointed at the fake server); the proxies are extra listeners of the same fake server, so keys x proxies x workers can be varied without real quota or real proxies
+
+per run: tweets/sec and calls/sec (as served by the fake server, or written by the streamer), key utilization (calls per key), cpu seconds per tweet (getrusage of the children) and peak rss (sum over the process tree, and the largest single process)
+
+python benchmark.py -m search,history -k 1,4 -p 1,4 -w 1,4 -d 20 -r results.json; compare two results files with -cmp old.json
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='(%(asctime)s) [%(process)d] %(levelname)s: %(message)s')
+
+import sys, os, json, time, argparse, signal, subprocess, threading, tempfile, shutil, resource, platform, itertools, datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import requests
+from fake_twitter import FakeTwitter, FakeTwitterServer, RETWEET_WORKER
+from snowflake import snowflake
+from output_writer import read_records
+
+MODES = ['search', 'timeline', 'users_by_user_id', '/followers/ids', '/statuses/retweets/:id', 'history', 'getgeo', 'sample', 'locations']
+ENDLESS_MODES = ['search', 'timeline', 'sample', 'locations'] # stopped with SIGINT after the duration
+STREAM_MODES = ['sample', 'locations']
+RATE_LIMIT = 1000000 # calls per window; the benchmark measures the crawler, not twitter's limits
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def process_tree(pid):
+    '''
+    pid and all of its descendants, from /proc
+    '''
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat'%entry, 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, []))
+
+    return tree
+
+def tree_rss(pid):
+    '''
+    resident bytes of the process tree
+    '''
+    rss = 0
+    for p in process_tree(pid):
+        try:
+            with open('/proc/%d/statm'%p, 'r') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except (IOError, IndexError, ValueError):
+            pass
+
+    return rss
+
+class RssSampler(threading.Thread):
+
+    def __init__(self, pid, interval = 0.5):
+        super(RssSampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def write_json(filename, data):
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+    return filename
+
+def prepare(workdir, mode, n_keys, n_proxies, proxy_urls, size):
+    '''
+    config.json, proxies.json and the -cc file of mode in workdir
+    '''
+    apikeys = dict(('key%d'%i, {'app_key': 'app%d'%i, 'app_secret': 'secret%d'%i, 'oauth_token': 'token%d'%i, 'oauth_token_secret': 'token_secret%d'%i}) for i in range(n_keys))
+    config = write_json(os.path.join(workdir, 'config.json'), {'apikeys': apikeys})
+
+    # always written, twitter_tracker.py defaults to ./proxies.json
+    proxies = write_json(os.path.join(workdir, 'proxies.json'), [{proxy_url.split('://')[1]: 'http'} for proxy_url in proxy_urls[:n_proxies]])
+
+    if mode == 'search':
+        command_config = write_json(os.path.join(workdir, 'search.json'), dict(('s%d'%i, {'terms': ['term%d'%i]}) for i in range(size)))
+    elif mode == 'timeline':
+        command_config = write_json(os.path.join(workdir, 'users.json'), dict(('u%d'%i, {'user_id': 1000 + i}) for i in range(size)))
+    elif mode in ['users_by_user_id', '/followers/ids']:
+        command_config = write_json(os.path.join(workdir, 'user_ids.json'), [1000 + i for i in range(size)])
+    elif mode == '/statuses/retweets/:id':
+        # original tweets (not RETWEET_WORKER ones), so every level has retweets
+        command_config = write_json(os.path.join(workdir, 'tweets_ids.json'), [snowflake(1500000000000 + i * 1000, i % RETWEET_WORKER, 0) for i in range(size)])
+    elif mode == 'history':
+        command_config = write_json(os.path.join(workdir, 'history.json'), {'current_id': 1200000000000000000, 'end': 1200000000000000000 + size * 100 - 1, 'range': 100})
+    elif mode == 'locations':
+        command_config = write_json(os.path.join(workdir, 'locations.json'), {'name': 'bbox', 'locations': '-112,31,-108,34'})
+    else:
+        command_config = None
+
+    return config, proxies, command_config
+
+def command_line(mode, config, proxies, command_config, output_folder, workers, api_url, token_cache, extra_args):
+
+    if mode in STREAM_MODES:
+        cmd = [sys.executable, os.path.join(ROOT, 'twitter_streamer.py'), '-c', config, '-o', output_folder, '-cmd', mode, '-su', api_url]
+        if command_config:
+            cmd += ['-cc', command_config]
+        return cmd + extra_args
+
+    cmd = [sys.executable, os.path.join(ROOT, 'twitter_tracker.py'), '-c', config, '-p', proxies, '-o', output_folder, '-cmd', mode, '-w', '%d'%workers, '-api', api_url, '-tc', token_cache, '-l', '2']
+    if command_config:
+        cmd += ['-cc', command_config]
+
+    return cmd + extra_args
+
+def count_written(output_folder):
+    '''
+    (records, bytes) in the output folder; only used for the streamer, the crawlers write whole responses per line
+    '''
+    records = 0
+    size = 0
+    for folder, _, filenames in os.walk(output_folder):
+        for filename in filenames:
+            filename = os.path.join(folder, filename)
+            size += os.path.getsize(filename)
+            if filename.endswith(('.json', '.gz', '.zst')):
+                records += sum(1 for _ in read_records(filename))
+
+    return records, size
+
+def run_once(twitter, api_url, proxy_urls, mode, n_keys, n_proxies, workers, duration, timeout, size, extra_args):
+
+    workdir = tempfile.mkdtemp(prefix='benchmark_')
+    output_folder = os.path.join(workdir, 'data')
+
+    try:
+        config, proxies, command_config = prepare(workdir, mode, n_keys, n_proxies, proxy_urls, size)
+        cmd = command_line(mode, config, proxies, command_config, output_folder, workers, api_url, os.path.join(workdir, 'tokens'), extra_args)
+
+        before = requests.get('%s/stats'%api_url).json()
+        usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        started = time.time()
+        with open(os.path.join(workdir, 'run.log'), 'w') as log_f:
+            process = subprocess.Popen(cmd, cwd=workdir, stdout=log_f, stderr=subprocess.STDOUT)
+
+            sampler = RssSampler(process.pid)
+            sampler.start()
+
+            limit = duration if mode in ENDLESS_MODES else timeout
+            try:
+                process.wait(limit)
+                timed_out = False
+            except subprocess.TimeoutExpired:
+                timed_out = mode not in ENDLESS_MODES
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(60)
+                except subprocess.TimeoutExpired:
+                    for p in reversed(process_tree(process.pid)):
+                        try:
+                            os.kill(p, signal.SIGKILL)
+                        except OSError:
+                            pass
+                    process.wait()
+
+            sampler.stop()
+
+        elapsed = time.time() - started
+        usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        after = requests.get('%s/stats'%api_url).json()
+
+        calls = sum(after['calls'].values()) - sum(before['calls'].values())
+        calls_per_key = dict((app_key, n - before['keys'].get(app_key, 0)) for app_key, n in after['keys'].items() if n - before['keys'].get(app_key, 0) > 0)
+
+        if mode in STREAM_MODES:
+            tweets, written = count_written(output_folder)
+        else:
+            tweets = after['tweets'] - before['tweets']
+            written = count_written(output_folder)[1]
+
+        cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+
+        return {
+            'mode': mode,
+            'keys': n_keys,
+            'proxies': n_proxies,
+            'workers': workers,
+            'elapsed': round(elapsed, 3),
+            'timed_out': timed_out,
+            'exit_code': process.returncode,
+            'tweets': tweets,
+            'calls': calls,
+            'tweets_per_sec': round(tweets / elapsed, 2),
+            'calls_per_sec': round(calls / elapsed, 2),
+            'rate_limited': after['rate_limited'] - before['rate_limited'],
+            'errors': after['errors'] - before['errors'],
+            'keys_used': len(calls_per_key),
+            'key_utilization': round(len(calls_per_key) / float(n_keys), 3),
+            'calls_per_key': calls_per_key,
+            'cpu_seconds': round(cpu, 3),
+            'cpu_ms_per_tweet': round(1000 * cpu / tweets, 4) if tweets else None,
+            'peak_rss_tree_mb': round(sampler.peak / 1024.0 / 1024.0, 1),
+            # ru_maxrss is the largest single (waited for) descendant so far, in KB on linux
+            'peak_rss_max_process_mb': round(usage_after.ru_maxrss / 1024.0, 1),
+            'bytes_written': written
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(old_filename, new_filename, threshold = 0.1):
+    '''
+    runs with the same (mode, keys, proxies, workers) whose tweets/sec dropped by more than threshold
+    '''
+    with open(old_filename, 'r') as f:
+        old = dict(((r['mode'], r['keys'], r['proxies'], r['workers']), r) for r in json.load(f)['runs'])
+    with open(new_filename, 'r') as f:
+        new = json.load(f)['runs']
+
+    regressions = []
+    for r in new:
+        o = old.get((r['mode'], r['keys'], r['proxies'], r['workers']))
+        if o and o['tweets_per_sec'] and r['tweets_per_sec'] < (1 - threshold) * o['tweets_per_sec']:
+            regressions.append((r['mode'], r['keys'], r['proxies'], r['workers'], o['tweets_per_sec'], r['tweets_per_sec']))
+            logger.warn('[%s] keys: %d; proxies: %d; workers: %d; %.1f -> %.1f tweets/sec'%regressions[-1])
+
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('utf-8').strip()
+    except Exception:
+        return None
+
+def int_list(value):
+    return [int(x) for x in value.split(',')]
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--modes', help="comma separated: %s"%(', '.join(MODES)), default=','.join(MODES))
+    parser.add_argument('-k', '--keys', help="comma separated numbers of api keys", type=int_list, default=[1, 4])
+    parser.add_argument('-p', '--proxies', help="comma separated numbers of proxies (twitter_tracker.py only uses more than one key with proxies)", type=int_list, default=[0, 4])
+    parser.add_argument('-w', '--workers', help="comma separated --workers", type=int_list, default=[1, 4])
+    parser.add_argument('-d', '--duration', help="seconds to run search, timeline and the streams for", type=int, default=20)
+    parser.add_argument('-t', '--timeout', help="seconds before a finite mode is stopped", type=int, default=300)
+    parser.add_argument('-s', '--size', help="searches, users, tweets or lookups (x100 ids) per run", type=int, default=50)
+    parser.add_argument('-latency', '--latency', help="seconds per fake response", type=float, default=0.02)
+    parser.add_argument('-sr', '--stream_rate', help="fake stream tweets/sec", type=int, default=5000)
+    parser.add_argument('-rl', '--real_limits', help="keep the real rate limits of fake_twitter.py (default: unlimited)", action="store_true")
+    parser.add_argument('-x', '--extra', help="extra arguments for the scripts, e.g., \"-f gzip -kw\"", default='')
+    parser.add_argument('-r', '--result', help="results file", default="benchmark.json")
+    parser.add_argument('-cmp', '--compare', help="an earlier results file to compare with", default=None)
+
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(',') if mode]
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError('unknown mode [%s]'%mode)
+
+    config = {'latency': args.latency, 'stream_rate': args.stream_rate}
+    if not args.real_limits:
+        config['rate_limits'] = dict((endpoint, RATE_LIMIT) for endpoint in FakeTwitter().config['rate_limits'])
+
+    server = FakeTwitterServer(config=config)
+    api_url = server.start()
+
+    proxy_servers = [FakeTwitterServer(twitter=server.twitter) for _ in range(max(args.proxies))]
+    proxy_urls = [proxy_server.start() for proxy_server in proxy_servers]
+
+    logger.info('fake twitter on %s; %d proxies'%(api_url, len(proxy_urls)))
+
+    started = datetime.datetime.now().isoformat()
+
+    runs = []
+    try:
+        for mode in modes:
+            # the streamer uses one key, no proxies and no workers
+            matrix = [(1, 0, 1)] if mode in STREAM_MODES else itertools.product(args.keys, args.proxies, args.workers)
+
+            for n_keys, n_proxies, workers in matrix:
+                logger.info('[%s] keys: %d; proxies: %d; workers: %d'%(mode, n_keys, n_proxies, workers))
+
+                result = run_once(server.twitter, api_url, proxy_urls, mode, n_keys, n_proxies, workers, args.duration, args.timeout, args.size, args.extra.split())
+                logger.info(json.dumps(result))
+
+                runs.append(result)
+
+                # written after every run, a crash still leaves the runs so far
+                write_json(args.result, {
+                    'revision': git_revision(),
+                    'python': platform.python_version(),
+                    'started': started,
+                    'fake_config': config,
+                    'duration': args.duration,
+                    'size': args.size,
+                    'extra': args.extra,
+                    'runs': runs
+                })
+    finally:
+        for proxy_server in proxy_servers:
+            proxy_server.stop()
+        server.stop()
+
+    if args.compare:
+        compare(args.compare, args.result)
@@ -10,14 +10,171 @@ logging.basicConfig(level=logging.DEBUG, format='(%(asctime)s) [%(process)d] %(l
 requests_log = logging.getLogger("requests")
 requests_log.setLevel(logging.WARNING)
 
-import sys,json
+import sys,os,json,math,argparse
 import hashlib
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util import search_querystring
 def md5(data):
     return hashlib.md5(data).hexdigest()
 # n is the number in one list element
 def chunks(arr, n):
     return [arr[i:i+n] for i in range(0, len(arr), n)]
 
+# limits of /search/tweets (standard v1.1): the url-encoded q is at most 500 characters, operators included; queries with too many operators are rejected as too complex
+MAX_QUERY_LENGTH = 500
+MAX_OPERATORS = 50
+SEPARATOR = ' OR '
+EARTH_RADIUS = 3958.8 # miles
+
+def querystring_of(terms):
+    '''
+    the query search_by_terms_task (twitter_tracker.py) sends for terms
+    '''
+    return search_querystring([term.lower() for term in terms])
+
+def query_length(terms):
+    return len(quote(querystring_of(terms), safe=''))
+
+def pack_terms(query_terms, max_length = MAX_QUERY_LENGTH, max_operators = MAX_OPERATORS):
+    '''
+    first fit decreasing: the fewest queries (lists of terms) that fit max_length (url-encoded) and max_operators ORs each; a term that can't fit on its own is an error
+    '''
+    # the encoded length of a query is the sum of its terms plus a separator between every two, so a term costs its length + separator in a bin of max_length + separator
+    separator = len(quote(SEPARATOR, safe=''))
+    capacity = max_length + separator
+
+    terms = []
+    for term in query_terms:
+        if term.lower() not in [t.lower() for t in terms]:
+            terms.append(term)
+
+    costs = dict((term, query_length([term]) + separator) for term in terms)
+
+    for term in terms:
+        if costs[term] > capacity:
+            raise ValueError('term [%s] is longer than the query limit'%term)
+
+    bins = []
+    for term in sorted(terms, key=lambda term: -costs[term]):
+        for b in bins:
+            if b['size'] + costs[term] <= capacity and len(b['terms']) <= max_operators:
+                b['terms'].append(term)
+                b['size'] += costs[term]
+                break
+        else:
+            bins.append({'terms': [term], 'size': costs[term]})
+
+    return [b['terms'] for b in bins]
+
+def geocode_name(geocode):
+    return geocode[0] if isinstance(geocode, (list, tuple)) else geocode
+
+def parse_geocode(geocode):
+    '''
+    (lat, lng, radius in miles) of a ("name", "lat,lng,radius(mi|km)") or a "lat,lng,radius(mi|km)" geocode
+    '''
+    lat, lng, radius = (geocode[1] if isinstance(geocode, (list, tuple)) else geocode).split(',')
+    radius = float(radius[:-2]) * (0.621371 if radius.endswith('km') else 1.0)
+
+    return float(lat), float(lng), radius
+
+def distance(lat1, lng1, lat2, lng2):
+    '''
+    great circle distance in miles
+    '''
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+def merge_geocodes(geocodes):
+    '''
+    the geocodes that aren't covered by another one (the same circle, or a circle inside a bigger one): searching the bigger circle returns every tweet of the smaller; None (no geocode) covers them all; returns (kept, {dropped name: name of the one covering it})
+    '''
+    if not geocodes:
+        return [None], {}
+
+    if None in geocodes:
+        return [None], dict((geocode_name(geocode), None) for geocode in geocodes if geocode)
+
+    circles = [(geocode, parse_geocode(geocode)) for geocode in geocodes]
+    # the biggest first, so a circle is only checked against the ones that can cover it
+    circles.sort(key=lambda circle: -circle[1][2])
+
+    kept = []
+    covered = {}
+    for geocode, (lat, lng, radius) in circles:
+        for other, (other_lat, other_lng, other_radius) in kept:
+            if distance(lat, lng, other_lat, other_lng) + radius <= other_radius + 1e-9:
+                covered[geocode_name(geocode)] = geocode_name(other)
+                break
+        else:
+            kept.append((geocode, (lat, lng, radius)))
+
+    return [geocode for geocode, _ in kept], covered
+
+def calls_per_sweep(search_configs):
+    '''
+    at least one /search/tweets call per config per pass
+    '''
+    return len(search_configs)
+
+def optimize_search_json(query_terms, geocodes, search_json_filename, max_length = MAX_QUERY_LENGTH, max_operators = MAX_OPERATORS):
+    '''
+    the same terms and places as generate_search_json, in the fewest configs: the terms bin-packed up to the real query limits, and every packed query once per geocode that isn't covered by another one; returns the configs
+    '''
+    queries = pack_terms(query_terms, max_length, max_operators)
+    kept, covered = merge_geocodes(geocodes)
+
+    for name, other in covered.items():
+        logger.info('[%s] is covered by [%s], merged'%(name, other))
+
+    results = {}
+    for geocode in kept:
+        for terms in queries:
+            terms = [term.lower() for term in terms]
+            querystring = querystring_of(terms)
+            output_filename = md5(('%s_%s'%(geocode,querystring)).encode('utf-8'))
+
+            results[output_filename] = {
+                "terms": terms,
+                "since_id": 0,
+                "geocode": geocode,
+                "querystring": querystring,
+                "output_filename": output_filename
+            }
+
+    with open(search_json_filename, 'w') as wf:
+        json.dump(results, wf)
+
+    lower_bound = max(int(math.ceil(float(sum(query_length([term]) + len(quote(SEPARATOR, safe='')) for term in set(t.lower() for t in query_terms))) / (max_length + len(quote(SEPARATOR, safe=''))))), 1)
+    logger.info('terms: %d; queries: %d (at least %d); geocodes: %d -> %d; calls per sweep: %d'%(len(query_terms), len(queries), lower_bound, len(geocodes) if geocodes else 0, len(kept), calls_per_sweep(results)))
+
+    return results
+
+def terms_and_geocodes(search_json_filename):
+    '''
+    the terms and geocodes of an existing search json (e.g., to optimize it)
+    '''
+    with open(search_json_filename, 'r') as rf:
+        search_configs = json.load(rf)
+
+    query_terms = []
+    geocodes = []
+    for search_config in search_configs.values():
+        for term in search_config['terms']:
+            if term.lower() not in query_terms:
+                query_terms.append(term.lower())
+
+        geocode = search_config.get('geocode') or None
+        geocode = tuple(geocode) if isinstance(geocode, list) else geocode
+        if geocode not in geocodes:
+            geocodes.append(geocode)
+
+    return query_terms, [geocode for geocode in geocodes if geocode] if None not in geocodes else [None]
+
 def generate_search_json(query_terms, geocodes, search_json_filename):
 
     with open(search_json_filename, 'w') as wf:
@@ -72,6 +229,22 @@ def generate_search_json(query_terms, geocodes, search_json_filename):
 
 if __name__=="__main__":
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help="an existing search json to optimize (instead of the terms below)", default=None)
+    parser.add_argument('-o', '--output', help="the optimized search json", default=None)
+    parser.add_argument('-ml', '--max_length', help="url-encoded characters per query", type=int, default=MAX_QUERY_LENGTH)
+    parser.add_argument('-mo', '--max_operators', help="ORs per query", type=int, default=MAX_OPERATORS)
+
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, 'r') as rf:
+            logger.info('[%s] calls per sweep: %d'%(args.input, calls_per_sweep(json.load(rf))))
+
+        query_terms, geocodes = terms_and_geocodes(args.input)
+        optimize_search_json(query_terms, geocodes, args.output if args.output else args.input.replace('.json', '_optimized.json'), args.max_length, args.max_operators)
+        sys.exit(0)
+
     # search_terms = ["hpv", "#hpv", "#hpvvaccine", "hpvvaccine", "HumanPapillomavirus", "#HumanPapillomavirus",
     # "HumanPapillomavirusVaccine", "#HumanPapillomavirusVaccine",
     # "Gardasil", "#Gardasil", "Papillomavirus", "#Papillomavirus", "Cervarix", "#cervarix"
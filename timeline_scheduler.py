@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+timeline_scheduler.py: which user timeline to crawl next, by how many new tweets a call is expected to return, instead of every user once per cycle
+
+ActivityScheduler: every user's posting rate is estimated from what its passes found (new tweets over the seconds since the pass before, both decayed by DECAY per pass, on top of a prior of PRIOR_TWEETS in PRIOR_SECONDS); before a user's first pass, the gap since its since_id (a snowflake, see snowflake.py) stands in for the history
+
+a pass costs at least one call and returns at most PAGE tweets a call, so a call is used best once PAGE new tweets are expected; the heap (heapq) is keyed by the time that happens, rate * (due - checked) = target_yield, clamped to [min_interval, max_interval] after the last pass, so the quota goes to the users with the most to return first (an account that tweets once a month comes up every max_interval at most, and its one call finds its few tweets). next() pops the earliest; when nothing is due yet it still pops the earliest (the quota is there to be used), but never sooner than min_interval after its last pass
+
+the estimates are kept in the user configs (checked, tweets_seen, seconds_seen, calls, yield), i.e., in users.json through the checkpoint journal; python timeline_scheduler.py -cc users.json prints the queue
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import time, heapq, threading, argparse
+from snowflake import snowflake_ms, TWEPOCH
+
+PAGE = 200 # tweets per /statuses/user_timeline call
+TARGET_YIELD = PAGE # expected new tweets per pass
+MIN_INTERVAL = 300 # seconds between two passes of a user
+MAX_INTERVAL = 7 * 24 * 3600 # seconds; even a silent user is checked this often
+DECAY = 0.8 # weight of the older passes in the rate estimate
+PRIOR_TWEETS = 1.0
+PRIOR_SECONDS = 24 * 3600.0
+
+class ActivityScheduler(object):
+    '''
+    configs: config_id -> config (a user of users.json here; search_cadence.py schedules the searches of search.json the same way)
+    '''
+    def __init__(self, configs, target_yield = TARGET_YIELD, min_interval = MIN_INTERVAL, max_interval = MAX_INTERVAL, decay = DECAY, update = None):
+
+        self.configs = configs
+
+        # merges a finished pass into configs, e.g., CheckpointJournal.update to journal it too
+        self.update = update if update else lambda config_id, config: self.configs[config_id].update(config)
+        self.target_yield = target_yield
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.decay = decay
+
+        self._heap = []
+        self._in_flight = set()
+        self._cond = threading.Condition()
+
+        for config_id in configs:
+            self._push(config_id)
+
+    def rate(self, config, now = None):
+        '''
+        estimated tweets per second
+        '''
+        tweets = config.get('tweets_seen', 0.0)
+        seconds = config.get('seconds_seen')
+
+        if seconds is None:
+            # not passed yet: no tweet since the newest one we have
+            since_ms = snowflake_ms(int(config.get('since_id', 1)))
+            now = now if now else time.time()
+            seconds = max(now - since_ms / 1000.0, 0) if since_ms > TWEPOCH else 0.0
+
+        return (tweets + PRIOR_TWEETS) / (seconds + PRIOR_SECONDS)
+
+    def expected(self, config, now = None):
+        '''
+        new tweets expected if the config is crawled at now
+        '''
+        now = now if now else time.time()
+        checked = config.get('checked')
+
+        return self.rate(config, now) * (now - checked) if checked else float('inf')
+
+    def due(self, config):
+        checked = config.get('checked')
+        if not checked:
+            return 0
+
+        interval = self.target_yield / self.rate(config, checked)
+
+        return checked + min(max(interval, self.min_interval), self.max_interval)
+
+    def ready(self, config):
+        '''
+        the earliest time config may be crawled again
+        '''
+        checked = config.get('checked')
+        return checked + self.min_interval if checked else 0
+
+    def _push(self, config_id, due = None):
+        config = self.configs[config_id]
+        if config.get('remove'):
+            return
+
+        heapq.heappush(self._heap, (self.due(config) if due is None else due, config_id))
+
+    def next(self, timeout = None):
+        '''
+        (config_id, seconds to wait before crawling it); (None, 0) once there's nothing left to crawl; waits (up to timeout) while every config is being crawled
+        '''
+        with self._cond:
+            while not self._heap:
+                if not self._in_flight:
+                    return None, 0
+
+                if not self._cond.wait(timeout):
+                    return None, 0
+
+            due, config_id = heapq.heappop(self._heap)
+            self._in_flight.add(config_id)
+
+            return config_id, max(self.ready(self.configs[config_id]) - time.time(), 0)
+
+    def observe(self, current, config, tweets, calls, oldest_id, now):
+        '''
+        the estimates of a pass that found tweets in calls calls, into config (current: before the pass)
+        '''
+        checked = current.get('checked')
+
+        if current.get('seconds_seen') is None:
+            # the first pass: since the since_id we started from, or (a timeline never crawled) since the oldest tweet it found
+            since_ms = snowflake_ms(int(current.get('since_id', 1)))
+            if since_ms <= TWEPOCH and oldest_id:
+                since_ms = snowflake_ms(int(oldest_id))
+
+            elapsed = max(now - since_ms / 1000.0, 0) if since_ms > TWEPOCH else 0.0
+        else:
+            elapsed = now - checked if checked else 0.0
+
+        config['tweets_seen'] = current.get('tweets_seen', 0.0) * self.decay + tweets
+        config['seconds_seen'] = current.get('seconds_seen', 0.0) * self.decay + elapsed
+
+    def done(self, config_id, config, tweets = None, calls = None, oldest_id = None, now = None):
+        '''
+        a pass of config_id finished (tweets new tweets in calls calls, the oldest of them oldest_id; None: it failed, it's tried again after min_interval); updates config with the estimates, and queues it again unless it's removed
+        '''
+        now = now if now else time.time()
+
+        with self._cond:
+            current = self.configs[config_id]
+
+            if tweets is not None:
+                self.observe(current, config, tweets, calls, oldest_id, now)
+                config['calls'] = current.get('calls', 0) + calls
+                config['yield'] = float(tweets) / calls if calls else 0.0
+
+            config['checked'] = int(now)
+
+            self.update(config_id, config)
+
+            self._in_flight.discard(config_id)
+            # a failed pass tells nothing about the rate, it's tried again as soon as it's ready
+            self._push(config_id, None if tweets is not None else self.ready(self.configs[config_id]))
+            self._cond.notify_all()
+
+    def queue(self, now = None):
+        '''
+        (due, expected new tweets, config_id) of the queued configs, earliest first
+        '''
+        now = now if now else time.time()
+
+        with self._cond:
+            return [(due, self.expected(self.configs[config_id], now), config_id) for due, config_id in sorted(self._heap)]
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-cc', '--command_config', help="users.json of the timeline command", required=True)
+    parser.add_argument('-n', '--top', help="print the first n users of the queue", type=int, default=20)
+
+    args = parser.parse_args()
+
+    from checkpoint import CheckpointJournal
+
+    checkpoint = CheckpointJournal(args.command_config)
+    timelines = ActivityScheduler(checkpoint.configs)
+
+    now = time.time()
+    queue = timelines.queue(now)
+    logger.info('users: %d; due now: %d'%(len(queue), sum(1 for due, _, _ in queue if due <= now)))
+
+    for due, expected, user_config_id in queue[:args.top]:
+        user_config = checkpoint.configs[user_config_id]
+        logger.info('[%s] due in %d secs; expected: %.1f; %.2f tweets/day; yield: %.1f/call'%(user_config_id, max(due - now, 0), expected, timelines.rate(user_config, now) * 86400, user_config.get('yield', 0.0)))
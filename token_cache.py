@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+token_cache.py: on-disk OAuth2 bearer tokens, shared by every worker process and across restarts
+
+BearerTokenCache: one file per app key (<folder>/<md5(app_key)>); a bearer token stays valid until twitter rejects it, so a cached token is only dropped with invalidate() after a 401 that says so (invalid_token(): error 89, "Invalid or expired token"; a protected timeline's 401 "Not authorized." is about the resource, not the token)
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os, json
+import twython
+from util import md5
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TOKEN_CACHE_FOLDER = os.path.expanduser('~/.twitter_tracker/tokens')
+INVALID_TOKEN = 89 # error code of an invalid or expired token
+
+def invalid_token(body):
+    '''
+    True if a 401 (its json body, or twython's message of it) rejects the bearer token itself
+    '''
+    text = body.decode('utf-8', 'ignore') if isinstance(body, bytes) else '%s'%body
+
+    try:
+        errors = json.loads(text).get('errors') or []
+        if any(error.get('code') == INVALID_TOKEN for error in errors if isinstance(error, dict)):
+            return True
+    except (ValueError, AttributeError):
+        pass
+
+    return 'invalid or expired token' in text.lower()
+
+class BearerTokenCache(object):
+
+    def __init__(self, folder = TOKEN_CACHE_FOLDER):
+        self.folder = os.path.abspath(folder)
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, mode=0o700)
+
+    def _filename(self, app_key):
+        return os.path.join(self.folder, md5(app_key.encode('utf-8')))
+
+    def load(self, app_key):
+        try:
+            with open(self._filename(app_key), 'r') as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+    def save(self, app_key, access_token):
+        filename = self._filename(app_key)
+        tmp_filename = '%s.%d.tmp'%(filename, os.getpid())
+
+        fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(access_token)
+
+        os.replace(tmp_filename, filename)
+
+    def invalidate(self, app_key, access_token = None):
+        '''
+        drop the cached token of app_key; with access_token, only if it's still the cached one (another process may have renewed it already)
+        '''
+        if access_token and self.load(app_key) != access_token:
+            return
+
+        try:
+            os.remove(self._filename(app_key))
+            logger.info('[%s] bearer token invalidated'%app_key)
+        except OSError:
+            pass
+
+    def get(self, app_key, app_secret, client_args = None, api_url = None):
+        '''
+        the cached token of app_key; fetches (and caches) one from oauth2/token (of api_url, e.g., a fake_twitter.py server, if given) if there isn't any; only one process fetches at a time
+        '''
+        access_token = self.load(app_key)
+        if access_token:
+            return access_token
+
+        with open('%s.lock'%self._filename(app_key), 'w') as lock_f:
+            if fcntl:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+
+            # someone else may have fetched it while we were waiting for the lock
+            access_token = self.load(app_key)
+            if access_token:
+                return access_token
+
+            twitter = twython.Twython(app_key, app_secret, oauth_version=2, client_args=client_args)
+            if api_url:
+                twitter.request_token_url = '%s/oauth2/token'%api_url.rstrip('/')
+            access_token = twitter.obtain_access_token()
+
+            self.save(app_key, access_token)
+
+        return access_token
@@ -5,6 +5,12 @@ twitter_streamer.py:
 
 KeywordsStreamer: straightforward class that tracks a list of keywords; most of the jobs are done by TwythonStreamer; the only thing this is just attach a WriteToHandler so results will be saved
 
+stream_url replaces https://stream.twitter.com (e.g., a fake_twitter.py server for load testing)
+
+tweets are written through a DailyWriter (see output_writer.py), which keeps the day file open and buffers writes; with queue_size > 0, on_success only enqueues the tweet and a QueuedWriter thread does the writing, so a slow disk doesn't back up the stream
+
+with a dedup_index (see dedup_index.py), tweets already in the index (e.g., seen before a reconnect) are dropped; the lookup runs on the writer thread if there is a queue
+
 '''
 
 import logging
@@ -18,43 +24,59 @@ requests_log.setLevel(logging.WARNING)
 import sys, time, argparse, json, os, pprint, datetime
 import twython
 from util import full_stack, chunks, md5
+from output_writer import DailyWriter, QueuedWriter, BUFFER_SIZE, FLUSH_INTERVAL, OVERFLOW_POLICIES, OUTPUT_FORMATS, SEGMENT_SIZE
+from dedup_index import DedupIndex, DedupWriter
+
+STREAM_URL = 'https://stream.twitter.com' # hardcoded in twython.streaming.types
 
 class TwitterStreamer(twython.TwythonStreamer):
 
-    def __init__(self, APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET, output_folder='./data'):
+    def __init__(self, APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET, output_folder='./data', buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL, queue_size=0, overflow='block', output_format='json', segment_size=SEGMENT_SIZE, segment_interval=None, stream_url=None, dedup_index=None):
+
+        self.stream_url = stream_url.rstrip('/') if stream_url else None
 
         self.output_folder = os.path.abspath(output_folder)
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
 
+        self.writer = DailyWriter(self.output_folder, buffer_size=buffer_size, flush_interval=flush_interval, output_format=output_format, segment_size=segment_size, segment_interval=segment_interval)
+
+        if dedup_index is not None:
+            self.writer = DedupWriter(self.writer, dedup_index)
+
+        if queue_size > 0:
+            self.writer = QueuedWriter(self.writer, queue_size=queue_size, overflow=overflow, spill_folder=self.output_folder, flush_interval=flush_interval)
+
         self.counter = 0
 
         super(TwitterStreamer, self).__init__(APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET)
 
+    def _request(self, url, method='GET', params=None):
+        if self.stream_url:
+            url = url.replace(STREAM_URL, self.stream_url)
+
+        return super(TwitterStreamer, self)._request(url, method=method, params=params)
+
     def on_success(self, tweet):
 
         if 'text' in tweet:
-            now = datetime.datetime.now()
-            month_folder = os.path.abspath('%s/%s'%(self.output_folder, now.strftime('%Y-%m')))
-            if not os.path.exists(month_folder):
-                os.makedirs(month_folder)
+            self.writer.write(tweet)
 
-            output_file = os.path.abspath('%s/%s.json'%(month_folder, now.strftime("%Y%m%d")))
-            
-            with open(output_file, 'a+') as f:
-                f.write('%s\n'%json.dumps(tweet))
+            self.counter += 1
+            if self.counter % 10000 == 0:
+                logger.info("received: %d; %.1f tweets/sec"%(self.counter, self.writer.rate()))
 
-                self.counter += 1
-                if self.counter % 10000 == 0:
-                    logger.info("received: %d"%self.counter)
+                if isinstance(self.writer, QueuedWriter):
+                    logger.info("queue depth: %(depth)d/%(queue_size)d; max depth: %(max_depth)d; spilled: %(spilled)d; dropped: %(dropped)d; errors: %(errors)d"%self.writer.stats())
             
-    def on_error(self, status_code, data):
+    def on_error(self, status_code, data, headers=None):
          logger.warn('ERROR CODE: [%s]-[%s]'%(status_code, data))
         
     def close(self):
         self.disconnect()
+        self.writer.close()
 
-def init_streamer(config, output_folder):
+def init_streamer(config, output_folder, **kwargs):
     
     apikeys = list(config['apikeys'].values()).pop()
 
@@ -68,20 +90,23 @@ def init_streamer(config, output_folder):
     OAUTH_TOKEN = apikeys['oauth_token']
     OAUTH_TOKEN_SECRET = apikeys['oauth_token_secret']
 
-    streamer = TwitterStreamer(APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET, output_folder=output_folder)
+    streamer = TwitterStreamer(APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET, output_folder=output_folder, **kwargs)
 
     return streamer
 
 
-def collect_public_tweets(config, output_folder):
+def collect_public_tweets(config, output_folder, **kwargs):
 
-    streamer = init_streamer(config, output_folder)
+    streamer = init_streamer(config, output_folder, **kwargs)
 
     logger.info("start collecting.....")
 
-    streamer.statuses.sample()
+    try:
+        streamer.statuses.sample()
+    finally:
+        streamer.close()
 
-def filter_by_locations(config, output_folder, locations = None):
+def filter_by_locations(config, output_folder, locations = None, **kwargs):
 
     with open(os.path.abspath(locations), 'r') as locations_f:
 
@@ -90,7 +115,7 @@ def filter_by_locations(config, output_folder, locations = None):
         name = geo_locations['name']
         locations = geo_locations['locations']
 
-        streamer = init_streamer(config, '%s/%s'%(output_folder,name))
+        streamer = init_streamer(config, '%s/%s'%(output_folder,name), **kwargs)
     
         logger.info("start collecting for %s....."%(name))
 
@@ -99,7 +124,10 @@ def filter_by_locations(config, output_folder, locations = None):
     #         locations = json.load(locations_f)
     #         locations = ','.join([','.join([str(g) for g in pair]) for pair in locations['bounding_box']])
 
-        streamer.statuses.filter(locations=locations)
+        try:
+            streamer.statuses.filter(locations=locations)
+        finally:
+            streamer.close()
 
 
 if __name__=="__main__":
@@ -108,9 +136,24 @@ if __name__=="__main__":
     parser.add_argument('-o','--output', help="output folder data", default="./data/")
     parser.add_argument('-cmd','--command', help="command", default="sample")
     parser.add_argument('-cc','--command_data', help="command data", default=None)
+    parser.add_argument('-b','--buffer_size', help="flush the output buffer once it reaches this many bytes", type=int, default=BUFFER_SIZE)
+    parser.add_argument('-fi','--flush_interval', help="flush the output buffer at least every n seconds", type=float, default=FLUSH_INTERVAL)
+    parser.add_argument('-q','--queue_size', help="decouple the stream from disk writes with a queue of this many tweets (0: write inline)", type=int, default=0)
+    parser.add_argument('-op','--overflow', help="what to do when the queue is full: %s"%(', '.join(OVERFLOW_POLICIES)), choices=OVERFLOW_POLICIES, default='block')
+    parser.add_argument('-f','--format', help="output format: %s (gzip/zstd are written as size-rotated segments)"%(', '.join(OUTPUT_FORMATS)), choices=OUTPUT_FORMATS, default='json')
+    parser.add_argument('-ss','--segment_size', help="segment size in MB for compressed output", type=int, default=SEGMENT_SIZE // (1024 * 1024))
+    parser.add_argument('-si','--segment_interval', help="also rotate a compressed segment after this many seconds (0: by size only)", type=int, default=0)
+    parser.add_argument('-su','--stream_url', help="base url of the streaming api, e.g., a fake_twitter.py server (default: twitter)", default=None)
+    parser.add_argument('-di','--dedup_index', help="folder of a dedup index (see dedup_index.py); tweets already in it are dropped", default=None)
 
     args = parser.parse_args()
 
+    writer_args = {'buffer_size': args.buffer_size, 'flush_interval': args.flush_interval, 'queue_size': args.queue_size, 'overflow': args.overflow, 'output_format': args.format, 'segment_size': args.segment_size * 1024 * 1024, 'segment_interval': args.segment_interval if args.segment_interval > 0 else None, 'stream_url': args.stream_url}
+
+    dedup_index = DedupIndex(args.dedup_index) if args.dedup_index else None
+    if dedup_index is not None:
+        writer_args['dedup_index'] = dedup_index
+
 
     with open(os.path.abspath(args.config), 'r') as config_f:
         config = json.load(config_f)
@@ -119,9 +162,9 @@ if __name__=="__main__":
             while(True):
                 try:
                     if (args.command == 'locations'):
-                        filter_by_locations(config, args.output, args.command_data)
+                        filter_by_locations(config, args.output, args.command_data, **writer_args)
                     else:
-                        collect_public_tweets(config, args.output)
+                        collect_public_tweets(config, args.output, **writer_args)
                 except Exception as exc:        
                     logger.error(exc)
                     #logger.error(full_stack())
@@ -133,4 +176,5 @@ if __name__=="__main__":
             logger.error('You pressed Ctrl+C!')
             pass
         finally:
-            pass
+            if dedup_index is not None:
+                dedup_index.close()
@@ -11,20 +11,41 @@ requests_log.setLevel(logging.WARNING)
 
 import sys, time, argparse, json, os, pprint, datetime, copy
 import twython
-from util import full_stack, chunks, md5
+from util import full_stack, chunks, md5, search_querystring
 from proxy_check import check_proxy_twython, proxy_checker, check_proxy
 from exceptions import NotImplemented, MissingArgs, WrongArgs, InvalidConfig, MaxRetryReached
+from output_writer import open_writer, shared_writer, kept_writer, JsonLinesWriter, OUTPUT_FORMATS, SEGMENT_SIZE
+from rate_limit import RateLimitTracker, endpoint_name
+from scheduler import QuotaScheduler
+from token_cache import BearerTokenCache, TOKEN_CACHE_FOLDER, invalid_token
+from key_workers import KeyWorkerPool
+from checkpoint import CheckpointJournal, LowWatermark, CursorStore
+from snowflake import CandidateSpace, hit_rate
+from frontier import BfsFrontier
+from edge_store import EdgePageWriter, shared_edge_writer, edges_prefix
+from relationship_diff import RelationshipStore, relationship_ids, output_files
+from timeline_scheduler import ActivityScheduler
+from search_cadence import SearchCadence
+from requests_oauthlib import OAuth2
 import concurrent.futures
 import functools
 import multiprocessing as mp
 import itertools
 import signal
+import threading
 import re
 import pandas as pd
 #sys.path.append(".")
 
 MAX_RETRY_CNT = 3
 WAIT_TIME = 30
+OUTPUT_FORMAT = 'json' # json, gzip or zstd; see output_writer.py
+SEGMENT_INTERVAL = None # seconds before a compressed segment is rotated, whatever its size (None: by size only)
+RELATIONSHIPS_FORMAT = 'json' # json (the output format above) or edges (/friends/ids and /followers/ids only); see edge_store.py
+RELATIONSHIPS_DIFF = None # folder of a RelationshipStore (see relationship_diff.py): keep only what changed since the last crawl of a user
+KEY_WORKERS = False # one long-lived process per api key; see key_workers.py
+API_URL = None # base url of the api, None for twitter; e.g., a fake_twitter.py server
+HISTORY_WINDOW = 4 # history lookups in flight or done past the saved current_id, per worker
 
 class TwitterCrawler(twython.Twython):
 
@@ -48,19 +69,87 @@ class TwitterCrawler(twython.Twython):
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
 
-        oauth2 = kwargs.pop('oauth2', True) # default to use oauth2 (application level access, read-only)
+        self.output_format = kwargs.pop('output_format', OUTPUT_FORMAT)
+        self.segment_size = kwargs.pop('segment_size', SEGMENT_SIZE)
+        self.segment_interval = kwargs.pop('segment_interval', SEGMENT_INTERVAL)
+        self.relationships_format = kwargs.pop('relationships_format', RELATIONSHIPS_FORMAT)
+        self.relationships_diff = kwargs.pop('relationships_diff', RELATIONSHIPS_DIFF)
 
-        if oauth2:
+        # x-rate-limit-* of every response, per endpoint; pass a shared dict as rate_limits to share them between crawlers
+        self.rate_limits = RateLimitTracker(apikeys['app_key'], kwargs.pop('rate_limits', None))
+
+        self.oauth2 = kwargs.pop('oauth2', True) # default to use oauth2 (application level access, read-only)
+
+        # bearer tokens are shared by all workers (and restarts) through the on-disk cache
+        self.token_cache = BearerTokenCache(kwargs.pop('token_cache', TOKEN_CACHE_FOLDER))
+
+        self.base_url = kwargs.pop('api_url', API_URL)
+        if self.base_url and self.base_url.startswith('http://'):
+            # requests_oauthlib refuses bearer tokens over plain http, e.g., to a local fake_twitter.py
+            os.environ.setdefault('OAUTHLIB_INSECURE_TRANSPORT', '1')
+
+        if self.oauth2:
             apikeys.pop('oauth_token')
             apikeys.pop('oauth_token_secret')
-            twitter = twython.Twython(apikeys['app_key'], apikeys['app_secret'], oauth_version=2)
-            access_token = twitter.obtain_access_token()
+            access_token = self.token_cache.get(apikeys['app_key'], apikeys['app_secret'], client_args=kwargs.get('client_args'), api_url=self.base_url)
             kwargs['access_token'] = access_token
             apikeys.pop('app_secret')
 
         kwargs.update(apikeys)
 
         super(TwitterCrawler, self).__init__(*args, **kwargs)
+
+        if self.base_url:
+            self.api_url = '%s/%%s'%self.base_url.rstrip('/')
+
+    def open_output(self, filename, mode='a', keep=False):
+        '''
+        a writer for filename in self.output_format; keep it open for the whole task, compressed output starts a new segment every time it's opened, unless keep (a file written again on every pass, e.g., a search or a timeline), see output_writer.kept_writer
+        '''
+        if keep:
+            return kept_writer(filename, self.output_format, segment_size=self.segment_size, segment_interval=self.segment_interval)
+
+        return open_writer(filename, self.output_format, mode=mode, segment_size=self.segment_size, segment_interval=self.segment_interval)
+
+    def renew_access_token(self):
+        '''
+        the bearer token got a 401: drop it from the cache and switch to a new one
+        '''
+        self.token_cache.invalidate(self.app_key, self.access_token)
+
+        self.access_token = self.token_cache.get(self.app_key, self.apikeys['app_secret'], client_args=self.client_args, api_url=self.base_url)
+        self.client.auth = OAuth2(self.app_key, token={'token_type': 'bearer', 'access_token': self.access_token})
+
+    def request(self, endpoint, method='GET', params=None, version='1.1', json_encoded=False):
+        '''
+        every api call goes through here; a 401 rejecting the bearer token (see token_cache.invalid_token) renews the token and retries once, any other 401 (e.g., a protected timeline) is raised as is
+        '''
+        api = endpoint_name(endpoint)
+
+        try:
+            return self.tracked_request(api, endpoint, method=method, params=params, version=version, json_encoded=json_encoded)
+        except twython.exceptions.TwythonAuthError as exc:
+            if not self.oauth2 or not invalid_token(exc.msg):
+                raise
+
+            logger.warn('[%s] bearer token rejected, renewing it'%self.app_key)
+            self.renew_access_token()
+
+            return self.tracked_request(api, endpoint, method=method, params=params, version=version, json_encoded=json_encoded)
+
+    def tracked_request(self, api, endpoint, method='GET', params=None, version='1.1', json_encoded=False):
+        '''
+        wait if the budget of the endpoint is used up, and record the x-rate-limit-* headers of the response (including 429s)
+        '''
+        self.rate_limits.wait(api)
+
+        self._last_call = None
+        try:
+            return super(TwitterCrawler, self).request(endpoint, method=method, params=params, version=version, json_encoded=json_encoded)
+        finally:
+            if self._last_call:
+                self.rate_limits.record(api, self._last_call['headers'], self._last_call['status_code'])
+
     def fetch_geo(self, query = None, now=datetime.datetime.now()):
 
         if not query:
@@ -84,8 +173,6 @@ class TwitterCrawler(twython.Twython):
                 with open(filename, 'a+') as f:
 
                     f.write('%s\n'%json.dumps(result))
-
-                time.sleep(1)
                 
                 return False
 
@@ -102,6 +189,13 @@ class TwitterCrawler(twython.Twython):
         return False
 
     def rate_limit_error_occured(self, resource, api):
+        '''
+        a 429 slipped through (e.g., another process used the same key); sleep until the reset recorded from its headers, and only ask /application/rate_limit_status if the response didn't have them
+        '''
+        if self.rate_limits.budget(api):
+            self.rate_limits.wait(api)
+            return
+
         rate_limits = self.get_application_rate_limit_status(resources=[resource])
 
         #e.g., ['resources']['followers']['/followers/list']['reset']
@@ -132,7 +226,7 @@ class TwitterCrawler(twython.Twython):
         else:
             filename = os.path.abspath('%s/%s'%(self.output_folder, filename))
 
-        retry_cnt = 0
+        retry_cnt = MAX_RETRY_CNT
         while retry_cnt > 0:
             try:
 
@@ -148,8 +242,6 @@ class TwitterCrawler(twython.Twython):
 
                         retry_cnt = 0
 
-                time.sleep(1)
-
             except twython.exceptions.TwythonRateLimitError:
                 self.rate_limit_error_occured('users', '/users/lookup')
             except Exception as exc:
@@ -162,9 +254,9 @@ class TwitterCrawler(twython.Twython):
 
         return False
 
-    def fetch_user_relationships(self, user_id = None, resource_family='friends', call='/friends/ids', now=datetime.datetime.now()):
+    def fetch_user_relationships(self, user_id = None, resource_family='friends', call='/friends/ids', now=datetime.datetime.now(), cursor_folder = None):
         '''
-        call: /friends/ids, /friends/list, /followers/ids, and /followers/list
+        call: /friends/ids, /friends/list, /followers/ids, and /followers/list; with a cursor_folder (see checkpoint.CursorStore), next_cursor is saved after every page and an interrupted user resumes from it, appending to the same file
         '''
         if not user_id:
             raise Exception("user_relationship: user_id cannot be None")
@@ -176,59 +268,89 @@ class TwitterCrawler(twython.Twython):
 
         filename = os.path.abspath('%s/%s'%(day_output_folder, user_id))
 
-        with open(filename, 'w') as f:
-            pass
-
         cursor = -1
-
         cnt = 0
+        mode = 'w'
 
-        retry_cnt = MAX_RETRY_CNT
-        while cursor != 0 and retry_cnt > 0:
-            try:
-                result = None
-                if (call == '/friends/ids'):
-                    result = self.get_friends_ids(user_id=user_id, cursor=cursor,count=5000)
+        cursors = CursorStore(cursor_folder) if cursor_folder else None
+        state = cursors.get(call, user_id) if cursors else None
 
-                    cnt += len(result['ids'])
-                elif (call == '/friends/list'):
+        if state:
+            if cursors.done(state):
+                logger.info("[%s] [%s] already done: %d"%(user_id, call, state['cnt']))
+                return False
 
-                    result = self.get_friends_list(user_id=user_id, cursor=cursor,count=200)
+            # the file of the day it started on; a page written after the last saved cursor is cut off (json), or written again (compressed segments and edges, where build_csr drops the duplicate edges)
+            cursor, cnt, filename, mode = state['cursor'], state['cnt'], state['filename'], 'a'
+            if state.get('size') is not None and os.path.exists(filename) and os.path.getsize(filename) > state['size']:
+                with open(filename, 'r+') as f:
+                    f.truncate(state['size'])
 
-                    cnt += len(result['users'])
-                elif (call == '/followers/ids'):
+            logger.info("[%s] [%s] resuming at cursor [%d] after %d"%(user_id, call, cursor, cnt))
 
-                    result = self.get_followers_ids(user_id=user_id, cursor=cursor,count=5000)
+        # the ids calls can go to an edge store (see edge_store.py) instead of a json file per user
+        if self.relationships_format == 'edges' and call.endswith('/ids'):
+            output = EdgePageWriter(shared_edge_writer(edges_prefix(day_output_folder, call)), user_id)
+        else:
+            output = self.open_output(filename, mode=mode)
 
-                    cnt += len(result['ids'])
-                elif (call == '/followers/list'):
+        with output as wf:
 
-                    result = self.get_followers_list(user_id=user_id, cursor=cursor,count=200)
+            retry_cnt = MAX_RETRY_CNT
+            while cursor != 0 and retry_cnt > 0:
+                try:
+                    result = None
+                    if (call == '/friends/ids'):
+                        result = self.get_friends_ids(user_id=user_id, cursor=cursor,count=5000)
 
-                    cnt += len(result['users'])
-                
-                if (result):
+                        cnt += len(result['ids'])
+                    elif (call == '/friends/list'):
 
-                    cursor = result['next_cursor'] 
+                        result = self.get_friends_list(user_id=user_id, cursor=cursor,count=200)
 
-                    with open(filename, 'a+') as f:
-                        f.write('%s\n'%json.dumps(result))
+                        cnt += len(result['users'])
+                    elif (call == '/followers/ids'):
 
+                        result = self.get_followers_ids(user_id=user_id, cursor=cursor,count=5000)
 
-                time.sleep(1)
+                        cnt += len(result['ids'])
+                    elif (call == '/followers/list'):
 
+                        result = self.get_followers_list(user_id=user_id, cursor=cursor,count=200)
 
-            except twython.exceptions.TwythonRateLimitError:
-                self.rate_limit_error_occured(resource_family, call)
-            except Exception as exc:
-                time.sleep(10)
-                logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
-                retry_cnt -= 1
-                if (retry_cnt == 0):
-                    logger.warn("exceed max retry... return")
-                    return False
+                        cnt += len(result['users'])
+                
+                    if (result):
+
+                        cursor = result['next_cursor'] 
+
+                        wf.write(result)
+
+                        if cursors:
+                            wf.flush()
+                            cursors.save(call, user_id, {'cursor': cursor, 'cnt': cnt, 'filename': filename, 'size': os.path.getsize(filename) if isinstance(output, JsonLinesWriter) else None})
+
+                except twython.exceptions.TwythonRateLimitError:
+                    self.rate_limit_error_occured(resource_family, call)
+                except Exception as exc:
+                    time.sleep(10)
+                    logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        # not tried again in this crawl (e.g., suspended or protected)
+                        if cursors:
+                            cursors.give_up(call, user_id, {'cursor': cursor, 'cnt': cnt, 'filename': filename, 'size': None})
+                        return False
 
         logger.info("[%s] total [%s]: %d; "%(user_id, call, cnt))
+
+        # the full crawl is only kept until it's diffed against the last one
+        if self.relationships_diff and call.endswith('/ids') and not isinstance(output, EdgePageWriter):
+            RelationshipStore(self.relationships_diff).update(call, user_id, relationship_ids(filename))
+            for f in output_files(filename):
+                os.remove(f)
+
         return False
 
     def fetch_retweets(self, tweet_id = None, now=datetime.datetime.now()):
@@ -264,8 +386,6 @@ class TwitterCrawler(twython.Twython):
 
                         f.write('%s\n'%json.dumps(result))
 
-                time.sleep(1)
-
                 return False, retweet_ids
 
             except twython.exceptions.TwythonRateLimitError:
@@ -298,48 +418,52 @@ class TwitterCrawler(twython.Twython):
 
         cnt = 0
 
-        retry_cnt = MAX_RETRY_CNT
-        while current_max_id != prev_max_id and retry_cnt > 0:
-            try:
-                if current_max_id > 0:
-                    tweets = self.get_user_timeline(user_id=user_id, since_id = since_id, max_id=current_max_id - 1, count=200)
-                else:
-                    tweets = self.get_user_timeline(user_id=user_id, since_id = since_id, count=200)
+        # what the pass returned for how many calls (see timeline_scheduler.py)
+        self.timeline_stats = {'tweets': 0, 'calls': 0}
 
-                prev_max_id = current_max_id # if no new tweets are found, the prev_max_id will be the same as current_max_id
+        with self.open_output(filename, keep=True) as wf:
+            retry_cnt = MAX_RETRY_CNT
+            while current_max_id != prev_max_id and retry_cnt > 0:
+                try:
+                    if current_max_id > 0:
+                        tweets = self.get_user_timeline(user_id=user_id, since_id = since_id, max_id=current_max_id - 1, count=200)
+                    else:
+                        tweets = self.get_user_timeline(user_id=user_id, since_id = since_id, count=200)
 
-                with open(filename, 'a+') as f:
+                    prev_max_id = current_max_id # if no new tweets are found, the prev_max_id will be the same as current_max_id
+                    self.timeline_stats['calls'] += 1
+
+                    wf.write_records(tweets)
                     for tweet in tweets:
-                        f.write('%s\n'%json.dumps(tweet))
                         if current_max_id == 0 or current_max_id > int(tweet['id']):
                             current_max_id = int(tweet['id'])
                         if current_since_id == 0 or current_since_id < int(tweet['id']):
                             current_since_id = int(tweet['id'])
 
-                #no new tweets found
-                if (prev_max_id == current_max_id):
-                    break;
-
-                #timeline.extend(tweets)
+                    #no new tweets found
+                    if (prev_max_id == current_max_id):
+                        break;
 
-                cnt += len(tweets)
+                    #timeline.extend(tweets)
 
-                # if (cnt % 100):
-                #     logger.info("received: [%d] for user: [%d]"%(cnt, user_id))
+                    cnt += len(tweets)
+                    self.timeline_stats['tweets'] = cnt
+                    self.timeline_stats['oldest_id'] = current_max_id
 
-                #logger.debug('%d > %d ? %s'%(prev_max_id, current_max_id, bool(prev_max_id > current_max_id)))
+                    # if (cnt % 100):
+                    #     logger.info("received: [%d] for user: [%d]"%(cnt, user_id))
 
-                time.sleep(1)
+                    #logger.debug('%d > %d ? %s'%(prev_max_id, current_max_id, bool(prev_max_id > current_max_id)))
 
-            except twython.exceptions.TwythonRateLimitError:
-                self.rate_limit_error_occured('statuses', '/statuses/user_timeline')
-            except Exception as exc:
-                time.sleep(10)
-                logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
-                retry_cnt -= 1
-                if (retry_cnt == 0):
-                    logger.warn("exceed max retry... return")
-                    return since_id, False, True
+                except twython.exceptions.TwythonRateLimitError:
+                    self.rate_limit_error_occured('statuses', '/statuses/user_timeline')
+                except Exception as exc:
+                    time.sleep(10)
+                    logger.error("exception: %s; when fetching user_id: %d"%(exc, user_id))
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        return since_id, False, True
 
         logger.info("[%s] total tweets: %d; since_id: [%d]"%(user_id, cnt, since_id))
         return current_since_id, False, False
@@ -371,53 +495,56 @@ class TwitterCrawler(twython.Twython):
         cnt = 0
         current_since_id = since_id
 
-        retry_cnt = MAX_RETRY_CNT
-        #result_tweets = []
-        while current_max_id != prev_max_id and retry_cnt > 0:
-            try:
-                if current_max_id > 0:
-                    tweets = self.search(q=query, geocode=geo, since_id=since_id, lang=lang, max_id=current_max_id-1, result_type='recent', count=100)
-                else:
-                    tweets = self.search(q=query, geocode=geo, since_id=since_id, lang=lang, result_type='recent', count=100)
+        # what the pass returned for how many calls (see search_cadence.py)
+        self.search_stats = {'tweets': 0, 'calls': 0}
 
+        with self.open_output(filename, keep=True) as wf:
+            retry_cnt = MAX_RETRY_CNT
+            #result_tweets = []
+            while current_max_id != prev_max_id and retry_cnt > 0:
+                try:
+                    if current_max_id > 0:
+                        tweets = self.search(q=query, geocode=geo, since_id=since_id, lang=lang, max_id=current_max_id-1, result_type='recent', count=100)
+                    else:
+                        tweets = self.search(q=query, geocode=geo, since_id=since_id, lang=lang, result_type='recent', count=100)
 
-                prev_max_id = current_max_id # if no new tweets are found, the prev_max_id will be the same as current_max_id
 
-                with open(filename, 'a+') as f:
+                    prev_max_id = current_max_id # if no new tweets are found, the prev_max_id will be the same as current_max_id
+                    self.search_stats['calls'] += 1
+
+                    wf.write_records(tweets['statuses'])
                     for tweet in tweets['statuses']:
-                        f.write('%s\n'%json.dumps(tweet))
                         if current_max_id == 0 or current_max_id > int(tweet['id']):
                             current_max_id = int(tweet['id'])
                         if current_since_id == 0 or current_since_id < int(tweet['id']):
                             current_since_id = int(tweet['id'])
 
-                #no new tweets found
-                if (prev_max_id == current_max_id):
-                    break;
-
-                #result_tweets.extend(tweets['statuses'])
+                    #no new tweets found
+                    if (prev_max_id == current_max_id):
+                        break;
 
-                cnt += len(tweets['statuses'])
+                    #result_tweets.extend(tweets['statuses'])
 
-                # if (cnt % 1000 == 0):
-                #     logger.info("[%d] tweets... "%cnt)
+                    cnt += len(tweets['statuses'])
+                    self.search_stats['tweets'] = cnt
 
-                #logger.info(cnt)
+                    # if (cnt % 1000 == 0):
+                    #     logger.info("[%d] tweets... "%cnt)
 
-                #logger.debug('%d > %d ? %s'%(prev_max_id, current_max_id, bool(prev_max_id > current_max_id)))
+                    #logger.info(cnt)
 
-                time.sleep(1)
+                    #logger.debug('%d > %d ? %s'%(prev_max_id, current_max_id, bool(prev_max_id > current_max_id)))
 
-            except twython.exceptions.TwythonRateLimitError:
-                self.rate_limit_error_occured('statuses', '/statuses/lookup.json')
-            except Exception as exc:
-                time.sleep(10)
-                logger.error("exception: %s"%exc)
-                retry_cnt -= 1
-                if (retry_cnt == 0):
-                    logger.warn("exceed max retry... return")
-                    return since_id, False
-                    #raise MaxRetryReached("max retry reached due to %s"%(exc))
+                except twython.exceptions.TwythonRateLimitError:
+                    self.rate_limit_error_occured('search', '/search/tweets')
+                except Exception as exc:
+                    time.sleep(10)
+                    logger.error("exception: %s"%exc)
+                    retry_cnt -= 1
+                    if (retry_cnt == 0):
+                        logger.warn("exceed max retry... return")
+                        return since_id, False
+                        #raise MaxRetryReached("max retry reached due to %s"%(exc))
 
         logger.info("[%s]; since_id: [%d]; total tweets: %d "%(query, since_id, cnt))
         return current_since_id, False
@@ -431,32 +558,44 @@ class TwitterCrawler(twython.Twython):
         return year, month
 
     def lookup_tweets_by_ids(self, tweets_id = None,  now=datetime.datetime.now()):
-
+        '''
+        the number of tweets found, or None if the lookup never got a response (the ids were not looked up)
+        '''
 
         if not tweets_id:
             raise Exception("tweets_history: tweets_id cannot be None")
 
-        cnt = 0
+        retry_cnt = MAX_RETRY_CNT
+        while retry_cnt > 0:
+            try:
 
-        try:
+                tweets = self.lookup_status(id=list(tweets_id))
+                cnt = len(tweets)
+                if (cnt > 0):
+                    if (self.output_format == 'json'):
+                        filename = os.path.abspath('%s/%s.json'%(self.output_folder, now.strftime('%Y%m%d')))
+                    else:
+                        filename = os.path.abspath('%s/%s'%(self.output_folder, now.strftime('%Y%m%d')))
 
-            tweets = self.lookup_status(id=list(tweets_id))
-            cnt = len(tweets)
-            if (cnt > 0):
-                for tweet in tweets:
-                    filename = os.path.abspath('%s/%s.json'%(self.output_folder, now.strftime('%Y%m%d')))
-                    with open(filename, 'a+') as f:
-                        f.write('%s\n'%json.dumps(tweet))
+                    # one chunk (and, compressed, one frame) per response, flushed so it's on disk when the task is done
+                    wf = shared_writer(filename, self.output_format, segment_size=self.segment_size, segment_interval=self.segment_interval)
+                    wf.write_records(tweets)
+                    wf.flush()
 
+                logger.info("total tweets: %d; since_id: [%d]"%(cnt, tweets_id[0]))
+                return cnt
 
-        except twython.exceptions.TwythonRateLimitError:
-            self.rate_limit_error_occured('search', '/search/tweets')
-        except Exception as exc:
-            time.sleep(10)
-            logger.error("exception: %s; when fetching tweet_id: %d"%(exc, tweets_id[0]))
+            except twython.exceptions.TwythonRateLimitError:
+                self.rate_limit_error_occured('statuses', '/statuses/lookup')
+            except Exception as exc:
+                time.sleep(10)
+                logger.error("exception: %s; when fetching tweet_id: %d"%(exc, tweets_id[0]))
+                retry_cnt -= 1
+                if (retry_cnt == 0):
+                    logger.warn("exceed max retry... return")
+                    return None
 
-        logger.info("total tweets: %d; since_id: [%d]"%(cnt, tweets_id[0]))
-        return False
+        return None
 
 def generate_apikey_proxy_pair(apikeys_list, proxies_list):
 
@@ -491,60 +630,80 @@ def apikey_proxy_pairs(apikeys_list, proxies_list):
 
     return apikey_proxy_pairs
 
-def fetch_users_worker(parameter, chunk, output_folder, filename, available, apikey_proxy_pairs_dict):
-
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-
+def build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, **kwargs):
+    '''
+    a TwitterCrawler for the apikeys of available, through the first of its proxies that passes check_proxy_twython
+    '''
     apikeys = copy.copy(apikey_proxy_pairs_dict[available]['apikeys'])
     proxies = copy.copy(apikey_proxy_pairs_dict[available]['proxies'])
 
-    proxies = iter(proxies) if proxies else None
+    client_args = {"timeout": timeout}
+
+    for proxy in proxies:
+        logger.info('checking [%s]'%proxy)
+        passed, proxy = check_proxy_twython(proxy['proxy'], 5, API_URL)
+        if passed:
+            logger.info('[%s] is alive'%proxy)
+            client_args['proxies'] = proxy['proxy_dict']
+            break
+
+        logger.warn('proxy failed, retry next one')
+    else:
+        if proxies:
+            raise Exception('[%s]: none of the proxies is alive'%available)
+
+    return TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder, **kwargs)
+
+def create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder, timeout = 30):
+    '''
+    KEY_WORKERS: a KeyWorkerPool, i.e., one long-lived process per key that builds its crawler once, and runs the *_task functions (the scheduler only hands out the keys of those max_workers processes)
+    otherwise: a ProcessPoolExecutor, which runs the *_worker functions (a new crawler per task)
+    '''
+    if not KEY_WORKERS:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+    keys = list(apikey_proxy_pairs_dict.keys())[:max_workers]
+    scheduler.retain(keys)
+
+    return KeyWorkerPool(keys, apikey_proxy_pairs_dict, build_crawler, output_folder = output_folder, timeout = timeout, rate_limits = scheduler.rate_limits)
+
+def fetch_users_task(twitterCralwer, parameter, chunk, filename):
 
     logger.info('REQUEST -> (chunk size: [%d])'%(len(chunk)))
 
-    client_args = {"timeout": 30}
+    retry = twitterCralwer.fetch_users(parameter=parameter, parameter_values=chunk, filename=filename)
+    logger.info("retry: %s"%(retry))
 
-    retry = True
-    try:
-        while(retry):
-            if proxies:
-                proxy = next(proxies)
-                logger.info('checking [%s]'%proxy)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                client_args['proxies'] = proxy['proxy_dict']
+def fetch_users_worker(parameter, chunk, output_folder, filename, available, apikey_proxy_pairs_dict, rate_limits = None):
 
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            retry = twitterCralwer.fetch_users(parameter=parameter, parameter_values=chunk, filename=filename)
-            logger.info("retry: %s"%(retry))
-    # except StopIteration as exc:
-    #     pass
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, rate_limits = rate_limits)
+        fetch_users_task(twitterCralwer, parameter, chunk, filename)
     except Exception as exc:
         logger.error(exc)
         pass
 
+    return available, None
 
-    return available
-
-def fetch_users_worker_done(future, available_apikey_proxy_pairs = []):
+def fetch_users_worker_done(future, scheduler = None):
 
-    available = future.result()
+    available, _ = future.result()
 
     logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
+    scheduler.release(available)
 
 
 def collect_users(parameter, users_config_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = []):
 
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
-    max_workers = len(available_apikey_proxy_pairs)
+    max_workers = len(apikey_proxy_pairs_dict)
 
     #max_workers = mp.cpu_count() if max_workers > mp.cpu_count() else max_workers
 
@@ -559,24 +718,24 @@ def collect_users(parameter, users_config_filename, output_folder, config, n_wor
     logger.info("concurrent workers: [%d]"%(max_workers))
 
     futures_ = []
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder) as executor:
 
         try:
 
             for chunk in chunks:
 
-                while(len(available_apikey_proxy_pairs) == 0):
-                    logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                    time.sleep(WAIT_TIME)
-
                 time.sleep(1)
 
                 now = datetime.datetime.now()
                 filename = now.strftime('%Y%m%d%H%M%S')
-                future_ = executor.submit(
-                            fetch_users_worker, parameter, chunk, output_folder, filename, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                available = scheduler.acquire('/users/lookup')
+                if KEY_WORKERS:
+                    future_ = executor.submit(available, fetch_users_task, parameter, chunk, filename)
+                else:
+                    future_ = executor.submit(
+                                fetch_users_worker, parameter, chunk, output_folder, filename, available, apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                future_.add_done_callback(functools.partial(fetch_users_worker_done, available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                future_.add_done_callback(functools.partial(fetch_users_worker_done, scheduler=scheduler))
 
                 futures_.append(future_)
             else:
@@ -590,110 +749,85 @@ def collect_users(parameter, users_config_filename, output_folder, config, n_wor
             executor.shutdown()
             raise
 
-def fetch_retweets_worker(tweet_id, now, output_folder, available, apikey_proxy_pairs_dict):
+def fetch_retweets_task(twitterCralwer, tweet_id, now):
 
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info('REQUEST -> (tweet_id: [%d])'%(tweet_id))
 
-    apikeys = copy.copy(apikey_proxy_pairs_dict[available]['apikeys'])
-    proxies = copy.copy(apikey_proxy_pairs_dict[available]['proxies'])
+    retry, retweet_ids = twitterCralwer.fetch_retweets(tweet_id, now=now)
+    logger.info("retry: %s"%(retry))
 
-    proxies = iter(proxies) if proxies else None
+    return retweet_ids
 
-    logger.info('REQUEST -> (tweet_id: [%d])'%(tweet_id))
+def fetch_retweets_worker(tweet_id, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None):
 
-    client_args = {"timeout": 60}
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    retry = True
-    retweet_ids = set()
+    retweet_ids = None
     try:
-        while(retry):
-            if proxies:
-                proxy = next(proxies)
-                logger.info('checking [%s]'%proxy)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                client_args['proxies'] = proxy['proxy_dict']
-
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            retry, retweet_ids = twitterCralwer.fetch_retweets(tweet_id, now=now)
-            logger.info("retry: %s"%(retry))
-    # except StopIteration as exc:
-    #     pass
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 60, rate_limits = rate_limits)
+        retweet_ids = fetch_retweets_task(twitterCralwer, tweet_id, now)
     except Exception as exc:
         logger.error(exc)
         pass
 
-
     return available, retweet_ids
 
-def fetch_retweets_worker_done(future, available_apikey_proxy_pairs = [], retweet_ids = set()):
+def fetch_retweets_worker_done(future, tweet_id = None, frontier = None, landed = None, scheduler = None):
 
-    available, this_retweet_ids = future.result()
+    try:
+        available, retweet_ids = future.result()
 
-    logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
-    retweet_ids |= this_retweet_ids
+        logger.info('finished... [%s]'%available)
+        scheduler.release(available)
+
+        # a failed fetch (None) isn't marked done, so it's retried on a restart
+        if retweet_ids is not None:
+            frontier.done(tweet_id, retweet_ids)
+    finally:
+        # futures are done before their callbacks run
+        landed.release()
 
+def fetch_user_relationships_task(twitterCralwer, user_id, resource_family, call, now, cursor_folder = None):
 
+    logger.info('REQUEST -> (user_id: [%d]; call: [%s])'%(user_id, call))
+
+    retry = twitterCralwer.fetch_user_relationships(user_id, resource_family=resource_family, call=call, now=now, cursor_folder=cursor_folder)
+    logger.info("retry: %s"%(retry))
 
-def fetch_user_relationships_worker(user_id, resource_family, call, now, output_folder, available, apikey_proxy_pairs_dict):
+def fetch_user_relationships_worker(user_id, resource_family, call, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None, cursor_folder = None):
 
     # Ignore the SIGINT signal by setting the handler to the standard
     # signal handler SIG_IGN.
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    apikeys = copy.copy(apikey_proxy_pairs_dict[available]['apikeys'])
-    proxies = copy.copy(apikey_proxy_pairs_dict[available]['proxies'])
-
-    proxies = iter(proxies) if proxies else None
-
-    logger.info('REQUEST -> (user_id: [%d]; call: [%s])'%(user_id, call))
-
-    client_args = {"timeout": 30}
-
-    retry = True
-    remove = False
     try:
-        while(retry):
-            if proxies:
-                proxy = next(proxies)
-                logger.info('checking [%s]'%proxy)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                client_args['proxies'] = proxy['proxy_dict']
-
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            retry = twitterCralwer.fetch_user_relationships(user_id, resource_family=resource_family, call=call, now=now)
-            logger.info("retry: %s"%(retry))
-    # except StopIteration as exc:
-    #     pass
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, rate_limits = rate_limits)
+        fetch_user_relationships_task(twitterCralwer, user_id, resource_family, call, now, cursor_folder)
     except Exception as exc:
         logger.error(exc)
         pass
 
+    return available, None
 
-    return available
-
-def fetch_user_relationships_worker_done(future, available_apikey_proxy_pairs = []):
+def fetch_user_relationships_worker_done(future, scheduler = None):
 
-    available = future.result()
+    available, _ = future.result()
 
     logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
+    scheduler.release(available)
 
-def collect_user_relatinoships_by_user_ids(call, user_ids_config_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = []):
+def collect_user_relatinoships_by_user_ids(call, user_ids_config_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = [], cursor_folder = None):
+    '''
+    the cursors are saved in cursor_folder (default: <user_ids_config_filename>.cursors, see checkpoint.CursorStore), so a restart skips the users that are done and resumes the others at their next page; they're removed once every user is done or given up (or after checkpoint.MAX_PASSES passes), and the next crawl starts over
+    '''
 
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
-    max_workers = len(available_apikey_proxy_pairs)
+    max_workers = len(apikey_proxy_pairs_dict)
 
     #max_workers = mp.cpu_count() if max_workers > mp.cpu_count() else max_workers
 
@@ -703,7 +837,11 @@ def collect_user_relatinoships_by_user_ids(call, user_ids_config_filename, outpu
 
     user_ids = set(user_ids)
 
-    logger.info("tracking [%d] users' [%s]"%(len(user_ids), call))
+    cursor_folder = cursor_folder if cursor_folder else '%s.cursors'%os.path.abspath(user_ids_config_filename)
+    cursors = CursorStore(cursor_folder)
+    run = cursors.begin(call)
+
+    logger.info("tracking [%d] users' [%s]; crawl [%s], pass [%d]"%(len(user_ids), call, run['run'], run['passes'] + 1))
 
     max_workers = max_workers if max_workers < len(user_ids) else len(user_ids)
     max_workers = n_workers if n_workers < max_workers else max_workers
@@ -715,27 +853,36 @@ def collect_user_relatinoships_by_user_ids(call, user_ids_config_filename, outpu
         resource_family = m.group('resource_family')
 
     futures_ = []
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder) as executor:
 
         try:
 
             for user_id in user_ids:
 
-                while(len(available_apikey_proxy_pairs) == 0):
-                    logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                    time.sleep(WAIT_TIME)
-
+                if cursors.done(cursors.get(call, user_id)):
+                    continue
 
                 now = datetime.datetime.now()
-                future_ = executor.submit(
-                            fetch_user_relationships_worker, user_id, resource_family, call, now, output_folder, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                available = scheduler.acquire(call)
+                if KEY_WORKERS:
+                    future_ = executor.submit(available, fetch_user_relationships_task, user_id, resource_family, call, now, cursor_folder)
+                else:
+                    future_ = executor.submit(
+                                fetch_user_relationships_worker, user_id, resource_family, call, now, output_folder, available, apikey_proxy_pairs_dict, scheduler.rate_limits, cursor_folder)
 
-                future_.add_done_callback(functools.partial(fetch_user_relationships_worker_done, available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                future_.add_done_callback(functools.partial(fetch_user_relationships_worker_done, scheduler=scheduler))
 
                 futures_.append(future_)
             else:
                 concurrent.futures.wait(futures_)
                 executor.shutdown()
+
+                given_up = cursors.end_pass(call, user_ids)
+                if given_up is None:
+                    logger.warn("[%s] unfinished users are kept in [%s], run again to resume them"%(call, cursor_folder))
+                elif given_up:
+                    logger.warn("[%s] gave up on [%d] users: %s"%(call, len(given_up), given_up[:100]))
+
                 return False
 
         except KeyboardInterrupt:
@@ -744,262 +891,276 @@ def collect_user_relatinoships_by_user_ids(call, user_ids_config_filename, outpu
             executor.shutdown()
             raise
 
-def collect_retweets_by_tweets_ids(output_folder = None, config = None, tweets_ids = set(), n_workers = 1, proxies = None, level = -1):
-
-        apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
-
-        available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+def collect_retweets_by_tweets_ids(output_folder = None, config = None, tweets_ids = set(), n_workers = 1, proxies = None, level = -1, frontier_folder = None):
+    '''
+    a breadth first crawl of retweets, level by level with one pool for all of them; the frontier (see frontier.py) is on disk, so a restart resumes the level it stopped at, and a tweet is never fetched twice; level <= 0: until no new retweets are found
+    '''
+    apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-        max_workers = len(available_apikey_proxy_pairs)
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
-        logger.info("tracking[%d] tweet" %(len(tweets_ids)))
+    max_workers = len(apikey_proxy_pairs_dict)
+    max_workers = n_workers if n_workers < max_workers else max_workers
+    logger.info("concurrent workers: [%d]" %(max_workers))
 
-        max_workers = max_workers if max_workers < len(tweets_ids) else len(tweets_ids)
-        max_workers = n_workers if n_workers < max_workers else max_workers
-        logger.info("concurrent workers: [%d]" %(max_workers))
+    frontier = BfsFrontier(frontier_folder if frontier_folder else '%s/retweets.frontier'%output_folder)
+    if frontier.finished:
+        logger.info('[%s] the last crawl is finished, starting over'%frontier.folder)
+        frontier.reset()
 
-        retweet_ids = set()
-        futures_ = []
+    frontier.seed(tweets_ids)
 
-        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    futures_ = []
+    retry_cnt = MAX_RETRY_CNT
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder, timeout = 60) as executor:
+        try:
+            while level <= 0 or frontier.level < level:
 
-            try:
+                tweets_ids = frontier.pending()
+                logger.info("[RETWEETS]: working on level %d; [%d] tweets"%(frontier.level, len(tweets_ids)))
 
+                landed = threading.Semaphore(0)
 
                 for tweet_id in tweets_ids:
 
-                    while(len(available_apikey_proxy_pairs) == 0):
-                        logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                        time.sleep(WAIT_TIME)
-
                     now = datetime.datetime.now()
-                    future_ = executor.submit(
-                                fetch_retweets_worker, tweet_id, now, output_folder, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                    available = scheduler.acquire('/statuses/retweets/:id')
+                    if KEY_WORKERS:
+                        future_ = executor.submit(available, fetch_retweets_task, tweet_id, now)
+                    else:
+                        future_ = executor.submit(
+                                    fetch_retweets_worker, tweet_id, now, output_folder, available, apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                    future_.add_done_callback(functools.partial(fetch_retweets_worker_done, available_apikey_proxy_pairs=available_apikey_proxy_pairs, retweet_ids = retweet_ids))
+                    future_.add_done_callback(functools.partial(fetch_retweets_worker_done, tweet_id=tweet_id, frontier=frontier, landed=landed, scheduler=scheduler))
 
                     futures_.append(future_)
-                else:
-                    # logger.info('finished one layer')
-                    concurrent.futures.wait(futures_)
-                    executor.shutdown()
-                    level -= 1
-                    logger.info("[RETWEETS]: working on level %s"%(level))
-                    if ((level == 0) or (len(retweet_ids) == 0)):
-                        return False
-                    #elif ((level > 0 or level < 0) and len(retweet_ids) > 0):
-                    else:
-                        collect_retweets_by_tweets_ids(output_folder = output_folder, config = config, tweets_ids = retweet_ids, n_workers = n_workers, proxies = proxies, level = level)
 
-                return False
+                for future_ in futures_:
+                    landed.acquire()
+                futures_ = []
 
-            except KeyboardInterrupt:
-                logger.warn('You pressed Ctrl+C! But we will wait until all sub processes are finished...')
-                concurrent.futures.wait(futures_)
-                executor.shutdown()
-                raise
+                # tweets that failed stay pending; the level is only checkpointed once all of them are done
+                tweets_ids = frontier.pending()
+                if tweets_ids:
+                    retry_cnt -= 1
+                    if retry_cnt > 0:
+                        logger.warn("[RETWEETS]: level %d isn't finished, retrying [%d] tweets"%(frontier.level, len(tweets_ids)))
+                        continue
+
+                    logger.warn("exceed max retry... giving up on [%d] tweets"%len(tweets_ids))
+                    for tweet_id in tweets_ids:
+                        frontier.done(tweet_id)
+
+                retry_cnt = MAX_RETRY_CNT
+                if not frontier.next_level():
+                    break
+            else:
+                frontier.finish()
 
-        return False
+            logger.info("[RETWEETS]: %s"%json.dumps(frontier.stats()))
+
+        except KeyboardInterrupt:
+            logger.warn('You pressed Ctrl+C! But we will wait until all sub processes are finished...')
+            concurrent.futures.wait(futures_)
+            executor.shutdown()
+            raise
+        finally:
+            frontier.close()
+
+    return False
 
 def collect_retweets (input_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = [], level = 0):
     tweets_ids = set()
 
     if (input_filename.endswith('.csv')):
         from reader_csv_column import CsvFile,EXCLUDE
-        csvfile = CsvFile(csvfilename)
+        csvfile = CsvFile(input_filename)
         id_column = csvfile.get_column('id')
         for element in id_column:
             tweets_ids.add(int(element))
     elif (input_filename.endswith('.json')):
-        with open(os.path.abspath(user_ids_config_filename), 'r') as user_ids_config_rf:
-            tweets_ids = set(json.load(user_ids_config_rf))
+        with open(os.path.abspath(input_filename), 'r') as tweets_ids_rf:
+            tweets_ids = set(json.load(tweets_ids_rf))
 
     if (len(tweets_ids) > 0):
-        return collect_retweets_by_tweets_ids(output_folder = output_folder, config = config, tweets_ids = tweets_ids, n_workers = n_workers, proxies = proxies, level = level)
-
-def fetch_user_timeline_worker(user_config, now, output_folder, available, apikey_proxy_pairs_dict):
-
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+        return collect_retweets_by_tweets_ids(output_folder = output_folder, config = config, tweets_ids = tweets_ids, n_workers = n_workers, proxies = proxies, level = level, frontier_folder = '%s.frontier'%os.path.abspath(input_filename))
 
-    apikeys = copy.copy(apikey_proxy_pairs_dict[available]['apikeys'])
-    proxies = copy.copy(apikey_proxy_pairs_dict[available]['proxies'])
-
-    proxies = iter(proxies) if proxies else None
+def fetch_user_timeline_task(twitterCralwer, user_config, now):
 
     user_id = user_config['user_id']
     since_id = user_config['since_id'] if 'since_id' in user_config else 1
 
     logger.info('REQUEST -> (user_id: [%d]; since_id: [%d])'%(user_id, since_id))
 
-    client_args = {"timeout": 30}
-
-    retry = True
-    remove = False
-    try:
-        while(retry):
-            if proxies:
-                proxy = next(proxies)
-                logger.info('checking [%s]'%proxy)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                client_args['proxies'] = proxy['proxy_dict']
-
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            since_id, retry, remove = twitterCralwer.fetch_user_timeline(user_id, now=now, since_id = since_id)
-            logger.info("since_id: %d; retry: %s"%(since_id, retry))
-    # except StopIteration as exc:
-    #     pass
-    except Exception as exc:
-        logger.error(exc)
-        pass
+    since_id, retry, remove = twitterCralwer.fetch_user_timeline(user_id, now=now, since_id = since_id)
+    logger.info("since_id: %d; retry: %s"%(since_id, retry))
 
     user_config['since_id'] = since_id
     user_config['remove'] = remove
+    user_config['timeline_stats'] = twitterCralwer.timeline_stats
 
-    return available, user_config
+    return user_config
 
-def fetch_user_timeline_worker_done(future, now=None, output_folder = None, user_config_id = None, users_config = None, users_config_filename = None, available_apikey_proxy_pairs = []):
+def fetch_user_timeline_worker(user_config, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None):
 
-    available, user_config = future.result()
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    users_config[user_config_id] = user_config
+    try:
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, rate_limits = rate_limits)
+        user_config = fetch_user_timeline_task(twitterCralwer, user_config, now)
+    except Exception as exc:
+        logger.error(exc)
+        pass
 
-    with open(os.path.abspath(users_config_filename), 'w') as users_config_wf:
-            json.dump(users_config, users_config_wf)
+    if 'since_id' not in user_config:
+        user_config['since_id'] = 1
+    user_config['remove'] = user_config.get('remove', False)
 
-    day_output_folder = os.path.abspath('%s/%s'%(output_folder, now.strftime('%Y%m%d')))
+    return available, user_config
 
-    if not os.path.exists(day_output_folder):
-        os.makedirs(day_output_folder)
+def fetch_user_timeline_worker_done(future, now=None, user_config_id = None, available = None, scheduler = None, timelines = None):
 
-    with open(os.path.abspath('%s/users.json'%day_output_folder), 'w') as users_config_wf:
-        json.dump(users_config, users_config_wf)
+    try:
+        try:
+            available, user_config = future.result()
+        except Exception as exc:
+            logger.error('[%s] %s'%(user_config_id, exc))
+            user_config = None
 
-    logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
+        if user_config:
+            # the rate estimate of the user (see timeline_scheduler.py) is updated and it's queued again; only the since_id/remove/estimates of this user go to the journal, users.json (and <day>/users.json) are rewritten on compaction
+            stats = user_config.pop('timeline_stats', None) or {}
+            timelines.done(user_config_id, user_config, stats.get('tweets'), stats.get('calls'), stats.get('oldest_id'))
+        else:
+            # a failed or lost task (e.g., its key worker died): the user is tried again after min_interval
+            timelines.done(user_config_id, {}, None)
+    finally:
+        logger.info('finished... [%s]'%available)
+        scheduler.release(available)
 
 def collect_tweets_by_user_ids(users_config_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = []):
 
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
-    max_workers = len(available_apikey_proxy_pairs)
+    max_workers = len(apikey_proxy_pairs_dict)
 
     #max_workers = mp.cpu_count() if max_workers > mp.cpu_count() else max_workers
 
-    users_config = {}
-    with open(os.path.abspath(users_config_filename), 'r') as users_config_rf:
-        users_config = json.load(users_config_rf)
+    checkpoint = CheckpointJournal(users_config_filename, day_folder = output_folder, day_name = 'users.json')
+    users_config = checkpoint.configs
 
     max_workers = max_workers if max_workers < len(users_config) else len(users_config)
     max_workers = n_workers if n_workers < max_workers else max_workers
     logger.info("concurrent workers: [%d]"%(max_workers))
 
+    # the most productive timeline first, instead of every user once per cycle
+    timelines = ActivityScheduler(users_config, update = checkpoint.update)
+
     futures_ = []
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder) as executor:
 
         try:
 
-            for user_config_id in itertools.cycle(users_config):
-                user_config = users_config[user_config_id]
-                if ('remove' in user_config and user_config['remove']):
-                    continue
+            while True:
+                user_config_id, wait = timelines.next()
+                if user_config_id is None:
+                    # every user is removed
+                    concurrent.futures.wait(futures_)
+                    executor.shutdown()
+                    checkpoint.close()
+                    return False
+
+                if wait > 0:
+                    time.sleep(wait)
 
-                while(len(available_apikey_proxy_pairs) == 0):
-                    logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                    time.sleep(WAIT_TIME)
+                user_config = copy.copy(users_config[user_config_id])
 
                 now = datetime.datetime.now()
-                future_ = executor.submit(
-                            fetch_user_timeline_worker, user_config, now, output_folder, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                available = scheduler.acquire('/statuses/user_timeline')
+                if KEY_WORKERS:
+                    future_ = executor.submit(available, fetch_user_timeline_task, user_config, now)
+                else:
+                    future_ = executor.submit(
+                                fetch_user_timeline_worker, user_config, now, output_folder, available, apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                future_.add_done_callback(functools.partial(fetch_user_timeline_worker_done, now=now, output_folder=output_folder, user_config_id = user_config_id, users_config=users_config, users_config_filename=users_config_filename, available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                future_.add_done_callback(functools.partial(fetch_user_timeline_worker_done, now=now, user_config_id = user_config_id, available = available, scheduler=scheduler, timelines=timelines))
 
-                futures_.append(future_)
+                futures_ = [f for f in futures_ if not f.done()] + [future_]
         except KeyboardInterrupt:
             logger.warn('You pressed Ctrl+C! But we will wait until all sub processes are finished...')
             concurrent.futures.wait(futures_)
             executor.shutdown()
+            checkpoint.close()
             raise
 
 
-def search_by_terms_worker(search_config, now, output_folder, available, apikey_proxy_pairs_dict):
-
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-
-    apikeys = apikey_proxy_pairs_dict[available]['apikeys']
-    proxies = apikey_proxy_pairs_dict[available]['proxies']
-
-    proxies = iter(proxies) if proxies else None
+def search_by_terms_task(twitterCralwer, search_config, now):
 
     search_terms = [term.lower() for term in search_config['terms']]
-    querystring = '%s'%(' OR '.join('(' + term + ')' for term in search_terms))
+    querystring = search_querystring(search_terms)
     output_filename = search_config['output_filename'] if 'output_filename' in search_config else md5(querystring.encode('utf-8'))
     since_id = search_config['since_id'] if 'since_id' in search_config else 0
     geocode = tuple(search_config['geocode']) if ('geocode' in search_config and search_config['geocode']) else None
 
+    search_config['querystring'] = querystring
+    search_config['output_filename'] = output_filename
+    search_config['geocode'] = geocode
+
     logger.info('REQUEST -> (output_filename: [%s]; since_id: [%d]; geocode: [%s])'%(output_filename, since_id, geocode))
 
-    client_args = {"timeout": 30}
+    since_id, retry = twitterCralwer.search_by_query(querystring, geocode = geocode, since_id = since_id, now=now, output_filename = output_filename)
+    logger.info("since_id: %d; retry: %s"%(since_id, retry))
 
-    retry = True
-    try:
-        while(retry):
-            if proxies:
-                proxy = next(proxies)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                else:
-                    logger.info('[%s] is alive'%proxy)
-                client_args['proxies'] = proxy['proxy_dict']
+    search_config['since_id'] = since_id
+    search_config['search_stats'] = twitterCralwer.search_stats
 
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            since_id, retry = twitterCralwer.search_by_query(querystring, geocode = geocode, since_id = since_id, now=now, output_filename = output_filename)
-            logger.info("since_id: %d; retry: %s"%(since_id, retry))
-    # except StopIteration as exc:
-    #     pass
+    #logger.info("return from: %s"%(search_config))
+    return search_config
+
+def search_by_terms_worker(search_config, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None):
+
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, rate_limits = rate_limits)
+        search_config = search_by_terms_task(twitterCralwer, search_config, now)
     except Exception as exc:
         logger.error(exc)
         pass
 
-    search_config['since_id'] = since_id
-    search_config['querystring'] = querystring
-    search_config['output_filename'] = output_filename
-    search_config['geocode'] = geocode
+    if 'since_id' not in search_config:
+        search_config['since_id'] = 0
 
-    #logger.info("return from: %s"%(search_config))
     return available, search_config
 
 
-def search_by_terms_worker_done(future, output_folder=None, now = None, search_config_id = None, search_configs = None, search_configs_filename = None, available_apikey_proxy_pairs = []):
+def search_by_terms_worker_done(future, now = None, search_config_id = None, available = None, scheduler = None, cadence = None):
 
     logger.info("callback runs in PID: [%s]"%os.getpid())
-    available, search_config = future.result()
-
-    search_configs[search_config_id] = search_config
-
-    with open(os.path.abspath(search_configs_filename), 'w') as search_configs_wf:
-        json.dump(search_configs, search_configs_wf)
 
-    day_output_folder = os.path.abspath('%s/%s'%(output_folder, now.strftime('%Y%m%d')))
-
-    if not os.path.exists(day_output_folder):
-        os.makedirs(day_output_folder)
-
-    with open(os.path.abspath('%s/search.json'%day_output_folder), 'w') as search_configs_wf:
-        json.dump(search_configs, search_configs_wf)
+    try:
+        try:
+            available, search_config = future.result()
+        except Exception as exc:
+            logger.error('[%s] %s'%(search_config_id, exc))
+            search_config = None
 
-    logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
+        if search_config:
+            # the interval of the search (see search_cadence.py) follows what it found, and it's queued again; only what changed in this search goes to the journal, search.json (and <day>/search.json) are rewritten on compaction
+            stats = search_config.pop('search_stats', None) or {}
+            cadence.done(search_config_id, search_config, stats.get('tweets'), stats.get('calls'))
+        else:
+            # a failed or lost task: the search keeps its interval and runs again once it's up
+            cadence.done(search_config_id, {}, None)
+    finally:
+        logger.info('finished... [%s]'%available)
+        scheduler.release(available)
 
 
 def collect_tweets_by_search_terms(search_configs_filename, output_folder, config, n_workers = mp.cpu_count(), proxies = []):
@@ -1008,17 +1169,16 @@ def collect_tweets_by_search_terms(search_configs_filename, output_folder, confi
 
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
     # at most the number of avaliable apikey and proxy pairs
-    max_workers = len(available_apikey_proxy_pairs)
+    max_workers = len(apikey_proxy_pairs_dict)
 
     # at most number of cpu
     #max_workers = mp.cpu_count() if max_workers > mp.cpu_count() else max_workers
 
-    search_configs = {}
-    with open(os.path.abspath(search_configs_filename), 'r') as search_configs_rf:
-        search_configs = json.load(search_configs_rf)
+    checkpoint = CheckpointJournal(search_configs_filename, day_folder = output_folder, day_name = 'search.json')
+    search_configs = checkpoint.configs
 
     # at most number of searches
     max_workers = max_workers if max_workers < len(search_configs) else len(search_configs)
@@ -1026,41 +1186,52 @@ def collect_tweets_by_search_terms(search_configs_filename, output_folder, confi
 
     logger.info("concurrent workers: [%d]"%(max_workers))
 
+    # every search at its own pace, by what it has been finding
+    cadence = SearchCadence(search_configs, update = checkpoint.update)
+
     futures_ = []
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder) as executor:
 
         try:
-            for search_config_id in itertools.cycle(search_configs):
-
-                while(len(available_apikey_proxy_pairs) == 0):
-                    logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                    time.sleep(WAIT_TIME)
+            while True:
+                search_config_id, _ = cadence.next()
+                if search_config_id is None:
+                    # no searches
+                    concurrent.futures.wait(futures_)
+                    executor.shutdown()
+                    checkpoint.close()
+                    return False
 
                 now = datetime.datetime.now()
                 
-                search_config = search_configs[search_config_id]
+                search_config = copy.copy(search_configs[search_config_id])
 
-                future_ = executor.submit(
-                            search_by_terms_worker, search_config, now, output_folder, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                available = scheduler.acquire('/search/tweets')
+                if KEY_WORKERS:
+                    future_ = executor.submit(available, search_by_terms_task, search_config, now)
+                else:
+                    future_ = executor.submit(
+                                search_by_terms_worker, search_config, now, output_folder, available, apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                future_.add_done_callback(functools.partial(search_by_terms_worker_done, output_folder=output_folder, now = now, search_config_id = search_config_id, search_configs = search_configs, search_configs_filename = search_configs_filename, available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                future_.add_done_callback(functools.partial(search_by_terms_worker_done, now = now, search_config_id = search_config_id, available = available, scheduler=scheduler, cadence=cadence))
 
-                futures_.append(future_)
+                futures_ = [f for f in futures_ if not f.done()] + [future_]
         except KeyboardInterrupt:
             logger.warn('You pressed Ctrl+C! But we will wait until all sub processes are finished...')
                 # this is acutally impossible to run
             concurrent.futures.wait(futures_)
 
             executor.shutdown()
+            checkpoint.close()
             raise
-def search_by_city_worker_done(future, output_folder=None, now = None, search_configs_filename = None, available_apikey_proxy_pairs = []):
+def search_by_city_worker_done(future, output_folder=None, now = None, search_configs_filename = None, scheduler = None):
 
     available = future.result()
 
 
-    available_apikey_proxy_pairs.append(available)
+    scheduler.release(available)
 
-def search_by_city_worker(search_config, now, output_folder, available, apikey_proxy_pairs_dict):
+def search_by_city_worker(search_config, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None):
     # Ignore the SIGINT signal by setting the handler to the standard
     # signal handler SIG_IGN.
     signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -1079,7 +1250,7 @@ def search_by_city_worker(search_config, now, output_folder, available, apikey_p
         while(retry):
             if proxies:
                 proxy = next(proxies)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
+                passed, proxy = check_proxy_twython(proxy['proxy'], 5, API_URL)
                 if not passed:
                     logger.warn('proxy failed, retry next one')
                     continue
@@ -1087,7 +1258,7 @@ def search_by_city_worker(search_config, now, output_folder, available, apikey_p
                     logger.info('[%s] is alive' %proxy)
                 client_args['proxies'] = proxy['proxy_dict']
 
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder, oauth2 = False)
+            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder, oauth2 = False, rate_limits = rate_limits)
             retry = twitterCralwer.fetch_geo(query = search_config, now = now)
             logger.info("retry: %s"%(retry))
     # except StopIteration as exc:
@@ -1102,8 +1273,8 @@ def collect_geo_info(cities_config_name = [], output_folder = None, config = Non
     logger.info("main runs in PID: [%s]"%os.getpid())
     #Apikeys and proxy part
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
-    max_workers = len(available_apikey_proxy_pairs)
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
+    max_workers = len(apikey_proxy_pairs_dict)
 
     citynames = cities_config_name
 
@@ -1120,17 +1291,12 @@ def collect_geo_info(cities_config_name = [], output_folder = None, config = Non
         try:
             for city in citynames:
 
-                while(len(available_apikey_proxy_pairs) == 0):
-                    logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                    time.sleep(WAIT_TIME)
 
                 now = datetime.datetime.now()
 
-                logger.info("1 %s" %available_apikey_proxy_pairs)
-
-                future_ = executor.submit(search_by_city_worker, city, now, output_folder, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                future_ = executor.submit(search_by_city_worker, city, now, output_folder, scheduler.acquire('/geo/search'), apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                future_.add_done_callback(functools.partial(search_by_city_worker_done, output_folder=output_folder, now = now, search_configs_filename = 'city_name.json', available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                future_.add_done_callback(functools.partial(search_by_city_worker_done, output_folder=output_folder, now = now, search_configs_filename = 'city_name.json', scheduler=scheduler))
 #def search_by_city_worker_done(future, output_folder=None, now = None, search_config_id = None, search_configs = None, search_configs_filename = None, available_apikey_proxy_pairs = []):
 
                 futures_.append(future_)
@@ -1163,52 +1329,65 @@ def collect_geo (input_filename, output_folder, config, n_workers = mp.cpu_count
     # with open(os.path.abspath(search_configs_filename), 'w') as search_configs_wf:
     #     json.dump(search_configs, search_configs_wf)
 
-def fetch_tweets_by_ids_done(future, now=None, available_apikey_proxy_pairs = []):
+def fetch_tweets_by_ids_done(future, now=None, start = None, probed = 0, watermark = None, tweets_config = None, tweets_config_filename = None, futures_ = None, available = None, scheduler = None):
 
-    available, tweet_config = future.result()
+    try:
+        try:
+            available, cnt = future.result()
+        except Exception as exc:
+            # e.g., BrokenProcessPool: the lookup at start never happened
+            logger.error('[%d] %s'%(start, exc))
+            watermark.fail(exc)
+            return
 
-    logger.info('finished... [%s]'%available)
-    available_apikey_proxy_pairs.append(available)
+        if cnt is None:
+            # retries exhausted, the crawler couldn't be built, or a lost key worker task (see key_workers.py): only a real response moves the watermark
+            watermark.fail(MaxRetryReached('the lookup at [%d] failed'%start))
+            return
 
+        tweets_config['probed'] = tweets_config.get('probed', 0) + probed
+        tweets_config['hits'] = tweets_config.get('hits', 0) + cnt
 
-def fetch_tweets_by_ids_worker(tweets_id, now, current_point, output_folder, tweet_config, available, apikey_proxy_pairs_dict):
+        # current_id only moves past contiguous finished lookups, so a restart never skips ids
+        if watermark.done(start):
+            save_tweets_config(tweets_config, tweets_config_filename, watermark.current)
+    finally:
+        logger.info('finished... [%s]'%available)
+        scheduler.release(available)
 
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+        futures_.discard(future)
 
-    apikeys = copy.copy(apikey_proxy_pairs_dict[available]['apikeys'])
-    proxies = copy.copy(apikey_proxy_pairs_dict[available]['proxies'])
+def save_tweets_config(tweets_config, tweets_config_filename, current_id):
 
-    proxies = iter(proxies) if proxies else None
+    tweets_config['current_id'] = current_id
 
-    client_args = {"timeout": 30}
+    tmp_filename = '%s.tmp'%os.path.abspath(tweets_config_filename)
+    with open(tmp_filename, 'w') as tweets_config_wf:
+        json.dump(tweets_config, tweets_config_wf)
 
-    retry = True
-    try:
-        while(retry):
+    os.replace(tmp_filename, os.path.abspath(tweets_config_filename))
 
-            if proxies:
-                proxy = next(proxies)
-                passed, proxy = check_proxy_twython(proxy['proxy'], 5)
-                if not passed:
-                    logger.warn('proxy failed, retry next one')
-                    continue
-                else:
-                    logger.info('[%s] is alive' %proxy)
-                client_args['proxies'] = proxy['proxy_dict']
-            twitterCralwer = TwitterCrawler(apikeys=apikeys, client_args=client_args, output_folder = output_folder)
-            retry = twitterCralwer.lookup_tweets_by_ids(tweets_id, now=now)
 
-    # except StopIteration as exc:
-    #     pass
+def fetch_tweets_by_ids_task(twitterCralwer, tweets_id, now):
+
+    return twitterCralwer.lookup_tweets_by_ids(tweets_id, now=now)
+
+def fetch_tweets_by_ids_worker(tweets_id, now, output_folder, available, apikey_proxy_pairs_dict, rate_limits = None):
+
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # None: the ids were not looked up, same as a failed task of a key worker
+    cnt = None
+    try:
+        twitterCralwer = build_crawler(available, apikey_proxy_pairs_dict, output_folder, timeout = 30, rate_limits = rate_limits)
+        cnt = fetch_tweets_by_ids_task(twitterCralwer, tweets_id, now)
     except Exception as exc:
         logger.error(exc)
         pass
 
-    tweet_config["current_id"] = current_point
-
-    return available, tweet_config
+    return available, cnt
 
 def chunks(l, n):
     """ Yield successive n-sized chunks from l """
@@ -1220,9 +1399,9 @@ def collect_tweets_by_ids(tweets_config_filename, output_folder, config, n_worke
 
     apikey_proxy_pairs_dict = apikey_proxy_pairs(config['apikeys'], proxies)
 
-    available_apikey_proxy_pairs = list(apikey_proxy_pairs_dict.keys())
+    scheduler = QuotaScheduler(apikey_proxy_pairs_dict, wait_time = WAIT_TIME)
 
-    max_workers = len(available_apikey_proxy_pairs)
+    max_workers = len(apikey_proxy_pairs_dict)
     #logger.info(max_workers)
 
     #max_workers = mp.cpu_count() if max_workers > mp.cpu_count() else max_workers
@@ -1236,45 +1415,54 @@ def collect_tweets_by_ids(tweets_config_filename, output_folder, config, n_worke
     logger.info("concurrent workers: [%d]"%(max_workers))
     # logger.info(max_workers)⁄
 
-    futures_ = []
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    # a sliding window instead of waves: a lookup is submitted as soon as any key is free, but never more than HISTORY_WINDOW lookups past the watermark
+    window = HISTORY_WINDOW * max_workers
+    watermark = LowWatermark(tweets_config['current_id'], tweets_config['range'])
+
+    # with a snowflake entry, current_id and end index the plausible ids of a time window (see snowflake.py) instead of raw ids
+    space = CandidateSpace.from_config(tweets_config['snowflake']) if tweets_config.get('snowflake') else None
+    end = tweets_config.get('end', len(space) - 1) if space else tweets_config['end']
+
+    futures_ = set()
+    with create_executor(max_workers, scheduler, apikey_proxy_pairs_dict, output_folder) as executor:
         try:
             current_id = tweets_config['current_id']
 
-            while(current_id <= tweets_config['end']):
-
-                next_point = current_id + max_workers * tweets_config['range']
-                tweet_ids = list(chunks(range(current_id, next_point), tweets_config['range']))
-                current_id = next_point
-                #logger.info(tweet_ids)
-                for tweets_id in tweet_ids:
+            while(current_id <= end):
 
-                    #logger.info(tweets_id)
+                # raises the error of a failed lookup: the watermark can't move past it, the sweep stops there instead of waiting for good
+                while not watermark.wait_for(current_id, window, WAIT_TIME):
+                    logger.info("lookups past [%d] are %d windows ahead, waiting for it"%(watermark.current, HISTORY_WINDOW))
 
-                    while(len(available_apikey_proxy_pairs) == 0):
-                        logger.info('no available_apikey_proxy_pairs, wait for %ds to retry...'%WAIT_TIME)
-                        time.sleep(WAIT_TIME)
+                next_point = current_id + tweets_config['range']
+                tweets_id = space.ids(current_id, min(next_point, end + 1)) if space else range(current_id, next_point)
 
-                    now = datetime.datetime.now()
+                now = datetime.datetime.now()
+                available = scheduler.acquire('/statuses/lookup')
+                if KEY_WORKERS:
+                    future_ = executor.submit(available, fetch_tweets_by_ids_task, tweets_id, now)
+                else:
                     future_ = executor.submit(
-                                fetch_tweets_by_ids_worker, tweets_id, now, next_point, output_folder, tweets_config, available_apikey_proxy_pairs.pop(), apikey_proxy_pairs_dict)
+                                fetch_tweets_by_ids_worker, tweets_id, now, output_folder, available, apikey_proxy_pairs_dict, scheduler.rate_limits)
 
-                    future_.add_done_callback(functools.partial(fetch_tweets_by_ids_done, now=now, available_apikey_proxy_pairs=available_apikey_proxy_pairs))
+                futures_.add(future_)
+                future_.add_done_callback(functools.partial(fetch_tweets_by_ids_done, now=now, start=current_id, probed=len(tweets_id), watermark=watermark, tweets_config=tweets_config, tweets_config_filename=tweets_config_filename, futures_=futures_, available=available, scheduler=scheduler))
 
-                    futures_.append(future_)
+                current_id = next_point
 
-                concurrent.futures.wait(futures_)
-                tweets_config['current_id'] = current_id
+            concurrent.futures.wait(list(futures_))
+            save_tweets_config(tweets_config, tweets_config_filename, watermark.current)
 
-                with open(os.path.abspath(tweets_config_filename), 'w') as tweets_config_wf:
-                    json.dump(tweets_config, tweets_config_wf)
+            if watermark.error is not None:
+                raise watermark.error
 
-                futures_ = []
+            logger.info('probed: %d; hits: %d; hit rate: %.4f'%(tweets_config.get('probed', 0), tweets_config.get('hits', 0), hit_rate(tweets_config)))
 
         except KeyboardInterrupt:
             logger.warn('You pressed Ctrl+C! But we will wait until all sub processes are finished...')
-            concurrent.futures.wait(futures_)
+            concurrent.futures.wait(list(futures_))
             executor.shutdown()
+            save_tweets_config(tweets_config, tweets_config_filename, watermark.current)
             raise
 
 
@@ -1293,6 +1481,14 @@ if __name__=="__main__":
     parser.add_argument('-l','--level', help = "typing a int to indicate how many layer of retweets you want to fetch", type = int, default = 3)
     parser.add_argument('-w','--workers', help="number of workers (will only be effective if it's smaller than the number of proxies avaliable)", type=int, default=8)
     parser.add_argument('-wait','--wait_time', help="wait time to check available api keys", type=int, default=30)
+    parser.add_argument('-f','--format', help="output format: %s (gzip/zstd are written as size-rotated segments, see output_writer.py)"%(', '.join(OUTPUT_FORMATS)), choices=OUTPUT_FORMATS, default='json')
+    parser.add_argument('-rf','--relationships_format', help="output of /friends/ids and /followers/ids: json (the -f format) or edges (a binary edge store, see edge_store.py)", choices=['json', 'edges'], default=RELATIONSHIPS_FORMAT)
+    parser.add_argument('-rd','--relationships_diff', help="folder of the follower/friend histories (see relationship_diff.py): /friends/ids and /followers/ids (not -rf edges) only keep the ids added and removed since the last crawl of a user", default=None)
+    parser.add_argument('-ss','--segment_size', help="segment size in MB for compressed output", type=int, default=SEGMENT_SIZE // (1024 * 1024))
+    parser.add_argument('-si','--segment_interval', help="also rotate a compressed segment after this many seconds (0: by size only)", type=int, default=0)
+    parser.add_argument('-tc','--token_cache', help="folder of the bearer token cache shared by all workers", default=TOKEN_CACHE_FOLDER)
+    parser.add_argument('-api','--api_url', help="base url of the api, e.g., a fake_twitter.py server (default: twitter)", default=None)
+    parser.add_argument('-kw','--key_workers', help="keep one long-lived worker process (and crawler) per api key, instead of a new one per request", action="store_true")
 
     args = parser.parse_args()
 
@@ -1300,6 +1496,14 @@ if __name__=="__main__":
         raise MissingArgs('command is missing')
 
     WAIT_TIME = args.wait_time
+    OUTPUT_FORMAT = args.format
+    RELATIONSHIPS_FORMAT = args.relationships_format
+    RELATIONSHIPS_DIFF = args.relationships_diff
+    SEGMENT_SIZE = args.segment_size * 1024 * 1024
+    SEGMENT_INTERVAL = args.segment_interval if args.segment_interval > 0 else None
+    TOKEN_CACHE_FOLDER = args.token_cache
+    KEY_WORKERS = args.key_workers
+    API_URL = args.api_url
 
     with open(os.path.abspath(args.config), 'r') as config_f:
         config = json.load(config_f)
@@ -1309,7 +1513,7 @@ if __name__=="__main__":
             proxies = []
             if args.proxies:
                 with open(os.path.abspath(args.proxies), 'r') as proxy_f:
-                    proxies = proxy_checker(json.load(proxy_f))
+                    proxies = proxy_checker(json.load(proxy_f), API_URL)
                     logger.info("there are [%d] live proxies"%len(proxies))
 
             retry = True
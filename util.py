@@ -33,3 +33,9 @@ def chunks(l, n):
     """
     for i in range(0, len(l), n):
         yield l[i:i+n]
+
+import re
+def search_querystring(terms):
+    """ The /search/tweets query of terms (ORed); a term is only put in parentheses if it needs them, i.e., it has more than one word outside of quotes (a quoted phrase or a single word doesn't, and every pair saves 6 characters of the 500 a query can have, url-encoded).
+    """
+    return ' OR '.join(term if len(re.sub(r'"[^"]*"', 'x', term).split()) <= 1 else '(' + term + ')' for term in terms)